@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Micro-benchmark of parsing .sym files into symbol tables.
+
+It compares the old way of parsing (decode every line and run a regex on
+it) with the byte parser in tecken/symbolicate/parser.py and prints how
+many lines per second each manages.
+
+Give it paths to .sym files or to .zip files (every .sym file in them is
+used). For example:
+
+    $ ./bin/benchmark-sym-parser.py ~/Downloads/xul.sym tests/sample.zip
+
+Since it imports tecken, it needs to be run where Django can start, e.g.
+in ``docker-compose run web``.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tecken.symbolicate.parser import parse_symbol_table  # noqa
+from tecken.symbolicate.symboltable import SymbolTable  # noqa
+
+
+def regex_parse(lines):
+    """The way tecken.symbolicate.views.SymbolicateJSON.load_symbol used
+    to parse a .sym file."""
+    starts_regex = re.compile(r'^(FUNC|PUBLIC) (m )?')
+    public_symbols = {}
+    func_symbols = {}
+    for line in lines:
+        line = line.decode('utf-8')
+        try:
+            found, = starts_regex.findall(line)
+            prefix = found[0]
+        except ValueError:
+            continue
+        rest = starts_regex.sub('', line)
+        if prefix == 'PUBLIC':
+            fields = rest.strip().split(None, 2)
+            if len(fields) != 3:
+                continue
+            public_symbols[int(fields[0], 16)] = fields[2]
+        elif prefix == 'FUNC':
+            fields = rest.strip().split(None, 3)
+            if len(fields) != 4:
+                continue
+            func_symbols[int(fields[0], 16)] = fields[3]
+    func_symbols.update(public_symbols)
+    return SymbolTable.from_symbol_map(func_symbols)
+
+
+def byte_parse(lines):
+    symbol_table, _ = parse_symbol_table(lines)
+    return symbol_table
+
+
+def iter_sym_files(paths):
+    for path in paths:
+        if path.lower().endswith('.zip'):
+            with zipfile.ZipFile(path) as zf:
+                for name in zf.namelist():
+                    if name.lower().endswith('.sym'):
+                        yield name, zf.read(name)
+        else:
+            with open(path, 'rb') as f:
+                yield path, f.read()
+
+
+def measure(function, lines, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        symbol_table = function(lines)
+        t1 = time.perf_counter()
+        if best is None or t1 - t0 < best:
+            best = t1 - t0
+    return best, symbol_table
+
+
+def run(paths, repeat):
+    parsers = (('regex', regex_parse), ('bytes', byte_parse))
+    for name, content in iter_sym_files(paths):
+        lines = content.splitlines()
+        print(name)
+        print(
+            '  {:,} lines, {:,} bytes'.format(len(lines), len(content))
+        )
+        results = {}
+        for parser_name, function in parsers:
+            took, symbol_table = measure(function, lines, repeat)
+            results[parser_name] = (took, symbol_table)
+            print('  {:<8}{:>15,.0f} lines/sec ({:.4f}s, {:,} offsets)'.format(
+                parser_name,
+                len(lines) / max(took, 1e-9),
+                took,
+                len(symbol_table),
+            ))
+        if results['regex'][1].buffer != results['bytes'][1].buffer:
+            print('  WARNING! The two symbol tables are not identical.')
+        print('  {:.1f}x faster'.format(
+            results['regex'][0] / max(results['bytes'][0], 1e-9)
+        ))
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        'paths',
+        nargs='*',
+        help='.sym or .zip files (default: tests/sample.zip)',
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='number of times to parse each file (best time is used)',
+    )
+    args = parser.parse_args()
+    paths = args.paths or [os.path.join(ROOT, 'tests', 'sample.zip')]
+    return run(paths, args.repeat)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,6 +7,8 @@ set -eo pipefail
 : "${TRIES:=60}"
 : "${GUNICORN_WORKERS:=4}"
 : "${GUNICORN_TIMEOUT:=300}"
+: "${GUNICORN_WORKER_CLASS:=sync}"
+: "${GUNICORN_THREADS:=1}"
 
 usage() {
   echo "usage: ./bin/run.sh web|web-dev|worker|test|bash|superuser"
@@ -38,7 +40,7 @@ case $1 in
     ${CMD_PREFIX_PYTHON:-python} manage.py migrate --noinput
     ;;
   web)
-    ${CMD_PREFIX} gunicorn tecken.wsgi:application -b 0.0.0.0:${PORT} --timeout ${GUNICORN_TIMEOUT} --workers ${GUNICORN_WORKERS} --access-logfile -
+    ${CMD_PREFIX} gunicorn tecken.wsgi:application -b 0.0.0.0:${PORT} --timeout ${GUNICORN_TIMEOUT} --workers ${GUNICORN_WORKERS} --worker-class ${GUNICORN_WORKER_CLASS} --threads ${GUNICORN_THREADS} --access-logfile -
     ;;
   web-dev)
     python manage.py migrate --noinput
@@ -91,6 +91,21 @@ class PaginationForm(forms.Form):
         return value
 
 
+class HotModulesForm(forms.Form):
+    limit = forms.IntegerField(required=False, min_value=1, max_value=1000)
+    days = forms.IntegerField(required=False, min_value=1, max_value=30)
+
+    def clean_limit(self):
+        return self.cleaned_data['limit'] or 100
+
+
+class StoreAccountingForm(forms.Form):
+    limit = forms.IntegerField(required=False, min_value=1, max_value=1000)
+
+    def clean_limit(self):
+        return self.cleaned_data['limit'] or 100
+
+
 class BaseFilteringForm(forms.Form):
 
     sort = forms.CharField(required=False)
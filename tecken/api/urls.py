@@ -32,6 +32,16 @@ urlpatterns = [
         views.stats_symbolication,
         name='stats_symbolication'
     ),
+    path(
+        'stats/symbolication/modules',
+        views.stats_symbolication_modules,
+        name='stats_symbolication_modules'
+    ),
+    path(
+        'stats/symbolication/store',
+        views.stats_symbolication_store,
+        name='stats_symbolication_store'
+    ),
     path(
         'tokens/',
         views.tokens,
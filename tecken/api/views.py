@@ -27,6 +27,8 @@ from django.core.cache import cache
 from tecken.tokens.models import Token
 from tecken.upload.models import Upload, FileUpload
 from tecken.download.models import MissingSymbol, MicrosoftDownload
+from tecken.symbolicate.accounting import get_store_accounting
+from tecken.symbolicate.popularity import get_hot_modules
 from tecken.symbolicate.views import get_symbolication_count_key
 from tecken.base.decorators import (
     api_login_required,
@@ -899,6 +901,43 @@ def stats_symbolication(request):
     return http.JsonResponse(context)
 
 
+@api_login_required
+def stats_symbolication_modules(request):
+    """Return the most symbolicated modules, most popular first, over the
+    last few days."""
+    form = forms.HotModulesForm(request.GET)
+    if not form.is_valid():
+        return http.JsonResponse({'errors': form.errors}, status=400)
+    days = form.cleaned_data['days'] or settings.SYMBOLICATE_POPULARITY_DAYS
+    hot_modules = get_hot_modules(form.cleaned_data['limit'], days=days)
+    context = {
+        'days': days,
+        'modules': [
+            {
+                'symbol': symbol,
+                'debugid': debugid,
+                'count': count,
+            }
+            for (symbol, debugid), count in hot_modules
+        ]
+    }
+    return http.JsonResponse(context)
+
+
+@api_login_required
+@api_superuser_required
+def stats_symbolication_store(request):
+    """Return the modules with the largest symbol tables and those whose
+    symbol tables have been stored the most times in the Redis store.
+    The latter are those that keep getting evicted (by the LRU) only to
+    be downloaded again."""
+    form = forms.StoreAccountingForm(request.GET)
+    if not form.is_valid():
+        return http.JsonResponse({'errors': form.errors}, status=400)
+    context = get_store_accounting(form.cleaned_data['limit'])
+    return http.JsonResponse(context)
+
+
 @api_login_required
 @api_superuser_required
 def current_settings(request):
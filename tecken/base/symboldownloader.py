@@ -2,9 +2,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, you can obtain one at http://mozilla.org/MPL/2.0/.
 
+import threading
 import time
-from io import BytesIO
-from gzip import GzipFile
+import zlib
 from functools import wraps
 
 import logging
@@ -22,6 +22,9 @@ logger = logging.getLogger('tecken')
 metrics = markus.get_metrics('tecken')
 
 ITER_CHUNK_SIZE = 512
+# How many compressed bytes to read, at a time, from a gzipped stream.
+GZIP_CHUNK_SIZE = 64 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
 
 
 class SymbolNotFound(Exception):
@@ -63,6 +66,76 @@ def iter_lines(stream, chunk_size=ITER_CHUNK_SIZE):
         yield pending
 
 
+class GzipStreamReader:
+    """File-like (i.e. it has a read() method) wrapper of a stream of
+    gzipped bytes that decompresses them as they're read.
+
+    Unlike GzipFile, the stream doesn't need to be seekable so it doesn't
+    have to be downloaded, in full, into memory first. Only a chunk of
+    compressed bytes, and what they decompress to, is held at a time.
+    Like GzipFile, it accepts concatenated members and NUL padding after
+    them, raises an OSError if it's not gzipped at all and an EOFError if
+    it's truncated.
+    """
+
+    def __init__(self, stream, chunk_size=GZIP_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self._decompressor = None
+        self._buffer = bytearray()
+        self._eof = False
+        self._after_member = False
+
+    def _decompress(self, data):
+        while data:
+            if self._decompressor is None:
+                if self._after_member:
+                    # Like GzipFile, ignore the NUL padding that is
+                    # allowed after a member.
+                    data = data.lstrip(b'\x00')
+                    if not data:
+                        break
+                if len(data) < len(GZIP_MAGIC):
+                    # So short it's not even a complete header. Read more.
+                    more = self.stream.read(self.chunk_size)
+                    if not more:
+                        break
+                    data += more
+                    continue
+                if not data.startswith(GZIP_MAGIC):
+                    raise OSError(f'Not a gzipped file ({data[:2]!r})')
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self._buffer += self._decompressor.decompress(data)
+            if not self._decompressor.eof:
+                return
+            # The end of a gzip member. Whatever's left over is the start
+            # of the next one (like GzipFile, multiple members are
+            # concatenated).
+            data = self._decompressor.unused_data
+            self._decompressor = None
+            self._after_member = True
+        if data and self._decompressor is None:
+            raise OSError(f'Not a gzipped file ({data[:2]!r})')
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self.stream.read(self.chunk_size)
+            if not chunk:
+                self._eof = True
+                if self._decompressor is not None:
+                    raise EOFError(
+                        'Compressed file ended before the end-of-stream '
+                        'marker was reached'
+                    )
+                break
+            self._decompress(chunk)
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
 def set_time_took(method):
 
     @wraps(method)
@@ -166,6 +239,7 @@ class SymbolDownloader:
     def __init__(self, urls, file_prefix=settings.SYMBOL_FILE_PREFIX):
         self.urls = urls
         self._sources = None
+        self._sources_lock = threading.Lock()
         self.file_prefix = file_prefix
 
     def __repr__(self):
@@ -181,7 +255,12 @@ class SymbolDownloader:
     @property
     def sources(self):
         if self._sources is None:
-            self._sources = list(self._get_sources())
+            # The downloader is shared by all threads in the process so
+            # make sure they all end up using the same sources (and thus
+            # the same S3 clients and their connection pools).
+            with self._sources_lock:
+                if self._sources is None:
+                    self._sources = list(self._get_sources())
         return self._sources
 
     def invalidate_cache(self, symbol, debugid, filename):
@@ -273,7 +352,7 @@ class SymbolDownloader:
                 if check_url_head(file_url, _refresh=refresh_cache):
                     return {'url': file_url, 'source': source}
 
-    def _get_stream(self, symbol, debugid, filename):
+    def _get_stream(self, symbol, debugid, filename, decode=True):
         for source in self.sources:
 
             prefix = source.prefix
@@ -302,14 +381,16 @@ class SymbolDownloader:
                     )
                     stream = response['Body']
                     # But if the content encoding is gzip we have
-                    # re-wrap the stream.
+                    # re-wrap the stream. It's decompressed as it's
+                    # downloaded.
                     if response.get('ContentEncoding') == 'gzip':
-                        bytestream = BytesIO(response['Body'].read())
-                        stream = GzipFile(None, 'rb', fileobj=bytestream)
+                        stream = GzipStreamReader(stream)
                     yield (source.name, key)
                     try:
                         for line in iter_lines(stream):
-                            yield line.decode('utf-8')
+                            if decode:
+                                line = line.decode('utf-8')
+                            yield line
                         return
                     except OSError as exception:
                         if 'Not a gzipped file' in str(exception):
@@ -368,7 +449,8 @@ class SymbolDownloader:
                         for line in response.iter_lines():
                             # filter out keep-alive newlines
                             if line:
-                                line = line.decode('utf-8')
+                                if decode:
+                                    line = line.decode('utf-8')
                                 yield line
                         # Stop the iterator
                         return
@@ -426,9 +508,11 @@ class SymbolDownloader:
                 # ExpiresIn=3600
             )
 
-    def get_symbol_stream(self, symbol, debugid, filename):
+    def get_symbol_stream(self, symbol, debugid, filename, decode=True):
         """return a body stream for download if the file can be found.
         The object is a regular Python generator.
         The first item in the generator is always the URL or the
-        (bucketname, objectkey) tuple if found."""
-        return self._get_stream(symbol, debugid, filename)
+        (bucketname, objectkey) tuple if found.
+        If 'decode' is false, the lines are yielded as bytes instead of
+        strings."""
+        return self._get_stream(symbol, debugid, filename, decode=decode)
@@ -0,0 +1,350 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+
+from redis.client import BasePipeline, StrictRedis
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tecken.base.symboldownloader import SymbolDownloader, SymbolNotFound
+from tecken.symbolicate.invalidation import invalidation_poller
+from tecken.symbolicate.utils import invalidate_symbolicate_cache
+from tecken.symbolicate.views import SymbolicateJSON
+
+
+MODES = ('cold', 'warm', 'mixed')
+
+
+class LocalSymbolDownloader(SymbolDownloader):
+    """Instead of S3, reads the symbol files from a local directory, or
+    .zip file, laid out like the symbols bucket. E.g.
+    'xul.pdb/44E4EC8C2F41492B9369D6B9A059577C2/xul.sym'."""
+
+    def __init__(self, path):
+        super().__init__([])
+        self.path = path
+        self.files = None
+        if zipfile.is_zipfile(path):
+            # Read once, up front, so the disk isn't part of what's
+            # measured and so the threads don't share a ZipFile.
+            with zipfile.ZipFile(path) as zf:
+                self.files = {
+                    name: zf.read(name) for name in zf.namelist()
+                }
+
+    def _read(self, key):
+        if self.files is not None:
+            return self.files.get(key)
+        try:
+            with open(os.path.join(self.path, key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get_symbol_stream(self, symbol, debugid, filename, decode=True):
+        key = f'{symbol}/{debugid.upper()}/{filename}'
+        content = self._read(key)
+        if content is None:
+            raise SymbolNotFound(symbol, debugid, filename)
+        yield key
+        for line in content.splitlines():
+            yield line.decode('utf-8') if decode else line
+
+
+class RoundTripCounter:
+    """Counts every command, or pipeline, sent to any Redis server.
+    Each is one network round-trip.
+
+    Except those of the InvalidationPoller. It polls at most once per
+    settings.SYMBOLICATE_INVALIDATION_POLL_SECONDS, no matter how many
+    requests there are, so it would only make the count depend on how
+    long the benchmark took."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        self._ignored = threading.local()
+
+    def increment(self):
+        if getattr(self._ignored, 'value', False):
+            return
+        with self._lock:
+            self.count += 1
+
+    @contextmanager
+    def ignoring(self):
+        """Don't count anything sent by this thread."""
+        self._ignored.value = True
+        try:
+            yield
+        finally:
+            self._ignored.value = False
+
+    @contextmanager
+    def counting(self):
+        original_execute_command = StrictRedis.execute_command
+        original_execute = BasePipeline.execute
+        original_poll = invalidation_poller.poll
+        counter = self
+
+        def execute_command(self, *args, **options):
+            counter.increment()
+            return original_execute_command(self, *args, **options)
+
+        def execute(self, *args, **kwargs):
+            counter.increment()
+            return original_execute(self, *args, **kwargs)
+
+        def poll():
+            with counter.ignoring():
+                return original_poll()
+
+        # Note that pipelines override execute_command() so the commands
+        # queued in a pipeline aren't counted individually.
+        StrictRedis.execute_command = execute_command
+        BasePipeline.execute = execute
+        invalidation_poller.poll = poll
+        try:
+            yield self
+        finally:
+            StrictRedis.execute_command = original_execute_command
+            BasePipeline.execute = original_execute
+            del invalidation_poller.poll
+
+
+def iter_payload_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(('.json', '.jsonl')):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def load_payloads(paths):
+    """Return a list of payloads, each a list of jobs, each a tuple of
+    (stacks, memory map). A payload is whatever was (or would have been)
+    POSTed to /symbolicate/v4 or /symbolicate/v5. Files ending in .jsonl
+    are expected to have one payload per line. Other files have one
+    payload, or a list of payloads."""
+    payloads = []
+    for path in iter_payload_files(paths):
+        with open(path) as f:
+            if path.endswith('.jsonl'):
+                bodies = [json.loads(line) for line in f if line.strip()]
+            else:
+                bodies = json.load(f)
+                if not isinstance(bodies, list):
+                    bodies = [bodies]
+        for body in bodies:
+            if 'jobs' not in body:
+                # Version 4, or a single version 5 job.
+                body = {'jobs': [body]}
+            payloads.append([
+                (job['stacks'], job['memoryMap']) for job in body['jobs']
+            ])
+    return payloads
+
+
+def get_symbol_keys(payload):
+    return {
+        tuple(module)
+        for _, memory_map in payload
+        for module in memory_map
+    }
+
+
+def count_frames(payload):
+    return sum(
+        len(stack)
+        for stacks, _ in payload
+        for stack in stacks
+    )
+
+
+def percentile(sorted_numbers, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_numbers:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(sorted_numbers)))
+    return sorted_numbers[rank - 1]
+
+
+def get_peak_rss():
+    """Return the peak resident set size, in bytes, of this process."""
+    # On Linux, it's in kilobytes.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL,
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = """Replay recorded symbolication payloads against SymbolicateJSON
+    and report latency percentiles, frames/sec, Redis round-trips and peak
+    RSS for cold, warm and mixed cache states.
+
+    Symbol files are read from a local directory, or .zip file, instead
+    of S3. The caches are the configured ones, so point
+    DJANGO_REDIS_STORE_URL at a local, throwaway, Redis. Note that the
+    symbols of the replayed payloads are invalidated from it.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'payloads',
+            nargs='+',
+            help='.json or .jsonl files, or directories of them',
+        )
+        parser.add_argument(
+            '--symbols',
+            required=True,
+            help='directory or .zip file of symbol files',
+        )
+        parser.add_argument(
+            '--mode',
+            action='append',
+            choices=MODES,
+            help='cache state(s) to measure (default: all of them)',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=1,
+            help='number of times to replay all the payloads per mode',
+        )
+        parser.add_argument(
+            '--cold-ratio',
+            type=float,
+            default=0.2,
+            help='in mixed mode, share of payloads replayed with cold caches',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='random seed for the mixed mode',
+        )
+        parser.add_argument(
+            '--output',
+            help='file to save the results in, as JSON',
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['symbols']):
+            raise CommandError(f'{options["symbols"]} does not exist')
+        payloads = load_payloads(options['payloads'])
+        if not payloads:
+            raise CommandError('No payloads found')
+        downloader = LocalSymbolDownloader(options['symbols'])
+
+        results = {
+            'commit': get_git_commit(),
+            'payloads': len(payloads),
+            'iterations': options['iterations'],
+            'modes': {},
+        }
+        for mode in options['mode'] or MODES:
+            results['modes'][mode] = self.run(
+                mode,
+                payloads,
+                downloader,
+                options['iterations'],
+                random.Random(options['seed']),
+                options['cold_ratio'],
+            )
+            self.report(mode, results['modes'][mode])
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write(f'Results saved in {options["output"]}')
+
+    def run(self, mode, payloads, downloader, iterations, rng, cold_ratio):
+        all_symbol_keys = set()
+        for payload in payloads:
+            all_symbol_keys.update(get_symbol_keys(payload))
+        invalidate_symbolicate_cache(all_symbol_keys)
+        if mode != 'cold':
+            # Warm up, without measuring.
+            for payload in payloads:
+                SymbolicateJSON(downloader).symbolicate_many(payload)
+
+        latencies = []
+        frames = 0
+        counter = RoundTripCounter()
+        for _ in range(iterations):
+            for payload in payloads:
+                if mode == 'cold' or (
+                    mode == 'mixed' and rng.random() < cold_ratio
+                ):
+                    invalidate_symbolicate_cache(get_symbol_keys(payload))
+                with counter.counting():
+                    t0 = time.perf_counter()
+                    SymbolicateJSON(downloader).symbolicate_many(payload)
+                    t1 = time.perf_counter()
+                latencies.append(t1 - t0)
+                frames += count_frames(payload)
+
+        latencies.sort()
+        total_time = sum(latencies)
+        return {
+            'requests': len(latencies),
+            'frames': frames,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'frames_per_second': frames / total_time if total_time else None,
+            'round_trips': counter.count,
+            'round_trips_per_request': counter.count / len(latencies),
+            # Note, this is the peak of the whole process so far, not
+            # just this mode.
+            'peak_rss': get_peak_rss(),
+        }
+
+    def report(self, mode, result):
+        self.stdout.write(self.style.SUCCESS(mode.upper()))
+        self.stdout.write(
+            '  {:,} requests, {:,} frames'.format(
+                result['requests'],
+                result['frames'],
+            )
+        )
+        self.stdout.write(
+            '  p50 {:.2f}ms  p95 {:.2f}ms  p99 {:.2f}ms'.format(
+                result['p50'] * 1000,
+                result['p95'] * 1000,
+                result['p99'] * 1000,
+            )
+        )
+        self.stdout.write(
+            '  {:,.0f} frames/sec'.format(result['frames_per_second'] or 0)
+        )
+        self.stdout.write(
+            '  {:,} Redis round-trips ({:.1f} per request)'.format(
+                result['round_trips'],
+                result['round_trips_per_request'],
+            )
+        )
+        self.stdout.write(
+            '  peak RSS {:,.1f}MB'.format(result['peak_rss'] / 1024 / 1024)
+        )
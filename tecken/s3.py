@@ -3,6 +3,7 @@
 # file, you can obtain one at http://mozilla.org/MPL/2.0/.
 
 import re
+import threading
 from urllib.parse import urlparse
 
 import boto3
@@ -70,6 +71,8 @@ class S3Bucket:
 
         # This is only created if/when needed
         self._s3_client = None
+        # Web workers can have many threads sharing the same instance.
+        self._s3_client_lock = threading.Lock()
 
     @property
     def base_url(self):
@@ -90,10 +93,14 @@ class S3Bucket:
     def s3_client(self):
         """return a boto3 session client based on 'self'"""
         if not self._s3_client:
-            self._s3_client = get_s3_client(
-                endpoint_url=self.endpoint_url,
-                region_name=self.region,
-            )
+            # boto3 sessions are not thread-safe but the clients
+            # they create are. So make sure only one thread creates it.
+            with self._s3_client_lock:
+                if not self._s3_client:
+                    self._s3_client = get_s3_client(
+                        endpoint_url=self.endpoint_url,
+                        region_name=self.region,
+                    )
         return self._s3_client
 
     def get_s3_client(self, **config_params):
@@ -496,6 +496,188 @@ class Base(Core):
     # The value gets cached as an empty dict for one hour.
     SYMBOLS_GET_TIMEOUT = values.Value(5)
 
+    # Every web worker process keeps the most recently used symbol tables
+    # in memory, in front of the Redis store. This is the max. number of
+    # bytes, per process, that in-memory cache may use. The least recently
+    # used symbol tables are evicted first. Set to 0 to disable it.
+    SYMBOLICATE_MEMORY_CACHE_MAX_BYTES = values.IntegerValue(
+        256 * 1024 * 1024
+    )
+
+    # Invalidating symbols (e.g. when new symbols are uploaded) can only
+    # evict from the in-memory cache of the process that does the
+    # invalidation. So every symbol table in the in-memory cache also
+    # expires after this many seconds.
+    SYMBOLICATE_MEMORY_CACHE_TTL_SECONDS = values.IntegerValue(60 * 60)
+
+    # Every symbol table from the disk cache (see below) that is kept in
+    # the in-memory cache holds an open file. This is the max. number of
+    # them, per process, so that it stays well within the limit of open
+    # files. The least recently used ones are evicted first.
+    SYMBOLICATE_MEMORY_CACHE_MAX_OPEN_FILES = values.IntegerValue(256)
+
+    # Optionally, symbol tables can also be cached as files in this
+    # directory, between the in-memory cache and the Redis store. The
+    # files are memory mapped so all web worker processes on the same
+    # host share them through the page cache. Leave empty to disable it.
+    SYMBOLICATE_DISK_CACHE_DIR = values.Value('')
+
+    # The max. total number of bytes of all the files in the disk cache.
+    # The least recently used files are deleted first.
+    SYMBOLICATE_DISK_CACHE_MAX_BYTES = values.IntegerValue(
+        4 * 1024 * 1024 * 1024
+    )
+
+    # Like the in-memory cache, invalidation can only reach the disk
+    # cache of the host that does the invalidation. So every file also
+    # expires after this many seconds.
+    SYMBOLICATE_DISK_CACHE_TTL_SECONDS = values.IntegerValue(60 * 60)
+
+    # Every web worker process can also remember, for each module and
+    # offset, the function it resolved to. This is the max. number of
+    # frames, per process, it remembers. The least recently used are
+    # evicted first. Set to 0 to disable it.
+    SYMBOLICATE_FRAME_CACHE_MAX_ENTRIES = values.IntegerValue(0)
+
+    # Like the in-memory symbol table cache, invalidation can only reach
+    # the process that does the invalidation. So every remembered frame
+    # also expires after this many seconds.
+    SYMBOLICATE_FRAME_CACHE_TTL_SECONDS = values.IntegerValue(60 * 60)
+
+    # Invalidations (e.g. after a re-upload) are recorded in Redis (see
+    # SYMBOLICATE_STATS_CACHE) and every web worker process checks for
+    # new ones, and evicts them from its in-memory caches and its host's
+    # disk cache, at most this often. So, at worst, a process keeps using
+    # an invalidated symbol table for this many seconds.
+    SYMBOLICATE_INVALIDATION_POLL_SECONDS = values.FloatValue(5)
+
+    # When a symbolication request needs symbols that aren't in the cache,
+    # they're downloaded, parsed and stored concurrently. This is the max
+    # number of threads, per web worker process and shared by all its
+    # requests, doing that.
+    SYMBOLICATE_DOWNLOAD_MAX_WORKERS = values.IntegerValue(8)
+    # The max number of those threads any one request can use at a time.
+    # The rest of its downloads wait in line.
+    SYMBOLICATE_DOWNLOAD_MAX_WORKERS_PER_REQUEST = values.IntegerValue(4)
+
+    # The total amount of time a symbolication request is willing to wait
+    # for all its downloads. Those that haven't finished in time are
+    # treated as not found in that response but keep going in the
+    # background so they're stored for the next request.
+    SYMBOLICATE_DOWNLOAD_TIMEOUT_SECONDS = values.FloatValue(60)
+
+    # The total amount of time a symbolication request may take, e.g. to
+    # stay within the load balancer's timeout. Callers can lower it, per
+    # request, with a 'Symbolicate-Time-Budget' header. Whatever is still
+    # being downloaded when it runs out carries on in the background and
+    # those modules are reported as "pending". 0 means no limit, other
+    # than SYMBOLICATE_DOWNLOAD_TIMEOUT_SECONDS.
+    SYMBOLICATE_TIME_BUDGET_SECONDS = values.FloatValue(0)
+
+    # Parsing big symbol files is CPU bound and, in a thread, blocks every
+    # other thread of that web worker. If set, every web worker process
+    # starts a pool of this many processes that do the parsing instead.
+    # The downloads are written to temporary files, in this directory
+    # (default: the system's), for them to read.
+    SYMBOLICATE_PARSE_PROCESSES = values.IntegerValue(0)
+    SYMBOLICATE_PARSE_TEMP_DIR = values.Value('')
+    # If one of those processes dies while parsing a symbol file, or
+    # hasn't parsed it within this many seconds of starting, the web
+    # worker parses it itself. Other symbol files, being parsed or
+    # waiting in line for a process, are left alone.
+    SYMBOLICATE_PARSE_TIMEOUT_SECONDS = values.FloatValue(120)
+
+    # Where the symbol tables are stored, once downloaded and parsed. The
+    # dotted path to a tecken.symbolicate.storage.SymbolTableStore class
+    # and, for that backend, its location. For the Redis store, the name
+    # of the cache (default 'store'). For
+    # tecken.symbolicate.storage.FileSystemSymbolTableStore a directory
+    # and for tecken.symbolicate.storage.SQLiteSymbolTableStore the path
+    # to the database file.
+    SYMBOLICATE_STORE_BACKEND = values.Value(
+        'tecken.symbolicate.storage.RedisSymbolTableStore'
+    )
+    SYMBOLICATE_STORE_LOCATION = values.Value('')
+
+    # All the symbol tables needed for a symbolication request are read
+    # from the Redis store in one single pipeline (one network round-trip).
+    # Within that pipeline, the keys are split up into MGET commands of
+    # at most this many keys each.
+    SYMBOLICATE_STORE_PIPELINE_BATCH_SIZE = values.IntegerValue(100)
+
+    # Sending Redis one big command (empirically, around 9MB) makes it shut
+    # down the socket and redis-py raises a ConnectionError. So symbol
+    # tables, like xul.pdb's, bigger than this many bytes are written to
+    # the Redis store in pieces of (at most) this size.
+    SYMBOLICATE_STORE_WRITE_CHUNK_BYTES = values.IntegerValue(4 * 1024 * 1024)
+
+    # Symbol tables with more offsets than this are stored, in the Redis
+    # store, as pages of this many offsets plus a small index of the
+    # pages. That way, a web worker that doesn't have the symbol table
+    # in memory only needs to fetch the pages of the offsets it's looking
+    # up, not the whole thing. 0 means they're always stored whole.
+    SYMBOLICATE_STORE_PAGE_SIZE = values.IntegerValue(0)
+
+    # Symbolication keeps some statistics, in Redis, about the modules.
+    # E.g. how many requests needed them and how big their symbol tables
+    # are. This is the name of the cache (in CACHES), which has to be
+    # backed by Redis, where they are kept. It's deliberately not the
+    # 'store' so they survive the store being restarted or filling up.
+    SYMBOLICATE_STATS_CACHE = values.Value('default')
+
+    # The most popular modules, e.g. when pre-warming, are those with the
+    # most symbolication requests over this many days.
+    SYMBOLICATE_POPULARITY_DAYS = values.IntegerValue(7)
+
+    # After storing a symbol table, the Redis store's used memory is sent
+    # as a gauge. But, per process, at most once per this many seconds.
+    SYMBOLICATE_USED_MEMORY_GAUGE_INTERVAL_SECONDS = values.IntegerValue(60)
+
+    # When pre-warming the Redis store (e.g. after it's been restarted),
+    # the symbol tables of this many of the most popular modules are
+    # downloaded, unless they're already in the store...
+    SYMBOLICATE_PREWARM_TOP_N = values.IntegerValue(100)
+
+    # ...but stop once the symbol tables, of those modules, in the store
+    # add up to this many bytes.
+    SYMBOLICATE_PREWARM_MAX_BYTES = values.IntegerValue(
+        1024 * 1024 * 1024
+    )
+
+    # When many web workers need to download the same symbol file at the
+    # same time, only one of them does it while the others wait for it to
+    # be stored. That one holds a "lease" in Redis that expires after
+    # this many seconds in case it dies before finishing.
+    SYMBOLICATE_DOWNLOAD_LEASE_SECONDS = values.IntegerValue(5 * 60)
+
+    # How long the other web workers wait for it before they give up and
+    # download the symbol file themselves.
+    SYMBOLICATE_DOWNLOAD_LEASE_WAIT_SECONDS = values.FloatValue(60)
+
+    # When enabled, the symbolication (v5) response is streamed and each
+    # job's result is sent as soon as it's ready. That way, big batches
+    # don't need all of their results in memory at the same time.
+    ENABLE_SYMBOLICATE_STREAMING_RESPONSE = values.BooleanValue(False)
+
+    # Symbolication request bodies can be compressed (i.e. sent with
+    # 'Content-Encoding: gzip' or 'deflate'). This is the max. size, in
+    # bytes, of a body once it's been decompressed. Bigger ones get a 413.
+    SYMBOLICATE_MAX_REQUEST_BODY_SIZE = values.IntegerValue(
+        50 * 1024 * 1024
+    )
+
+    # When enabled, symbol files that are uploaded get their symbol
+    # tables built and stored in the Redis store, by a Celery task, right
+    # away. Instead of waiting for the first symbolication request that
+    # needs them to pay for downloading and parsing them.
+    ENABLE_SYMBOLICATE_PREBUILD = values.BooleanValue(False)
+
+    # The max number of symbol files that are allowed to be waiting to
+    # have their symbol tables built (see ENABLE_SYMBOLICATE_PREBUILD).
+    # Uploads that come in when it's full only get their symbols
+    # invalidated, like when the prebuilding is disabled.
+    SYMBOLICATE_PREBUILD_MAX_QUEUED = values.IntegerValue(1000)
+
     # Individual strings that can't be allowed in any of the lines in the
     # content of a symbols archive file.
     DISALLOWED_SYMBOLS_SNIPPETS = values.ListValue([
@@ -727,6 +909,9 @@ class Test(Localdev):
         }
         return parent
 
+    # The 'default' cache isn't Redis when testing.
+    SYMBOLICATE_STATS_CACHE = 'store'
+
     MARKUS_BACKENDS = [
         {
             'class': 'markus.backends.datadog.DatadogMetrics',
@@ -0,0 +1,121 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import threading
+import time
+
+import markus
+from django.conf import settings
+from django.core.cache import caches
+
+from .storage import get_symbol_table_store
+from .utils import get_stats_redis_connection, make_symbol_key_cache_key
+
+
+metrics = markus.get_metrics('tecken')
+
+# If a module isn't stored again for this long, it's forgotten.
+ACCOUNTING_TTL = datetime.timedelta(days=30)
+
+
+def get_sizes_key():
+    return caches[settings.SYMBOLICATE_STATS_CACHE].make_key(
+        'symbolicate:store:sizes'
+    )
+
+
+def get_loads_key():
+    return caches[settings.SYMBOLICATE_STATS_CACHE].make_key(
+        'symbolicate:store:loads'
+    )
+
+
+def record_symbol_table_stored(symbol_key, size):
+    """Remember how big this symbol table is, in the Redis store, and
+    count how many times it has been stored. Every time after the first
+    time, it's been reloaded because it had been evicted (or invalidated).
+    Return the number of times it has been stored."""
+    member = '/'.join(symbol_key)
+    pipeline = get_stats_redis_connection().pipeline(transaction=False)
+    pipeline.zadd(get_sizes_key(), size, member)
+    pipeline.zincrby(get_loads_key(), member, 1)
+    pipeline.expire(get_sizes_key(), ACCOUNTING_TTL)
+    pipeline.expire(get_loads_key(), ACCOUNTING_TTL)
+    _, loads, _, _ = pipeline.execute()
+    loads = int(loads)
+    if loads > 1:
+        metrics.incr('symbolicate_store_reload', 1)
+    return loads
+
+
+def get_store_accounting(limit):
+    """Return a dict with the 'limit' 'largest' and 'most_churned'
+    (i.e. most times stored) modules. For each, the size of its symbol
+    table, the number of times it's been stored and whether it's in the
+    store right now. Also the number of modules ('count') and the
+    total size of their symbol tables ('size'), as last stored."""
+    connection = get_stats_redis_connection()
+    pipeline = connection.pipeline(transaction=False)
+    pipeline.zrevrange(get_sizes_key(), 0, -1, withscores=True)
+    pipeline.zrevrange(get_loads_key(), 0, -1, withscores=True)
+    all_sizes, all_loads = pipeline.execute()
+    sizes = {member.decode('utf-8'): int(size) for member, size in all_sizes}
+    loads = {member.decode('utf-8'): int(count) for member, count in all_loads}
+    # Both were ranked by Redis, highest first, and dicts keep their order.
+    largest = list(sizes)[:limit]
+    most_churned = list(loads)[:limit]
+
+    # Whether they're still in the store, all at once.
+    members = list(set(largest) | set(most_churned))
+    sizes_stored = get_symbol_table_store().get_sizes([
+        # Module filenames might contain a '/' but debug IDs never do.
+        make_symbol_key_cache_key(tuple(member.rsplit('/', 1)))
+        for member in members
+    ])
+    stored = dict(zip(members, sizes_stored))
+
+    def serialize(member):
+        symbol, debugid = member.rsplit('/', 1)
+        return {
+            'symbol': symbol,
+            'debugid': debugid,
+            'size': sizes.get(member),
+            'loads': loads.get(member, 0),
+            'stored': bool(stored[member]),
+        }
+
+    return {
+        'count': len(sizes),
+        'size': sum(sizes.values()),
+        'largest': [serialize(member) for member in largest],
+        'most_churned': [serialize(member) for member in most_churned],
+    }
+
+
+class UsedMemoryGauge:
+    """Decides when it's time, again, to send the Redis store's used
+    memory as a gauge. At most once per
+    settings.SYMBOLICATE_USED_MEMORY_GAUGE_INTERVAL_SECONDS per process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last = None
+
+    def is_due(self):
+        """Return True, and assume it's going to be sent, if it's time."""
+        now = time.monotonic()
+        interval = settings.SYMBOLICATE_USED_MEMORY_GAUGE_INTERVAL_SECONDS
+        with self._lock:
+            if self._last is not None and now - self._last < interval:
+                return False
+            self._last = now
+            return True
+
+    def reset(self):
+        with self._lock:
+            self._last = None
+
+
+used_memory_gauge = UsedMemoryGauge()
@@ -0,0 +1,279 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import fcntl
+import logging
+import mmap
+import os
+import threading
+import time
+
+import markus
+
+from django.conf import settings
+
+from .files import (
+    TEMP_FILE_SUFFIX,
+    get_key_path,
+    is_locked,
+    remove_file,
+    write_file_atomically,
+)
+from .symboltable import InvalidSymbolTable, SymbolTable
+
+
+logger = logging.getLogger('tecken')
+metrics = markus.get_metrics('tecken')
+
+FILE_SUFFIX = '.symtab'
+
+# A temporary file that nobody is writing to and is older than this was
+# left behind by a process that died half-way through writing it.
+TEMP_FILE_GRACE_SECONDS = 60
+
+# Don't bother updating a file's access time, to mark it as recently
+# used, more often than this.
+TOUCH_INTERVAL_SECONDS = 60
+
+
+class SharedSymbolTable(SymbolTable):
+    """A SymbolTable backed by a memory mapped file in the disk cache.
+
+    For as long as the instance exists, the process holds a shared lock
+    on the file. That's how other processes can tell the file is still
+    attached to and that deleting it wouldn't free any memory. The locks
+    are the reference count, kept by the kernel, so a process that dies
+    (or is restarted) can never leave a reference behind.
+    """
+
+    def __init__(self, buffer, file):
+        self.file = file
+        super().__init__(buffer)
+
+    def __del__(self):
+        self.file.close()
+
+
+class SymbolTableDiskCache:
+    """A node-local cache of symbol tables, as files, keyed by their cache
+    key (see make_symbol_key_cache_key()).
+
+    Each symbol table is written once, as its serialized bytes, into its
+    own file in settings.SYMBOLICATE_DISK_CACHE_DIR and never modified
+    after that. Reading it is done with mmap so the SymbolTable instance
+    is backed by the operating system's page cache. That means all web
+    worker processes on the same host share one copy of, for example,
+    'xul.pdb' instead of each having their own and none of them need
+    a Redis round-trip to get it.
+
+    Point the directory to a tmpfs, like /dev/shm, and the files are
+    shared memory segments. One process writes (publishes) a symbol
+    table and all the others attach to it, read-only.
+
+    The files are capped by the total number of bytes. When full, the
+    least recently used files (by access time) are deleted first, except
+    the ones a process is still attached to (see SharedSymbolTable).
+    Like the in-memory cache, invalidation can only reach the host it's
+    called on so every file also expires after a while. Expired files,
+    and temporary files left behind by processes that died while writing
+    them, are deleted by the first cleanup of every (restarted) process
+    and every time a file is written after that.
+    """
+
+    def __init__(self, directory=None, max_bytes=None, ttl_seconds=None):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._swept = False
+
+    @property
+    def directory(self):
+        if self._directory is None:
+            return settings.SYMBOLICATE_DISK_CACHE_DIR
+        return self._directory
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is None:
+            return settings.SYMBOLICATE_DISK_CACHE_MAX_BYTES
+        return self._max_bytes
+
+    @property
+    def ttl_seconds(self):
+        if self._ttl_seconds is None:
+            return settings.SYMBOLICATE_DISK_CACHE_TTL_SECONDS
+        return self._ttl_seconds
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.max_bytes > 0
+
+    def get_path(self, key):
+        return get_key_path(self.directory, key, FILE_SUFFIX)
+
+    def get(self, key):
+        """Return the (mmap backed) SymbolTable instance or None if we
+        don't have it (or it has expired)."""
+        if not self.enabled:
+            return None
+        if not self._swept:
+            self.cleanup()
+        path = self.get_path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            metrics.incr('symbolicate_disk_cache_lookup', tags=['cache:miss'])
+            return None
+        now = time.time()
+        if stat.st_mtime + self.ttl_seconds < now:
+            self._remove(path)
+            metrics.incr(
+                'symbolicate_disk_cache_lookup', tags=['cache:expired']
+            )
+            return None
+        try:
+            symbol_table = self._open(path)
+        except (OSError, ValueError, InvalidSymbolTable):
+            # E.g. deleted by someone else's cleanup since we stat'ed it,
+            # or somehow broken. Either way, let it be written again.
+            logger.warning(f'Unable to read {path} from the disk cache')
+            self._remove(path)
+            metrics.incr('symbolicate_disk_cache_lookup', tags=['cache:miss'])
+            return None
+        if stat.st_atime + TOUCH_INTERVAL_SECONDS < now:
+            # The file system might be mounted with 'noatime' or
+            # 'relatime' so mark it as recently used ourselves.
+            try:
+                os.utime(path, (now, stat.st_mtime))
+            except OSError:
+                pass
+        metrics.incr('symbolicate_disk_cache_lookup', tags=['cache:hit'])
+        return symbol_table
+
+    def set(self, key, symbol_table):
+        """Write the symbol table to disk and return the SymbolTable
+        instance to use. If it could be written, that's the mmap backed
+        one so that this process doesn't need to hold on to a private
+        copy."""
+        if not self.enabled or not symbol_table:
+            # Empty symbol tables are the "known to be missing" ones. They
+            # are only cached, for a short while, in the Redis store.
+            return symbol_table
+        size = symbol_table.nbytes
+        if size > self.max_bytes:
+            return symbol_table
+        path = self.get_path(key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Locked while it's written, so cleanup() leaves it alone.
+            write_file_atomically(path, symbol_table.buffer)
+            mmapped = self._open(path)
+        except (OSError, ValueError, InvalidSymbolTable) as exception:
+            logger.warning(
+                f'Unable to write {path} to the disk cache ({exception})'
+            )
+            return symbol_table
+        metrics.incr('symbolicate_disk_cache_write', 1)
+        self.cleanup()
+        return mmapped
+
+    def evict(self, keys):
+        """Remove these keys, if present. Return how many were removed."""
+        if not self.directory:
+            return 0
+        count = 0
+        for key in keys:
+            if self._remove(self.get_path(key)):
+                count += 1
+        if count:
+            metrics.incr('symbolicate_disk_cache_invalidation', count)
+        return count
+
+    def cleanup(self):
+        """Delete expired files, orphaned temporary files and then the
+        least recently used files, that no process is attached to, till
+        the total size is within settings.SYMBOLICATE_DISK_CACHE_MAX_BYTES.
+        Return the number of files deleted to make room."""
+        max_bytes = self.max_bytes
+        now = time.time()
+        # Only one thread at a time. Other processes might be doing the
+        # same thing but that's harmless.
+        with self._lock:
+            self._swept = True
+            files = []
+            total_bytes = 0
+            try:
+                entries = list(os.scandir(self.directory))
+            except FileNotFoundError:
+                return 0
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(TEMP_FILE_SUFFIX):
+                    if (
+                        stat.st_mtime + TEMP_FILE_GRACE_SECONDS < now and
+                        not is_locked(entry.path)
+                    ):
+                        self._remove(entry.path)
+                        metrics.incr('symbolicate_disk_cache_orphan', 1)
+                    continue
+                if not entry.name.endswith(FILE_SUFFIX):
+                    continue
+                if stat.st_mtime + self.ttl_seconds < now:
+                    # Whoever is still attached keeps their copy till
+                    # they're done with it.
+                    self._remove(entry.path)
+                    continue
+                files.append((stat.st_atime, stat.st_size, entry.path))
+                total_bytes += stat.st_size
+            evictions = 0
+            if total_bytes > max_bytes:
+                files.sort()
+                for _, size, path in files:
+                    if total_bytes <= max_bytes:
+                        break
+                    # On POSIX, anybody who has it mmapped keeps their
+                    # copy, so deleting it wouldn't free any memory.
+                    if is_locked(path):
+                        continue
+                    if self._remove(path):
+                        evictions += 1
+                    total_bytes -= size
+        if evictions:
+            metrics.incr('symbolicate_disk_cache_eviction', evictions)
+        metrics.gauge('symbolicate_disk_cache_bytes', total_bytes)
+        return evictions
+
+    def clear(self):
+        if not self.directory:
+            return
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.name.endswith(FILE_SUFFIX):
+                self._remove(entry.path)
+
+    @staticmethod
+    def _open(path):
+        f = open(path, 'rb')
+        try:
+            # Released when the SharedSymbolTable is garbage collected.
+            fcntl.flock(f, fcntl.LOCK_SH)
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return SharedSymbolTable(buffer, f)
+        except BaseException:
+            f.close()
+            raise
+
+    @staticmethod
+    def _remove(path):
+        return remove_file(path)
+
+
+symbol_table_disk_cache = SymbolTableDiskCache()
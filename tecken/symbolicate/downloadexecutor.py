@@ -0,0 +1,132 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import concurrent.futures
+import functools
+import threading
+from collections import deque
+
+import markus
+
+from django.conf import settings
+
+
+metrics = markus.get_metrics('tecken')
+
+
+class DownloadExecutor:
+    """A pool of threads that download, parse and store symbol tables.
+
+    Every web worker process has one instance of this (see the
+    'download_executor' below) which is shared by all symbolication
+    requests in that process. So there are never more than
+    settings.SYMBOLICATE_DOWNLOAD_MAX_WORKERS of those threads, no matter
+    how many requests there are or how many downloads they gave up
+    waiting for. The rest wait in line.
+
+    If a download of the same symbol table is already in flight, in this
+    process, whoever asks for it again gets the same future instead of
+    starting another one. The pool is only started the first time it's
+    needed.
+    """
+
+    def __init__(self, max_workers=None):
+        self._max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        # Cache key to Future.
+        self._in_flight = {}
+
+    @property
+    def max_workers(self):
+        if self._max_workers is None:
+            return settings.SYMBOLICATE_DOWNLOAD_MAX_WORKERS
+        return self._max_workers
+
+    def submit(self, key, fn, *args):
+        """Return a Future of calling fn(*args), unless there already
+        is one in flight for this key. Then that's returned instead."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                metrics.incr('symbolicate_download_deduplicated', 1)
+                return future
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers
+                )
+            future = self._executor.submit(fn, *args)
+            self._in_flight[key] = future
+
+        def forget(future):
+            with self._lock:
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+
+        # Outside the lock, since it's called right away if it's already
+        # done.
+        future.add_done_callback(forget)
+        return future
+
+    def shutdown(self):
+        """Wait for all the downloads to finish and stop the pool. It's
+        started again, the next time it's needed."""
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+download_executor = DownloadExecutor()
+
+
+class RequestDownloads:
+    """The downloads of one symbolication request.
+
+    No more than settings.SYMBOLICATE_DOWNLOAD_MAX_WORKERS_PER_REQUEST of
+    them are submitted to the shared DownloadExecutor at a time, so that
+    one request that needs lots of symbol tables can't take every thread
+    and keep all the other requests waiting. The rest wait in line,
+    without taking up a thread, and are submitted as the others finish.
+    Even after the request has stopped waiting for them.
+    """
+
+    def __init__(self, executor=None, max_workers=None):
+        self._executor = executor or download_executor
+        if max_workers is None:
+            max_workers = settings.SYMBOLICATE_DOWNLOAD_MAX_WORKERS_PER_REQUEST
+        self._slots = threading.Semaphore(max_workers)
+        self._lock = threading.Lock()
+        # Of (Future, key, fn, args) that haven't been submitted yet.
+        self._queue = deque()
+
+    def submit(self, key, fn, *args):
+        """Return a Future of calling fn(*args) in the DownloadExecutor
+        (see DownloadExecutor.submit()). As soon as there's a slot free."""
+        future = concurrent.futures.Future()
+        with self._lock:
+            self._queue.append((future, key, fn, args))
+        self._submit_queued()
+        return future
+
+    def _submit_queued(self):
+        while True:
+            with self._lock:
+                if not self._queue or not self._slots.acquire(False):
+                    return
+                future, key, fn, args = self._queue.popleft()
+            submitted = self._executor.submit(key, fn, *args)
+            submitted.add_done_callback(
+                functools.partial(self._done, future)
+            )
+
+    def _done(self, future, submitted):
+        self._slots.release()
+        self._submit_queued()
+        exception = submitted.exception()
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(submitted.result())
@@ -0,0 +1,70 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import fcntl
+import hashlib
+import os
+import tempfile
+
+
+TEMP_FILE_SUFFIX = '.tmp'
+
+
+def hash_key(key):
+    """Return a name, for this cache key, that is safe to use in a
+    filename. The cache keys contain characters, like '/', that aren't."""
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_key_path(directory, key, suffix):
+    """Return the path, in this directory, of the file for this cache
+    key."""
+    return os.path.join(directory, hash_key(key) + suffix)
+
+
+def remove_file(path):
+    """Return True if the file was there to be removed."""
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def is_locked(path):
+    """Return True if any process (this one included) holds a lock on
+    the file at this path."""
+    try:
+        with open(path, 'rb') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            # Closing the file releases the lock.
+            return False
+    except FileNotFoundError:
+        return False
+
+
+def write_file_atomically(path, *chunks):
+    """Write these bytes to the file at this path.
+
+    They're written to a temporary file, in the same directory, first and
+    then moved into place, which is atomic, so nobody can ever read a
+    half-written file. The temporary file is locked while it's being
+    written so that whoever cleans up can tell it's not been left behind.
+    """
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path),
+        suffix=TEMP_FILE_SUFFIX,
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temp_path, path)
+    except BaseException:
+        remove_file(temp_path)
+        raise
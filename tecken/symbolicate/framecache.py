@@ -0,0 +1,124 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+import time
+from collections import OrderedDict
+
+import markus
+
+from django.conf import settings
+
+
+metrics = markus.get_metrics('tecken')
+
+
+class FrameCache:
+    """An in-process LRU cache of resolved frames. That is, for a cache
+    key (see make_symbol_key_cache_key()) and a module offset, the
+    tuple of (function start offset, function name) it resolved to.
+
+    The same frames, e.g. the ones in 'xul.pdb', show up in crash after
+    crash. If every frame of a module is in here, its symbol table
+    doesn't need to be looked up at all.
+
+    The cache is capped by the number of frames. When full, the least
+    recently used frames are evicted first. Like the in-memory symbol
+    table cache, every frame also expires after a while.
+    """
+
+    def __init__(self, max_entries=None, ttl_seconds=None):
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def max_entries(self):
+        if self._max_entries is None:
+            return settings.SYMBOLICATE_FRAME_CACHE_MAX_ENTRIES
+        return self._max_entries
+
+    @property
+    def ttl_seconds(self):
+        if self._ttl_seconds is None:
+            return settings.SYMBOLICATE_FRAME_CACHE_TTL_SECONDS
+        return self._ttl_seconds
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get_many(self, key, offsets):
+        """Return a dict of those of these offsets that we have, to their
+        tuple of (function start offset, function name)."""
+        if not self.enabled:
+            return {}
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for offset in offsets:
+                try:
+                    nearest, expires = self._entries[(key, offset)]
+                except KeyError:
+                    continue
+                if expires < now:
+                    del self._entries[(key, offset)]
+                    continue
+                self._entries.move_to_end((key, offset))
+                found[offset] = nearest
+        if found:
+            metrics.incr(
+                'symbolicate_frame_cache_lookup',
+                len(found),
+                tags=['cache:hit']
+            )
+        if len(found) < len(offsets):
+            metrics.incr(
+                'symbolicate_frame_cache_lookup',
+                len(offsets) - len(found),
+                tags=['cache:miss']
+            )
+        return found
+
+    def set_many(self, key, nearest_functions):
+        """Remember these resolved frames. 'nearest_functions' is a dict
+        of offsets to tuples of (function start offset, function name)."""
+        max_entries = self.max_entries
+        if max_entries <= 0:
+            return
+        expires = time.monotonic() + self.ttl_seconds
+        evictions = 0
+        with self._lock:
+            for offset, nearest in nearest_functions.items():
+                self._entries[(key, offset)] = (nearest, expires)
+                self._entries.move_to_end((key, offset))
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+                evictions += 1
+        if evictions:
+            metrics.incr('symbolicate_frame_cache_eviction', evictions)
+
+    def evict(self, keys):
+        """Remove all frames of these keys. Return how many were removed."""
+        keys = set(keys)
+        count = 0
+        with self._lock:
+            for entry_key in list(self._entries):
+                if entry_key[0] in keys:
+                    del self._entries[entry_key]
+                    count += 1
+        if count:
+            metrics.incr('symbolicate_frame_cache_invalidation', count)
+        return count
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+frame_cache = FrameCache()
@@ -0,0 +1,140 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+import time
+
+import markus
+from django_redis import get_redis_connection
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .diskcache import symbol_table_disk_cache
+from .framecache import frame_cache
+from .memorycache import symbol_table_cache
+
+
+metrics = markus.get_metrics('tecken')
+
+# How many of the most recent invalidations are remembered. A process
+# that has fallen further behind than this clears its caches instead.
+MAX_INVALIDATIONS = 10000
+
+# Every invalidated cache key is added, to a sorted set, with the next
+# number from a counter as its score. Only the most recent ARGV[1] are
+# kept. All in one atomic round-trip.
+RECORD_SCRIPT = """
+local number = redis.call('incr', KEYS[2])
+for i = 2, #ARGV do
+    redis.call('zadd', KEYS[1], number, ARGV[i])
+end
+redis.call('zremrangebyrank', KEYS[1], 0, -tonumber(ARGV[1]) - 1)
+return number
+"""
+
+
+def get_connection():
+    # The same Redis as the statistics. Unlike the store, it never
+    # evicts anything.
+    return get_redis_connection(settings.SYMBOLICATE_STATS_CACHE)
+
+
+def get_invalidations_key():
+    return caches[settings.SYMBOLICATE_STATS_CACHE].make_key(
+        'symbolicate:invalidations'
+    )
+
+
+def get_invalidations_counter_key():
+    return caches[settings.SYMBOLICATE_STATS_CACHE].make_key(
+        'symbolicate:invalidations:counter'
+    )
+
+
+def record_invalidations(cache_keys):
+    """Make these cache keys known, to every process on every host, as
+    invalidated. See InvalidationPoller."""
+    if not cache_keys:
+        return
+    get_connection().register_script(RECORD_SCRIPT)(
+        keys=[get_invalidations_key(), get_invalidations_counter_key()],
+        args=[MAX_INVALIDATIONS] + list(cache_keys),
+    )
+
+
+class InvalidationPoller:
+    """Evicts, from this process's in-memory caches (and this host's disk
+    cache), the symbol tables that have been invalidated by any other
+    process. E.g. by the Celery task that runs after a re-upload.
+
+    Every invalidation gets a number, from a counter in Redis, and this
+    remembers the last one it has seen. At most once per
+    settings.SYMBOLICATE_INVALIDATION_POLL_SECONDS it asks, in one
+    round-trip, for the ones after that.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_poll = None
+        self._last_seen = None
+
+    def poll(self):
+        """Evict whatever has been invalidated since last time, if it's
+        time to check. Return the number of cache keys evicted."""
+        now = time.monotonic()
+        interval = settings.SYMBOLICATE_INVALIDATION_POLL_SECONDS
+        with self._lock:
+            if (
+                self._last_poll is not None and
+                now - self._last_poll < interval
+            ):
+                return 0
+            self._last_poll = now
+            last_seen = self._last_seen
+
+        connection = get_connection()
+        if last_seen is None:
+            # Everything invalidated before this process started is
+            # not in its memory anyway.
+            counter = connection.get(get_invalidations_counter_key())
+            with self._lock:
+                self._last_seen = int(counter or 0)
+            return 0
+
+        key = get_invalidations_key()
+        pipeline = connection.pipeline(transaction=False)
+        pipeline.get(get_invalidations_counter_key())
+        pipeline.zcard(key)
+        pipeline.zrange(key, 0, 0, withscores=True)
+        pipeline.zrangebyscore(key, f'({last_seen}', '+inf')
+        counter, count, oldest, invalidated = pipeline.execute()
+        counter = int(counter or 0)
+        with self._lock:
+            self._last_seen = counter
+        if counter <= last_seen:
+            return 0
+
+        if count >= MAX_INVALIDATIONS and oldest[0][1] > last_seen + 1:
+            # Some invalidations we haven't seen are forgotten already.
+            symbol_table_cache.clear()
+            frame_cache.clear()
+            symbol_table_disk_cache.clear()
+            metrics.incr('symbolicate_invalidation_cleared', 1)
+            return len(invalidated)
+
+        cache_keys = [member.decode('utf-8') for member in invalidated]
+        symbol_table_cache.evict(cache_keys)
+        symbol_table_disk_cache.evict(cache_keys)
+        frame_cache.evict(cache_keys)
+        metrics.incr('symbolicate_invalidation_evicted', len(cache_keys))
+        return len(cache_keys)
+
+    def reset(self):
+        with self._lock:
+            self._last_poll = None
+            self._last_seen = None
+
+
+invalidation_poller = InvalidationPoller()
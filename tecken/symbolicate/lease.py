@@ -0,0 +1,51 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import uuid
+
+
+# Only delete the key if it's still ours. If the lease expired and
+# someone else took it, it's theirs to release.
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+else
+    return 0
+end
+"""
+
+
+class Lease:
+    """A lock, in Redis, that only one process (or thread) at a time can
+    hold. It's used so that when many web workers need the same symbol
+    file at the same time, only one of them downloads it.
+
+    The lease expires by itself after 'ttl_seconds', in case whoever
+    held it dies before releasing it.
+    """
+
+    def __init__(self, connection, key, ttl_seconds):
+        self.connection = connection
+        self.key = key
+        self.ttl_seconds = ttl_seconds
+        self.token = uuid.uuid4().hex
+        self.acquired = False
+
+    def acquire(self):
+        """Return True if we got the lease."""
+        self.acquired = bool(self.connection.set(
+            self.key,
+            self.token,
+            nx=True,
+            px=int(self.ttl_seconds * 1000),
+        ))
+        return self.acquired
+
+    def release(self):
+        if self.acquired:
+            self.connection.register_script(RELEASE_SCRIPT)(
+                keys=[self.key],
+                args=[self.token],
+            )
+            self.acquired = False
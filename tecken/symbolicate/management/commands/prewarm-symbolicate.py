@@ -0,0 +1,55 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+from django.core.management.base import BaseCommand
+
+from tecken.symbolicate.tasks import (
+    prewarm_symbolicate_cache,
+    prewarm_symbolicate_cache_task,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Download and store the symbol tables of the most popular modules '
+        'that are not already in the Redis store. E.g. after it has been '
+        'restarted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='number of most popular modules (default: '
+                 'settings.SYMBOLICATE_PREWARM_TOP_N)',
+        )
+        parser.add_argument(
+            '--max-bytes',
+            type=int,
+            help='memory budget (default: '
+                 'settings.SYMBOLICATE_PREWARM_MAX_BYTES)',
+        )
+        parser.add_argument(
+            '--async',
+            action='store_true',
+            dest='async_',
+            help='send it to a Celery worker instead of doing it here',
+        )
+
+    def handle(self, *args, **options):
+        if options['async_']:
+            prewarm_symbolicate_cache_task.delay(
+                limit=options['limit'],
+                max_bytes=options['max_bytes'],
+            )
+            self.stdout.write('Sent to Celery')
+            return
+        summary = prewarm_symbolicate_cache(
+            limit=options['limit'],
+            max_bytes=options['max_bytes'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            'Stored {stored} symbol tables ({size:,} bytes). '
+            '{skipped} were already stored.'.format(**summary)
+        ))
@@ -0,0 +1,238 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import functools
+import math
+import multiprocessing
+import os
+import sys
+import time
+from itertools import islice
+
+import ujson as json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tecken.symbolicate import views
+from tecken.symbolicate.views import (
+    InvalidMemoryMap,
+    InvalidStacks,
+    SymbolicateJSON,
+    format_v4_result,
+    format_v5_job_result,
+    operational_exceptions,
+    validate_memory_map,
+    validate_stacks,
+)
+
+
+def get_jobs(body):
+    """Return a tuple of (version, list of (stacks, memory map)) from a
+    payload that would have been POSTed to /symbolicate/v4 or
+    /symbolicate/v5."""
+    if not isinstance(body, dict):
+        raise ValueError('Not a dict')
+    if body.get('version') == 4:
+        version = 4
+        jobs = [body]
+    elif 'jobs' in body:
+        version = 5
+        jobs = body['jobs']
+        if not jobs or not isinstance(jobs, list):
+            raise ValueError('Jobs list empty')
+    else:
+        # A single version 5 job.
+        version = 5
+        jobs = [body]
+    try:
+        for job in jobs:
+            validate_stacks(job['stacks'])
+            validate_memory_map(job['memoryMap'])
+    except KeyError as exception:
+        raise ValueError(f'Missing key in JSON ({exception})')
+    except (TypeError, InvalidStacks, InvalidMemoryMap) as exception:
+        raise ValueError(str(exception))
+    return version, [(job['stacks'], job['memoryMap']) for job in jobs]
+
+
+def is_complete(result):
+    """Return True if every module, that the frames of this result of
+    SymbolicateJSON.symbolicate_many() refer to, was found. Not missing
+    and not still pending."""
+    return not any(
+        known is False or known == 'pending'
+        for known in result['knownModules']
+    )
+
+
+def symbolicate_line(line, timeout=math.inf):
+    """Symbolicate one JSON payload and return a tuple of (the result as
+    JSON, number of jobs, number of frames, whether it failed). The
+    result is the same as the response from /symbolicate/v4 or
+    /symbolicate/v5, or a dict with an 'error' key. It failed if it's an
+    error or if any module is missing or still pending after waiting
+    'timeout' seconds for the downloads.
+
+    This runs in the worker processes. Each of them has its own
+    in-memory cache of symbol tables (and frames) that is reused by every
+    payload that process symbolicates."""
+    jobs = []
+    try:
+        version, jobs = get_jobs(json.loads(line))
+        symbolicator = SymbolicateJSON(
+            views.downloader,
+            download_timeout=timeout,
+        )
+        results = symbolicator.symbolicate_many(jobs)
+        if version == 4:
+            output = format_v4_result(results[0])
+        else:
+            output = {
+                'results': [
+                    format_v5_job_result(memory_map, result)
+                    for (_, memory_map), result in zip(jobs, results)
+                ]
+            }
+        failed = not all(is_complete(result) for result in results)
+    except ValueError as exception:
+        output = {'error': str(exception)}
+        failed = True
+    except (IndexError, KeyError) as exception:
+        # E.g. a frame whose module index isn't in the memory map. Only
+        # this payload fails, not the whole run.
+        output = {'error': f'{exception.__class__.__name__}: {exception}'}
+        failed = True
+    except operational_exceptions as exception:
+        output = {'error': str(exception)}
+        failed = True
+    frames = sum(len(stack) for stacks, _ in jobs for stack in stacks)
+    return json.dumps(output), len(jobs), frames, failed
+
+
+def iter_lines(paths):
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+
+class Command(BaseCommand):
+    help = """Symbolicate JSONL files of payloads, each what would have been
+    POSTed to /symbolicate/v4 or /symbolicate/v5, and write the results as
+    JSONL in the same order. One line per payload.
+
+    The payloads are shared out across a pool of processes. It uses the
+    same symbol files and Redis store as the web workers but doesn't go
+    through the web stack.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'payloads',
+            nargs='+',
+            help='.jsonl files of payloads',
+        )
+        parser.add_argument(
+            '--output',
+            default='-',
+            help='file to write the results to (default: stdout)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='number of worker processes (default: number of CPUs)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=10,
+            help='number of payloads sent to a worker at a time',
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=0,
+            help=(
+                'seconds to wait for the downloads of each payload '
+                '(default: 0, i.e. no limit)'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        for path in options['payloads']:
+            if not os.path.isfile(path):
+                raise CommandError(f'{path} does not exist')
+        if options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--workers and --chunk-size must be >= 1')
+        if options['timeout'] < 0:
+            raise CommandError('--timeout must be >= 0')
+        timeout = options['timeout'] or math.inf
+
+        if options['output'] == '-':
+            output = sys.stdout
+            # The results go to stdout so the report can't.
+            report = self.stderr
+        else:
+            output = open(options['output'], 'w')
+            report = self.stdout
+
+        t0 = time.time()
+        payloads = jobs = frames = errors = 0
+        try:
+            for line, line_jobs, line_frames, failed in self.symbolicate(
+                iter_lines(options['payloads']),
+                options['workers'],
+                options['chunk_size'],
+                timeout,
+            ):
+                output.write(line + '\n')
+                payloads += 1
+                jobs += line_jobs
+                frames += line_frames
+                errors += failed
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        seconds = time.time() - t0
+
+        report.write(self.style.SUCCESS(
+            'Symbolicated {:,} payloads ({:,} jobs, {:,} frames) in '
+            '{:.1f}s with {} workers'.format(
+                payloads,
+                jobs,
+                frames,
+                seconds,
+                options['workers'],
+            )
+        ))
+        report.write(
+            '{:,.1f} payloads/sec  {:,.0f} frames/sec'.format(
+                payloads / seconds if seconds else 0,
+                frames / seconds if seconds else 0,
+            )
+        )
+        if errors:
+            report.write(self.style.WARNING(f'{errors:,} payloads failed'))
+
+    def symbolicate(self, lines, workers, chunk_size, timeout):
+        """Yield the result of symbolicate_line() for each line, in order."""
+        symbolicate = functools.partial(symbolicate_line, timeout=timeout)
+        if workers == 1:
+            yield from map(symbolicate, lines)
+            return
+        # The lines are read, and handed to the pool, a window at a time
+        # so a big backlog is never all in memory.
+        window = workers * chunk_size * 4
+        with multiprocessing.Pool(workers) as pool:
+            while True:
+                batch = list(islice(lines, window))
+                if not batch:
+                    break
+                yield from pool.imap(
+                    symbolicate,
+                    batch,
+                    chunksize=chunk_size,
+                )
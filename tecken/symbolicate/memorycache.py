@@ -0,0 +1,171 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+import time
+from collections import OrderedDict
+
+import markus
+
+from django.conf import settings
+
+from .diskcache import SharedSymbolTable
+
+
+metrics = markus.get_metrics('tecken')
+
+# Our best guess of how much memory a cached symbol table uses on top of
+# its buffer. I.e. the SymbolTable instance, its memoryviews and the
+# entry in the OrderedDict.
+ENTRY_OVERHEAD_BYTES = 1024
+
+
+def estimate_size(symbol_table):
+    return symbol_table.nbytes + ENTRY_OVERHEAD_BYTES
+
+
+class SymbolTableCache:
+    """An in-process LRU cache of SymbolTable instances, keyed by their
+    cache key (see make_symbol_key_cache_key()).
+
+    Every web worker process has one instance of this (see the
+    'symbol_table_cache' below) which is shared across all symbolication
+    requests in that process. That way, hot modules like 'xul.pdb' can be
+    symbolicated without even talking to the Redis store.
+
+    The cache is capped by the (estimated) number of bytes it's holding.
+    When full, the least recently used symbol tables are evicted first.
+    Symbol tables from the disk cache (see SharedSymbolTable) each keep
+    a file open, for as long as they're alive, so they're also capped by
+    how many there are. Regardless of how few bytes they take up.
+    Because invalidation (see invalidate_symbolicate_cache()) only reaches
+    the process it's called in, every entry also expires after a while.
+    """
+
+    def __init__(self, max_bytes=None, ttl_seconds=None, max_open_files=None):
+        self._max_bytes = max_bytes
+        self._ttl_seconds = ttl_seconds
+        self._max_open_files = max_open_files
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.open_files = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is None:
+            return settings.SYMBOLICATE_MEMORY_CACHE_MAX_BYTES
+        return self._max_bytes
+
+    @property
+    def ttl_seconds(self):
+        if self._ttl_seconds is None:
+            return settings.SYMBOLICATE_MEMORY_CACHE_TTL_SECONDS
+        return self._ttl_seconds
+
+    @property
+    def max_open_files(self):
+        if self._max_open_files is None:
+            return settings.SYMBOLICATE_MEMORY_CACHE_MAX_OPEN_FILES
+        return self._max_open_files
+
+    def get(self, key):
+        """Return the SymbolTable instance or None if we don't have it
+        (or it has expired)."""
+        with self._lock:
+            try:
+                symbol_table, size, expires = self._entries[key]
+            except KeyError:
+                metrics.incr(
+                    'symbolicate_memory_cache_lookup', tags=['cache:miss']
+                )
+                return None
+            if expires < time.monotonic():
+                self._delete(key)
+                metrics.incr(
+                    'symbolicate_memory_cache_lookup', tags=['cache:expired']
+                )
+                return None
+            self._entries.move_to_end(key)
+        metrics.incr('symbolicate_memory_cache_lookup', tags=['cache:hit'])
+        return symbol_table
+
+    def set(self, key, symbol_table):
+        max_bytes = self.max_bytes
+        max_open_files = self.max_open_files
+        size = estimate_size(symbol_table)
+        if size > max_bytes:
+            # Either the cache is disabled (max_bytes == 0) or this one
+            # symbol table is simply too big. Either way, don't bother.
+            # But what it replaces is out of date so that has to go.
+            with self._lock:
+                replaced = key in self._entries
+                if replaced:
+                    self._delete(key)
+                total_bytes = self.total_bytes
+            if replaced:
+                metrics.incr('symbolicate_memory_cache_eviction', 1)
+                metrics.gauge('symbolicate_memory_cache_bytes', total_bytes)
+            return
+        evictions = 0
+        with self._lock:
+            if key in self._entries:
+                self._delete(key)
+            self._entries[key] = (
+                symbol_table,
+                size,
+                time.monotonic() + self.ttl_seconds,
+            )
+            self.total_bytes += size
+            if isinstance(symbol_table, SharedSymbolTable):
+                self.open_files += 1
+            while self.total_bytes > max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._delete(oldest_key)
+                evictions += 1
+            if self.open_files > max_open_files:
+                oldest_keys = [
+                    key for key, (symbol_table, _, _) in self._entries.items()
+                    if isinstance(symbol_table, SharedSymbolTable)
+                ][:self.open_files - max_open_files]
+                for oldest_key in oldest_keys:
+                    self._delete(oldest_key)
+                    evictions += 1
+            total_bytes = self.total_bytes
+        if evictions:
+            metrics.incr('symbolicate_memory_cache_eviction', evictions)
+        metrics.gauge('symbolicate_memory_cache_bytes', total_bytes)
+
+    def evict(self, keys):
+        """Remove these keys, if present. Return how many were removed."""
+        count = 0
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._delete(key)
+                    count += 1
+        if count:
+            metrics.incr('symbolicate_memory_cache_invalidation', count)
+        return count
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+            self.open_files = 0
+
+    def _delete(self, key):
+        symbol_table, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+        if isinstance(symbol_table, SharedSymbolTable):
+            self.open_files -= 1
+
+
+symbol_table_cache = SymbolTableCache()
@@ -0,0 +1,199 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import fcntl
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import markus
+
+from django.conf import settings
+
+from .files import TEMP_FILE_SUFFIX, is_locked, remove_file
+from .parser import parse_symbol_file
+from .symboltable import SymbolTable
+
+
+logger = logging.getLogger('tecken')
+metrics = markus.get_metrics('tecken')
+
+# While a process of the pool parses a symbol file, it holds a lock on a
+# file, next to it, with this suffix.
+LOCK_FILE_SUFFIX = '.parsing'
+
+# How often, while waiting for a symbol file to be parsed, we check that
+# the process parsing it is still alive.
+POLL_INTERVAL_SECONDS = 0.5
+
+
+class ParseWorkerDied(Exception):
+    """The process of the pool that was parsing a symbol file died."""
+
+
+class ParseWorkerTimeout(Exception):
+    """The process of the pool that is parsing a symbol file is taking
+    too long."""
+
+
+def parse_symbol_file_locked(path, url=None):
+    """Like parse_symbol_file() but, all along, hold an exclusive lock on
+    a file (see LOCK_FILE_SUFFIX) that says which process is parsing it.
+    The kernel releases the lock if the process dies so that's how the web
+    worker can tell. The pool itself never tells anyone."""
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=TEMP_FILE_SUFFIX)
+    with os.fdopen(fd, 'wb') as f:
+        # Locked before it's moved into place so nobody ever sees it
+        # unlocked while we're still at it.
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(str(os.getpid()).encode('ascii'))
+        f.flush()
+        os.replace(temp_path, path + LOCK_FILE_SUFFIX)
+        return parse_symbol_file(path, url=url)
+
+
+class ParseExecutor:
+    """A pool of processes that parse .sym files.
+
+    Parsing a big .sym file is pure Python CPU work. Done in a thread of
+    the web worker, it holds the GIL all along and every other thread in
+    that process has to wait. With this, the web worker only writes the
+    download to a temporary file and waits (without the GIL) for one of
+    the processes to send back the serialized symbol table.
+
+    Every web worker process has one instance of this (see the
+    'parse_executor' below) and the pool is only started the first time
+    it's needed. Disabled if settings.SYMBOLICATE_PARSE_PROCESSES is 0.
+    """
+
+    def __init__(self, processes=None):
+        self._processes = processes
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._depth = 0
+        self._depth_lock = threading.Lock()
+
+    @property
+    def processes(self):
+        if self._processes is None:
+            return settings.SYMBOLICATE_PARSE_PROCESSES
+        return self._processes
+
+    @property
+    def enabled(self):
+        return self.processes > 0
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    # Not forked from this, multi-threaded, process since
+                    # the child would inherit whichever locks the other
+                    # threads happen to hold.
+                    context = multiprocessing.get_context('forkserver')
+                    self._pool = context.Pool(self.processes)
+        return self._pool
+
+    def _change_depth(self, delta):
+        with self._depth_lock:
+            self._depth += delta
+            depth = self._depth
+        metrics.gauge('symbolicate_parse_queue_depth', depth)
+
+    def parse(self, lines, url=None):
+        """Return a tuple of (SymbolTable instance, total size, time spent
+        writing the lines, CPU time spent parsing them) from an iterable
+        of lines (as bytes) of a .sym file."""
+        directory = settings.SYMBOLICATE_PARSE_TEMP_DIR or None
+        with tempfile.NamedTemporaryFile(
+            dir=directory,
+            suffix='.sym',
+        ) as f:
+            t0 = time.time()
+            for line in lines:
+                f.write(line)
+                f.write(b'\n')
+            f.flush()
+            write_time = time.time() - t0
+
+            buffer, total_size, parse_time = self.parse_file(f.name, url=url)
+        metrics.timing('symbolicate_parse_executor_cpu', parse_time * 1000)
+        return SymbolTable(buffer), total_size, write_time, parse_time
+
+    def parse_file(self, path, url=None):
+        """Return a tuple of (serialized symbol table, total size, CPU time
+        spent parsing it) of the .sym file at this path. Parsed by one of
+        the processes of the pool unless that fails. Then it's parsed in
+        this process instead."""
+        self._change_depth(1)
+        t0 = time.time()
+        try:
+            return self._wait(
+                self.pool.apply_async(parse_symbol_file_locked, (path, url)),
+                path + LOCK_FILE_SUFFIX,
+            )
+        except ParseWorkerDied:
+            # E.g. OOM killed. The pool starts a new process in its place
+            # and is otherwise left as is for everybody else.
+            logger.error(f'Parse executor process died parsing {url}')
+            metrics.incr('symbolicate_parse_executor_died', 1)
+        except ParseWorkerTimeout:
+            # It keeps going, in the background, but only holds up this
+            # one symbol file.
+            logger.error(f'Parse executor timed out parsing {url}')
+            metrics.incr('symbolicate_parse_executor_timeout', 1)
+        except Exception:
+            logger.exception(f'Parse executor failed to parse {url}')
+            metrics.incr('symbolicate_parse_executor_error', 1)
+        finally:
+            self._change_depth(-1)
+            remove_file(path + LOCK_FILE_SUFFIX)
+            # From being submitted till the symbol table came back.
+            metrics.timing(
+                'symbolicate_parse_executor_wait',
+                (time.time() - t0) * 1000
+            )
+        return parse_symbol_file(path, url=url)
+
+    def _wait(self, result, lock_path):
+        """Return the result of parse_symbol_file_locked() once it's done.
+        Raise ParseWorkerDied if the process parsing it dies and
+        ParseWorkerTimeout if it takes longer than
+        settings.SYMBOLICATE_PARSE_TIMEOUT_SECONDS. Not counting the time
+        it's waiting in line for a process."""
+        timeout = settings.SYMBOLICATE_PARSE_TIMEOUT_SECONDS
+        started = None
+        while True:
+            try:
+                return result.get(timeout=POLL_INTERVAL_SECONDS)
+            except multiprocessing.TimeoutError:
+                pass
+            if started is None:
+                if os.path.exists(lock_path):
+                    started = time.time()
+                continue
+            if not is_locked(lock_path):
+                # Either it's done and the result is on its way or the
+                # process died and the result will never come.
+                try:
+                    return result.get(timeout=POLL_INTERVAL_SECONDS)
+                except multiprocessing.TimeoutError:
+                    raise ParseWorkerDied(lock_path)
+            if time.time() - started > timeout:
+                raise ParseWorkerTimeout(lock_path)
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
+
+parse_executor = ParseExecutor()
@@ -0,0 +1,111 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import time
+
+from .symboltable import SymbolTable
+
+
+logger = logging.getLogger('tecken')
+
+# The first byte of the only two kinds of records we care about.
+# Note that 'FILE' records also start with an 'F'. All the (very many)
+# line records start with a lowercase hex digit so they never match.
+_F = ord('F')
+_P = ord('P')
+
+
+def parse_symbol_lines(lines, url=None):
+    """Return a tuple of (symbol map, total size) from an iterable of
+    lines (as bytes) of a .sym file.
+
+    The symbol map is a dict of offsets (ints) to function names (bytes).
+    Only the 'FUNC' and 'PUBLIC' records are parsed. Everything else is
+    skipped by looking at the first byte without decoding or splitting
+    the line.
+    If both a 'FUNC' and a 'PUBLIC' record share the same offset,
+    the 'PUBLIC' one wins.
+
+    About the 'm' after the record type; it's an extra *optional* prefix
+    which we currently omit.
+    Origin: https://bugs.chromium.org/p/google-breakpad/issues/detail?id=751
+    Note, as pointed out in
+    https://github.com/mozilla-services/tecken/issues/924#issuecomment-399130860
+    some day we might actually extract and use the presence of this 'm'
+    as a potential factor of the symbolication.
+    As of June 2018, we deliberately omit it.
+    """
+    public_symbols = {}
+    func_symbols = {}
+    total_size = 0
+    line_number = 0
+    for line in lines:
+        total_size += len(line)
+        line_number += 1
+        if not line:
+            continue
+        first = line[0]
+        if first == _F:
+            if not line.startswith(b'FUNC '):
+                continue
+            rest = line[5:]
+            if rest.startswith(b'm '):
+                rest = rest[2:]
+            # FUNC [m] address size parameter_size name
+            fields = rest.split(None, 3)
+            if len(fields) != 4:
+                logger.warning(
+                    'FUNC line {} in {} has too few fields'.format(
+                        line_number,
+                        url,
+                    )
+                )
+                continue
+            func_symbols[int(fields[0], 16)] = fields[3].rstrip()
+        elif first == _P:
+            if not line.startswith(b'PUBLIC '):
+                continue
+            rest = line[7:]
+            if rest.startswith(b'm '):
+                rest = rest[2:]
+            # PUBLIC [m] address parameter_size name
+            fields = rest.split(None, 2)
+            if len(fields) != 3:
+                logger.warning(
+                    'PUBLIC line {} in {} has too few fields'.format(
+                        line_number,
+                        url,
+                    )
+                )
+                continue
+            public_symbols[int(fields[0], 16)] = fields[2].rstrip()
+
+    # Prioritize PUBLIC symbols over FUNC symbols # XXX why?
+    func_symbols.update(public_symbols)
+    return func_symbols, total_size
+
+
+def parse_symbol_table(lines, url=None):
+    """Return a tuple of (SymbolTable instance, total size) from an
+    iterable of lines (as bytes) of a .sym file."""
+    symbol_map, total_size = parse_symbol_lines(lines, url=url)
+    return SymbolTable.from_symbol_map(symbol_map), total_size
+
+
+def parse_symbol_file(path, url=None):
+    """Return a tuple of (serialized symbol table, total size, CPU time)
+    from a .sym file on disk that has one line per line.
+
+    This is what the worker processes of the parse executor (see
+    parseexecutor.py) run. The symbol table is returned as bytes since
+    that's compact and cheap to send back to the web process."""
+    t0 = time.process_time()
+    with open(path, 'rb') as f:
+        symbol_map, total_size = parse_symbol_lines(
+            (line.rstrip(b'\n') for line in f),
+            url=url,
+        )
+    buffer = SymbolTable.serialize(symbol_map)
+    return buffer, total_size, time.process_time() - t0
@@ -0,0 +1,62 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .utils import get_stats_redis_connection
+
+
+def get_popularity_key(dateobj):
+    date = dateobj.strftime('%Y%m%d')
+    return caches[settings.SYMBOLICATE_STATS_CACHE].make_key(
+        f'symbolicate:popularity:{date}'
+    )
+
+
+def increment_module_popularity(symbol_keys):
+    """Count one more symbolication request for each of these symbol keys.
+    The counts are kept, per day, in a Redis sorted set. All in one
+    round-trip."""
+    if not symbol_keys:
+        return
+    key = get_popularity_key(datetime.datetime.utcnow())
+    pipeline = get_stats_redis_connection().pipeline(transaction=False)
+    for symbol_key in symbol_keys:
+        pipeline.zincrby(key, '/'.join(symbol_key), 1)
+    pipeline.expire(
+        key,
+        datetime.timedelta(days=settings.SYMBOLICATE_POPULARITY_DAYS + 1)
+    )
+    pipeline.execute()
+
+
+def get_hot_modules(limit, days=None):
+    """Return a list of (symbol key, count) of the 'limit' most
+    symbolicated modules over the last 'days' days (default
+    settings.SYMBOLICATE_POPULARITY_DAYS). Most popular first."""
+    if days is None:
+        days = settings.SYMBOLICATE_POPULARITY_DAYS
+    today = datetime.datetime.utcnow()
+    keys = [
+        get_popularity_key(today - datetime.timedelta(days=i))
+        for i in range(days)
+    ]
+    # Add up the days into a temporary sorted set, rank it and delete it,
+    # in one round-trip.
+    destination = get_popularity_key(today) + f':union:{uuid.uuid4().hex}'
+    pipeline = get_stats_redis_connection().pipeline(transaction=False)
+    pipeline.zunionstore(destination, keys)
+    pipeline.zrevrange(destination, 0, limit - 1, withscores=True)
+    pipeline.delete(destination)
+    _, ranked, _ = pipeline.execute()
+    hot_modules = []
+    for member, count in ranked:
+        # Module filenames might contain a '/' but debug IDs never do.
+        symbol_key = tuple(member.decode('utf-8').rsplit('/', 1))
+        hot_modules.append((symbol_key, int(count)))
+    return hot_modules
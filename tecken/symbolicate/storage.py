@@ -0,0 +1,433 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import fcntl
+import os
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+
+from django_redis import get_redis_connection
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from .files import get_key_path, hash_key, remove_file, write_file_atomically
+from .lease import Lease
+
+
+class SymbolTableStore:
+    """Where symbol tables are stored, as bytes, keyed by their cache key
+    (see make_symbol_key_cache_key()), so that they only need to be
+    downloaded and parsed once. The in-memory and disk caches are in
+    front of it.
+
+    This is the interface every backend implements. Which backend is used
+    is decided by settings.SYMBOLICATE_STORE_BACKEND and what its
+    'location' means is up to the backend. The values are opaque bytes
+    and every value is written whole and atomically.
+    """
+
+    def __init__(self, location):
+        self.location = location
+
+    def get(self, key):
+        """Return the bytes or None if there's nothing (or it expired)."""
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """Return a list of bytes (or None) in the same order as 'keys'."""
+        raise NotImplementedError
+
+    def get_prefixes(self, keys, length):
+        """Like get_many() but only the first 'length' bytes of each.
+        Backends should override this to avoid reading the whole thing."""
+        return [
+            value[:length] if value is not None else None
+            for value in self.get_many(keys)
+        ]
+
+    def set(self, key, value, timeout=None):
+        self.set_many([(key, value)], timeout=timeout)
+
+    def set_many(self, items, timeout=None):
+        """Store these (key, value) tuples, in this order. If 'timeout'
+        is set, they expire after that many seconds."""
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        raise NotImplementedError
+
+    def get_sizes(self, keys):
+        """Return a list of the number of bytes stored (0 if nothing) for
+        each of these keys."""
+        raise NotImplementedError
+
+    def get_lease(self, key, ttl_seconds):
+        """Return a lease (i.e. something with an acquire() and release()
+        method) that whoever is about to download the symbol table of
+        this key has to hold. See Lease."""
+        raise NotImplementedError
+
+    def get_used_memory(self):
+        """Return the number of bytes the store is using, if it knows."""
+        return None
+
+
+class RedisSymbolTableStore(SymbolTableStore):
+    """Symbol tables stored in a Redis LRU, 'location' being the name of
+    its cache in settings.CACHES (default 'store').
+
+    Note that this bypasses the django_redis serializer and compressor.
+    The symbol tables are stored as raw bytes. All the reads are sent in
+    one pipeline (i.e. one network round-trip) but split up into MGETs of
+    settings.SYMBOLICATE_STORE_PIPELINE_BATCH_SIZE keys so that one big
+    request doesn't block the (single threaded) Redis server for too long.
+    The writes are sent in as few pipelines as possible without any of
+    them being bigger than settings.SYMBOLICATE_STORE_WRITE_CHUNK_BYTES.
+    A value that is bigger than that on its own is appended, a piece at a
+    time, to a temporary key that is renamed into place once complete.
+    """
+
+    # While a value is written in pieces, the temporary key expires after
+    # this many seconds without a new piece. So a process that dies half
+    # way through doesn't leave it behind.
+    WRITING_TTL_SECONDS = 60
+
+    # Moves the temporary key, of a value written in pieces, into place.
+    # But only if it's all there. If it got evicted, by the LRU, half way
+    # through, it would be missing its start. All in one atomic step.
+    FINISH_WRITING_SCRIPT = """
+    if redis.call('strlen', KEYS[1]) ~= tonumber(ARGV[1]) then
+        redis.call('del', KEYS[1])
+        return 0
+    end
+    if tonumber(ARGV[2]) > 0 then
+        redis.call('expire', KEYS[1], ARGV[2])
+    else
+        redis.call('persist', KEYS[1])
+    end
+    redis.call('rename', KEYS[1], KEYS[2])
+    return 1
+    """
+
+    def __init__(self, location):
+        super().__init__(location or 'store')
+
+    @property
+    def connection(self):
+        return get_redis_connection(self.location)
+
+    def make_key(self, key):
+        return caches[self.location].make_key(key)
+
+    def get_many(self, keys):
+        batch_size = settings.SYMBOLICATE_STORE_PIPELINE_BATCH_SIZE
+        store_keys = [self.make_key(key) for key in keys]
+        pipeline = self.connection.pipeline(transaction=False)
+        for i in range(0, len(store_keys), batch_size):
+            pipeline.mget(store_keys[i:i + batch_size])
+        values = []
+        for batch in pipeline.execute():
+            values.extend(batch)
+        return values
+
+    def get_prefixes(self, keys, length):
+        pipeline = self.connection.pipeline(transaction=False)
+        for key in keys:
+            pipeline.getrange(self.make_key(key), 0, length - 1)
+        # A key that doesn't exist is an empty string, just like an empty
+        # value, but neither has a prefix worth knowing about.
+        return [value or None for value in pipeline.execute()]
+
+    def set_many(self, items, timeout=None):
+        chunk_size = settings.SYMBOLICATE_STORE_WRITE_CHUNK_BYTES
+        connection = self.connection
+        finish_writing = connection.register_script(
+            self.FINISH_WRITING_SCRIPT
+        )
+        pipeline = connection.pipeline(transaction=False)
+        pipeline_size = 0
+        for key, value in items:
+            store_key = self.make_key(key)
+            pieces = [value]
+            if len(value) > chunk_size:
+                pieces = [
+                    value[i:i + chunk_size]
+                    for i in range(0, len(value), chunk_size)
+                ]
+                temp_key = self.make_key(f'{key}:writing:{uuid.uuid4().hex}')
+            for piece in pieces:
+                if pipeline_size and pipeline_size + len(piece) > chunk_size:
+                    pipeline.execute()
+                    pipeline_size = 0
+                if len(pieces) == 1:
+                    pipeline.set(store_key, bytes(piece), ex=timeout)
+                else:
+                    pipeline.append(temp_key, bytes(piece))
+                    pipeline.expire(temp_key, self.WRITING_TTL_SECONDS)
+                pipeline_size += len(piece)
+            if len(pieces) > 1:
+                finish_writing(
+                    keys=[temp_key, store_key],
+                    args=[len(value), timeout or 0],
+                    client=pipeline,
+                )
+        pipeline.execute()
+
+    def delete_many(self, keys):
+        if keys:
+            self.connection.delete(*[self.make_key(key) for key in keys])
+
+    def get_sizes(self, keys):
+        pipeline = self.connection.pipeline(transaction=False)
+        for key in keys:
+            pipeline.strlen(self.make_key(key))
+        return pipeline.execute()
+
+    def get_lease(self, key, ttl_seconds):
+        return Lease(
+            self.connection,
+            self.make_key(f'{key}:lease'),
+            ttl_seconds,
+        )
+
+    def get_used_memory(self):
+        return self.connection.info()['used_memory']
+
+
+class FileLease:
+    """A lease, for processes on this host, that is an exclusive flock on
+    a lock file. The kernel releases it if whoever held it dies so,
+    unlike Lease, it doesn't need to expire."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    @property
+    def acquired(self):
+        return self.file is not None
+
+    def acquire(self):
+        """Return True if we got the lease."""
+        f = open(self.path, 'ab')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # Whoever held it before might have deleted the file, on
+            # release, after we opened it. Then we locked a file nobody
+            # else will ever open.
+            if os.fstat(f.fileno()).st_ino != os.stat(self.path).st_ino:
+                raise BlockingIOError(self.path)
+        except (BlockingIOError, FileNotFoundError):
+            f.close()
+            return False
+        self.file = f
+        return True
+
+    def release(self):
+        if self.file is not None:
+            # Deleted while we still hold it, so nobody can lock it
+            # after it's gone. See acquire().
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.file.close()
+            self.file = None
+
+
+class FileSystemSymbolTableStore(SymbolTableStore):
+    """Symbol tables stored as files in the 'location' directory, one per
+    key. Every file starts with when it expires (0 for never) followed
+    by the value.
+
+    Unlike the Redis LRU, nothing is ever evicted to make room. Only
+    invalidation, and expiring, removes symbol tables. Leases only work
+    between processes on the same host, which is fine since that's who
+    shares the directory.
+    """
+
+    HEADER = struct.Struct('<d')
+    FILE_SUFFIX = '.symtab'
+
+    def get_path(self, key, suffix=FILE_SUFFIX):
+        return get_key_path(self.location, key, suffix)
+
+    def get_many(self, keys):
+        return [self._read(self.get_path(key)) for key in keys]
+
+    def get_prefixes(self, keys, length):
+        return [self._read(self.get_path(key), length) for key in keys]
+
+    def _read(self, path, length=None):
+        try:
+            with open(path, 'rb') as f:
+                if length is None:
+                    data = f.read()
+                else:
+                    data = f.read(self.HEADER.size + length)
+        except FileNotFoundError:
+            return None
+        expires, = self.HEADER.unpack_from(data)
+        if expires and expires < time.time():
+            self._remove(path)
+            return None
+        return data[self.HEADER.size:]
+
+    def set_many(self, items, timeout=None):
+        expires = time.time() + timeout if timeout else 0
+        os.makedirs(self.location, exist_ok=True)
+        for key, value in items:
+            write_file_atomically(
+                self.get_path(key),
+                self.HEADER.pack(expires),
+                value,
+            )
+
+    def delete_many(self, keys):
+        for key in keys:
+            self._remove(self.get_path(key))
+
+    def get_sizes(self, keys):
+        sizes = []
+        for key in keys:
+            try:
+                size = os.stat(self.get_path(key)).st_size
+            except FileNotFoundError:
+                sizes.append(0)
+            else:
+                sizes.append(max(0, size - self.HEADER.size))
+        return sizes
+
+    def get_lease(self, key, ttl_seconds):
+        os.makedirs(self.location, exist_ok=True)
+        return FileLease(self.get_path(key, suffix='.lease'))
+
+    @staticmethod
+    def _remove(path):
+        remove_file(path)
+
+
+class SQLiteSymbolTableStore(SymbolTableStore):
+    """Symbol tables stored in an SQLite database, 'location' being the
+    path to its file. Every thread has its own connection.
+
+    Like the file system store, nothing is ever evicted to make room and
+    leases (lock files next to the database file) only work between
+    processes on the same host.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS symbol_tables (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        expires REAL
+    );
+    CREATE INDEX IF NOT EXISTS symbol_tables_expires
+        ON symbol_tables (expires);
+    """
+
+    def __init__(self, location):
+        super().__init__(location)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.location)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.location, timeout=30)
+            # So that reading never waits for writing.
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(self.SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def _select(self, columns, keys):
+        """Yield (key, *columns) rows, that haven't expired, for these
+        keys. A batch of keys at a time."""
+        batch_size = settings.SYMBOLICATE_STORE_PIPELINE_BATCH_SIZE
+        now = time.time()
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            placeholders = ','.join('?' * len(batch))
+            yield from self.connection.execute(
+                f'SELECT key, {columns} FROM symbol_tables '
+                f'WHERE key IN ({placeholders}) '
+                f'AND (expires IS NULL OR expires > ?)',
+                batch + [now],
+            )
+
+    def get_many(self, keys):
+        values = {
+            key: bytes(value)
+            for key, value in self._select('value', list(keys))
+        }
+        return [values.get(key) for key in keys]
+
+    def get_prefixes(self, keys, length):
+        values = {
+            key: bytes(value)
+            for key, value in self._select(
+                f'substr(value, 1, {int(length)})',
+                list(keys),
+            )
+        }
+        return [values.get(key) for key in keys]
+
+    def set_many(self, items, timeout=None):
+        now = time.time()
+        expires = now + timeout if timeout else None
+        with self.connection as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO symbol_tables (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                [(key, bytes(value), expires) for key, value in items]
+            )
+            connection.execute(
+                'DELETE FROM symbol_tables WHERE expires < ?',
+                (now,)
+            )
+
+    def delete_many(self, keys):
+        with self.connection as connection:
+            connection.executemany(
+                'DELETE FROM symbol_tables WHERE key = ?',
+                [(key,) for key in keys]
+            )
+
+    def get_sizes(self, keys):
+        sizes = dict(self._select('length(value)', list(keys)))
+        return [sizes.get(key, 0) for key in keys]
+
+    def get_lease(self, key, ttl_seconds):
+        return FileLease(f'{self.location}.{hash_key(key)}.lease')
+
+    def get_used_memory(self):
+        try:
+            return os.stat(self.location).st_size
+        except FileNotFoundError:
+            return None
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_symbol_table_store():
+    """Return the SymbolTableStore instance configured by
+    settings.SYMBOLICATE_STORE_BACKEND and
+    settings.SYMBOLICATE_STORE_LOCATION. One per process."""
+    backend = settings.SYMBOLICATE_STORE_BACKEND
+    location = settings.SYMBOLICATE_STORE_LOCATION
+    with _stores_lock:
+        if (backend, location) not in _stores:
+            _stores[(backend, location)] = import_string(backend)(location)
+        return _stores[(backend, location)]
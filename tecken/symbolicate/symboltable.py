@@ -0,0 +1,364 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import struct
+import sys
+import uuid
+from array import array
+from bisect import bisect
+from collections import defaultdict
+
+
+class InvalidSymbolTable(Exception):
+    """Happens when the bytes we're asked to read as a symbol table
+    don't look like one. For example, if it was stored by an older
+    version of the code."""
+
+
+class SymbolTable:
+    """A compact, read-only, representation of all the FUNC and PUBLIC
+    offsets (and their function names) of one symbol file.
+
+    The serialized format is one single blob that looks like this::
+
+        [header]        magic, version, number of offsets, number of names
+        [offsets]       sorted unsigned 64-bit integers
+        [name indexes]  unsigned 32-bit integer per offset, pointing
+                        into the names table
+        [name starts]   unsigned 32-bit integer per name (plus one), the
+                        start position of each name in the names blob
+        [names]         all the unique function names, UTF-8 encoded
+                        and concatenated
+
+    All integers are little-endian. The point of this format is that it
+    can be stored and fetched as one single value and that it doesn't
+    need to be deserialized to be used. The offsets are bisected directly
+    from the buffer and only the function names that are actually looked
+    up ever get decoded.
+    """
+
+    MAGIC = b'TKST'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHHII')
+
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        if len(view) < self.HEADER.size:
+            raise InvalidSymbolTable('too short')
+        magic, version, _, count, names_count = self.HEADER.unpack_from(view)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise InvalidSymbolTable(f'unrecognized header {magic!r}')
+
+        position = self.HEADER.size
+        self.offsets = self._read_array(view, 'Q', position, count)
+        position += count * 8
+        self.name_indexes = self._read_array(view, 'I', position, count)
+        position += count * 4
+        self.name_starts = self._read_array(
+            view, 'I', position, names_count + 1
+        )
+        position += (names_count + 1) * 4
+        self.names = view[position:]
+        if len(self.names) != self.name_starts[-1]:
+            raise InvalidSymbolTable('truncated names')
+
+        self.buffer = buffer
+        self.nbytes = len(view)
+
+    @staticmethod
+    def _read_array(view, typecode, position, length):
+        size = struct.calcsize(typecode)
+        chunk = view[position:position + length * size]
+        if len(chunk) != length * size:
+            raise InvalidSymbolTable('truncated')
+        if sys.byteorder == 'little':
+            # Zero-copy. Indexing (and bisecting) this works just like a
+            # list of ints.
+            return chunk.cast(typecode)
+        numbers = array(typecode, chunk.tobytes())  # pragma: no cover
+        numbers.byteswap()  # pragma: no cover
+        return numbers  # pragma: no cover
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} offsets={len(self)} '
+            f'bytes={self.nbytes}>'
+        )
+
+    def get_name(self, index):
+        return self.get_name_bytes(index).decode('utf-8', 'replace')
+
+    def get_name_bytes(self, index):
+        """Return the function name, still UTF-8 encoded, of the offset
+        at this index."""
+        name_index = self.name_indexes[index]
+        start = self.name_starts[name_index]
+        end = self.name_starts[name_index + 1]
+        return bytes(self.names[start:end])
+
+    def get_nearest(self, offset):
+        """Return a tuple of (function start offset, function name) for
+        the function nearest, rounded down, to this offset.
+
+        The origin of this is that we look for offsets in a stack as
+        these are kinda like lines of code. Imagine this C++ program::
+
+            10) ...
+            11) void some_function() {
+            12)     ...
+            13)     ...
+            14)     ...
+            15) }
+            17) void other_function() {
+            18)     ...
+            19) }
+            20) ...
+
+        Here, the offsets are going to be [11, 17]. The offsets where the
+        functions are.
+        Suppose the 'offset' we're being asked to look up is 13, meaning
+        the interesting thing happened on "line" 13. The nearest "function
+        definition line" is 11. That's where the function was defined.
+        To find 11, we bisect the list of all offsets and subtract 1.
+        I.e. bisect([11, 17], 13) == p == 1
+        And [11, 17][p - 1] == 11
+        """
+        index = bisect(self.offsets, offset) - 1
+        return self.offsets[index], self.get_name(index)
+
+    def get_nearest_many(self, offsets):
+        """Return a list of (function start offset, function name) tuples,
+        one for each offset in 'offsets' and in the same order. Same as
+        calling get_nearest() for each one but faster.
+
+        The offsets are looked up in sorted order so every bisect only
+        needs to search the part of the offsets that is to the right of
+        the previous one. And every function name is only decoded once
+        even if many offsets are in the same function.
+        """
+        order = sorted(range(len(offsets)), key=offsets.__getitem__)
+        all_offsets = self.offsets
+        names = {}
+        results = [None] * len(offsets)
+        lo = 0
+        for i in order:
+            lo = bisect(all_offsets, offsets[i], lo)
+            index = lo - 1
+            try:
+                name = names[index]
+            except KeyError:
+                name = names[index] = self.get_name(index)
+            results[i] = (all_offsets[index], name)
+        return results
+
+    @classmethod
+    def from_symbol_map(cls, symbol_map):
+        """Return a SymbolTable instance from a dict of offsets (ints)
+        to function names (strings or bytes)."""
+        return cls(cls.serialize(symbol_map))
+
+    @classmethod
+    def serialize(cls, symbol_map):
+        """Return the bytes that make up a symbol table from a dict of
+        offsets (ints) to function names. The function names can either
+        be strings or bytes (that are UTF-8 encoded already)."""
+        offsets = array('Q', sorted(symbol_map))
+        name_indexes = array('I')
+        name_starts = array('I', [0])
+        names = []
+        unique_names = {}
+        position = 0
+        for offset in offsets:
+            name = symbol_map[offset]
+            try:
+                name_index = unique_names[name]
+            except KeyError:
+                name_index = unique_names[name] = len(names)
+                encoded = name
+                if isinstance(encoded, str):
+                    encoded = encoded.encode('utf-8')
+                names.append(encoded)
+                position += len(encoded)
+                name_starts.append(position)
+            name_indexes.append(name_index)
+        if sys.byteorder != 'little':  # pragma: no cover
+            for numbers in (offsets, name_indexes, name_starts):
+                numbers.byteswap()
+        return b''.join([
+            cls.HEADER.pack(
+                cls.MAGIC,
+                cls.VERSION,
+                0,
+                len(offsets),
+                len(names),
+            ),
+            offsets.tobytes(),
+            name_indexes.tobytes(),
+            name_starts.tobytes(),
+        ] + names)
+
+
+class PagedSymbolTable:
+    """A symbol table that is stored, in the Redis store, as pages instead
+    of one single value. Every page is a SymbolTable of consecutive
+    offsets. This is the (small) top-level index of those pages and,
+    optionally, some of the pages themselves.
+
+    The serialized format of the index looks like this::
+
+        [header]        magic, version, number of offsets, number of
+                        pages, generation
+        [page starts]   sorted unsigned 64-bit integers, the first
+                        offset of each page
+
+    The generation is random and is part of the keys of the pages (see
+    make_page_cache_key()) so that pages of an older symbol table, with
+    the same symbol key, are never mixed up with the new index.
+
+    That way, to look up a handful of offsets, only the index and the
+    pages those offsets are in need to be fetched. Not the whole symbol
+    table.
+    """
+
+    MAGIC = b'TKSP'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHHII16s')
+
+    def __init__(self, buffer, pages=None):
+        view = memoryview(buffer)
+        if len(view) < self.HEADER.size:
+            raise InvalidSymbolTable('too short')
+        magic, version, _, count, pages_count, generation = (
+            self.HEADER.unpack_from(view)
+        )
+        if magic != self.MAGIC or version != self.VERSION:
+            raise InvalidSymbolTable(f'unrecognized header {magic!r}')
+        self.page_starts = SymbolTable._read_array(
+            view, 'Q', self.HEADER.size, pages_count
+        )
+        if not pages_count:
+            raise InvalidSymbolTable('no pages')
+        self.count = count
+        self.generation = generation.decode('ascii')
+        self.buffer = buffer
+        # Page number to SymbolTable.
+        self.pages = pages or {}
+        self.nbytes = len(view) + sum(x.nbytes for x in self.pages.values())
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} offsets={len(self)} '
+            f'pages={len(self.pages)}/{len(self.page_starts)} '
+            f'bytes={self.nbytes}>'
+        )
+
+    def get_page_number(self, offset):
+        # Just like SymbolTable.get_nearest(), an offset that is before
+        # the first function ends up with the last one.
+        return (bisect(self.page_starts, offset) - 1) % len(self.page_starts)
+
+    def get_missing_pages(self, offsets):
+        """Return the set of page numbers, that this instance doesn't have,
+        needed to look up these offsets."""
+        return {
+            self.get_page_number(offset) for offset in offsets
+        } - set(self.pages)
+
+    def with_pages(self, pages):
+        """Return a new instance that has these pages (a dict of page
+        number to SymbolTable) on top of the ones this one has. This
+        instance, which might be shared, is left as is."""
+        all_pages = dict(self.pages)
+        all_pages.update(pages)
+        return self.__class__(self.buffer, all_pages)
+
+    def get_nearest(self, offset):
+        """See SymbolTable.get_nearest(). The page that offset is in has
+        to be in this instance."""
+        return self.pages[self.get_page_number(offset)].get_nearest(offset)
+
+    def get_nearest_many(self, offsets):
+        """See SymbolTable.get_nearest_many(). The pages those offsets
+        are in have to be in this instance."""
+        pages_positions = defaultdict(list)
+        for i, offset in enumerate(offsets):
+            pages_positions[self.get_page_number(offset)].append(i)
+        results = [None] * len(offsets)
+        for page_number, positions in pages_positions.items():
+            nearest = self.pages[page_number].get_nearest_many(
+                [offsets[i] for i in positions]
+            )
+            for i, result in zip(positions, nearest):
+                results[i] = result
+        return results
+
+    @classmethod
+    def serialize(cls, symbol_table, page_size):
+        """Return a tuple of (generation, the bytes of the index, a list
+        of the bytes of every page) that make up this SymbolTable split
+        into pages of (at most) 'page_size' offsets."""
+        page_starts = array('Q')
+        pages = []
+        offsets = symbol_table.offsets
+        for start in range(0, len(offsets), page_size):
+            page_starts.append(offsets[start])
+            pages.append(SymbolTable.serialize({
+                offsets[i]: symbol_table.get_name_bytes(i)
+                for i in range(start, min(start + page_size, len(offsets)))
+            }))
+        if sys.byteorder != 'little':  # pragma: no cover
+            page_starts.byteswap()
+        generation = uuid.uuid4().hex[:16]
+        index = cls.HEADER.pack(
+            cls.MAGIC,
+            cls.VERSION,
+            0,
+            len(offsets),
+            len(pages),
+            generation.encode('ascii'),
+        ) + page_starts.tobytes()
+        return generation, index, pages
+
+    @classmethod
+    def get_page_cache_keys(cls, cache_key, header):
+        """Return the cache keys of all the pages of the index, stored as
+        'cache_key', that starts with these (at least HEADER.size) bytes.
+        An empty list if it's not a PagedSymbolTable index."""
+        if header is None or len(header) < cls.HEADER.size:
+            return []
+        magic, version, _, _, pages_count, generation = (
+            cls.HEADER.unpack_from(header)
+        )
+        if magic != cls.MAGIC or version != cls.VERSION:
+            return []
+        generation = generation.decode('ascii')
+        return [
+            make_page_cache_key(cache_key, generation, page_number)
+            for page_number in range(pages_count)
+        ]
+
+
+def make_page_cache_key(cache_key, generation, page_number):
+    """Return the cache key of one page of a PagedSymbolTable whose own
+    cache key is 'cache_key'."""
+    return f'{cache_key}:page:{generation}:{page_number}'
+
+
+def read_symbol_table(buffer):
+    """Return a SymbolTable, or PagedSymbolTable, instance depending on
+    what these bytes, as stored in the Redis store, are."""
+    if bytes(buffer[:len(PagedSymbolTable.MAGIC)]) == PagedSymbolTable.MAGIC:
+        return PagedSymbolTable(buffer)
+    return SymbolTable(buffer)
+
+
+# When a symbol file can't be found (or is empty) we still store an empty
+# symbol table so that we don't try to download it again and again.
+EMPTY_SYMBOL_TABLE = SymbolTable.serialize({})
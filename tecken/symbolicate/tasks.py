@@ -2,11 +2,163 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, you can obtain one at http://mozilla.org/MPL/2.0/.
 
+import logging
+
+import markus
 from celery import shared_task
 
-from tecken.symbolicate.utils import invalidate_symbolicate_cache
+from django.conf import settings
+from django.core.cache import cache
+
+from tecken.symbolicate import views
+from tecken.symbolicate.popularity import get_hot_modules
+from tecken.symbolicate.storage import get_symbol_table_store
+from tecken.symbolicate.utils import (
+    invalidate_symbolicate_cache,
+    make_symbol_key_cache_key,
+)
+
+logger = logging.getLogger('tecken')
+metrics = markus.get_metrics('tecken')
+
+# Number of symbol keys currently waiting to be prebuilt.
+PREBUILD_QUEUED_CACHE_KEY = 'symbolicate:prebuild:queued'
 
 
 @shared_task
 def invalidate_symbolicate_cache_task(symbol_keys):
     invalidate_symbolicate_cache(symbol_keys)
+
+
+def queue_prebuild_symbolicate_cache(symbol_keys):
+    """Send these symbol keys to the prebuild_symbolicate_cache_task unless
+    there are already too many waiting to be prebuilt
+    (see settings.SYMBOLICATE_PREBUILD_MAX_QUEUED). Return True if it
+    was queued. If it wasn't, it's up to the caller to invalidate the
+    symbol keys."""
+    count = len(symbol_keys)
+    try:
+        queued = cache.incr(PREBUILD_QUEUED_CACHE_KEY, count)
+    except ValueError:
+        # In case tasks get lost, don't let the count live forever.
+        cache.set(PREBUILD_QUEUED_CACHE_KEY, count, 60 * 60)
+        queued = count
+    if queued > settings.SYMBOLICATE_PREBUILD_MAX_QUEUED:
+        _decrement_prebuild_queued(count)
+        logger.warning(
+            f'Too many ({queued - count}) symbol tables already queued to '
+            f'be prebuilt. Skipping {count}.'
+        )
+        metrics.incr('symbolicate_prebuild_skipped', count)
+        return False
+    metrics.gauge('symbolicate_prebuild_queued', queued)
+    prebuild_symbolicate_cache_task.delay(symbol_keys)
+    return True
+
+
+def _decrement_prebuild_queued(count):
+    try:
+        cache.decr(PREBUILD_QUEUED_CACHE_KEY, count)
+    except ValueError:
+        # It has expired.
+        pass
+
+
+@shared_task
+@metrics.timer_decorator('symbolicate_prebuild')
+def prebuild_symbolicate_cache_task(symbol_keys):
+    """Invalidate and then download, parse and store the symbol tables
+    of these symbol keys so they're ready before any symbolication
+    request needs them."""
+    # When serialized for Celery, the tuples become lists.
+    symbol_keys = [tuple(symbol_key) for symbol_key in symbol_keys]
+    try:
+        invalidate_symbolicate_cache(symbol_keys)
+        symbolicator = views.SymbolicateJSON(views.downloader)
+        loaded = symbolicator.load_symbols(
+            symbol_keys,
+            timeout=settings.CELERY_TASK_SOFT_TIME_LIMIT,
+        )
+        built = sum(bool(info['symbol_table']) for _, info in loaded)
+        metrics.incr('symbolicate_prebuild_built', built)
+        if built < len(symbol_keys):
+            metrics.incr(
+                'symbolicate_prebuild_failed',
+                len(symbol_keys) - built
+            )
+    finally:
+        _decrement_prebuild_queued(len(symbol_keys))
+
+
+def prewarm_symbolicate_cache(limit=None, max_bytes=None):
+    """Download, parse and store the symbol tables of the most popular
+    modules (see get_hot_modules()) that aren't already in the Redis
+    store. Up to 'limit' modules (default
+    settings.SYMBOLICATE_PREWARM_TOP_N) and till the symbol tables of the
+    most popular modules, already stored or not, add up to 'max_bytes'
+    (default settings.SYMBOLICATE_PREWARM_MAX_BYTES).
+
+    The downloads happen concurrently, in batches, so the last batch
+    might go over the budget a little.
+
+    Return a dict of the number of modules 'stored' (and their total
+    size) and 'skipped' because they were already there.
+    """
+    if limit is None:
+        limit = settings.SYMBOLICATE_PREWARM_TOP_N
+    if max_bytes is None:
+        max_bytes = settings.SYMBOLICATE_PREWARM_MAX_BYTES
+    symbol_keys = [
+        symbol_key for symbol_key, _ in get_hot_modules(limit)
+    ]
+    summary = {'stored': 0, 'skipped': 0, 'size': 0}
+    if not symbol_keys:
+        return summary
+
+    # Find out, in one round-trip, which are already in the store and
+    # how big they are.
+    sizes = get_symbol_table_store().get_sizes([
+        make_symbol_key_cache_key(symbol_key) for symbol_key in symbol_keys
+    ])
+
+    needs_to_be_stored = []
+    used_bytes = 0
+    for symbol_key, size in zip(symbol_keys, sizes):
+        if size:
+            used_bytes += size
+            summary['skipped'] += 1
+        else:
+            needs_to_be_stored.append(symbol_key)
+
+    symbolicator = views.SymbolicateJSON(views.downloader)
+    batch_size = settings.SYMBOLICATE_DOWNLOAD_MAX_WORKERS
+    while needs_to_be_stored and used_bytes < max_bytes:
+        batch = needs_to_be_stored[:batch_size]
+        needs_to_be_stored = needs_to_be_stored[batch_size:]
+        loaded = symbolicator.load_symbols(
+            batch,
+            timeout=settings.CELERY_TASK_SOFT_TIME_LIMIT,
+        )
+        for _, information in loaded:
+            symbol_table = information['symbol_table']
+            if symbol_table:
+                used_bytes += symbol_table.nbytes
+                summary['stored'] += 1
+                summary['size'] += symbol_table.nbytes
+    metrics.incr('symbolicate_prewarm_stored', summary['stored'])
+    metrics.incr('symbolicate_prewarm_skipped', summary['skipped'])
+    logger.info(
+        'Pre-warmed {} symbol tables ({:,} bytes). {} were already '
+        'stored.'.format(
+            summary['stored'],
+            summary['size'],
+            summary['skipped'],
+        )
+    )
+    return summary
+
+
+@shared_task
+@metrics.timer_decorator('symbolicate_prewarm')
+def prewarm_symbolicate_cache_task(limit=None, max_bytes=None):
+    prewarm_symbolicate_cache(limit=limit, max_bytes=max_bytes)
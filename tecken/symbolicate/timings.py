@@ -0,0 +1,93 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import markus
+
+
+metrics = markus.get_metrics('tecken')
+
+# The stages of a symbolication request, in the order they happen.
+# * 'lookup' - finding the symbol tables in the in-memory cache, disk
+#   cache or Redis store
+# * 'download' - wall-clock time of downloading (and parsing and storing)
+#   the symbol tables that weren't found, concurrently
+# * 'fetch' - total time, across all downloads, spent waiting on the
+#   network
+# * 'parse' - total CPU time, across all downloads, spent parsing
+# * 'store' - total time, across all downloads, spent writing to the
+#   Redis store
+# * 'resolve' - finding the function of every module offset
+# * 'assemble' - making and serializing the response
+STAGES = (
+    'lookup',
+    'download',
+    'fetch',
+    'parse',
+    'store',
+    'resolve',
+    'assemble',
+)
+
+
+def thread_cpu_time():
+    """Return the CPU time, in seconds, of the current thread."""
+    return time.clock_gettime(time.CLOCK_THREAD_CPUTIME_ID)
+
+
+class StageTimings:
+    """Accumulates how much time a symbolication request spent in each
+    of its stages (see STAGES). The downloads happen in threads so
+    everything is thread-safe."""
+
+    def __init__(self):
+        self._durations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        assert stage in STAGES, stage
+        with self._lock:
+            self._durations[stage] = (
+                self._durations.get(stage, 0.0) + seconds
+            )
+
+    @contextmanager
+    def timer(self, stage):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.time() - t0)
+
+    def items(self):
+        """Return a list of (stage, seconds) in the order of STAGES, for
+        those stages that happened."""
+        with self._lock:
+            durations = dict(self._durations)
+        return [
+            (stage, durations[stage])
+            for stage in STAGES
+            if stage in durations
+        ]
+
+    def emit(self, version):
+        """Send each stage's time as a histogram tagged by API version."""
+        for stage, seconds in self.items():
+            metrics.histogram(
+                'symbolicate_stage',
+                seconds * 1000,
+                tags=[f'stage:{stage}', f'version:{version}']
+            )
+
+    def server_timing_header(self):
+        """Return the value for a 'Server-Timing' response header.
+        See https://www.w3.org/TR/server-timing/"""
+        return ', '.join(
+            '{};dur={:.2f}'.format(stage, seconds * 1000)
+            for stage, seconds in self.items()
+        )
@@ -4,9 +4,17 @@
 
 import hashlib
 
-from django.core.cache import caches
+from django_redis import get_redis_connection
+
 from django.conf import settings
 
+from .diskcache import symbol_table_disk_cache
+from .framecache import frame_cache
+from .invalidation import record_invalidations
+from .memorycache import symbol_table_cache
+from .storage import get_symbol_table_store
+from .symboltable import PagedSymbolTable
+
 
 def make_symbol_key_cache_key_default_prefix():
     """Return a string that is an appropriate non-empty prefix for the
@@ -40,18 +48,72 @@ def make_symbol_key_cache_key(symbol_key, prefix=None):
     return 'symbol:{}:{}/{}'.format(prefix, *symbol_key)
 
 
+def make_symbol_filename(lib_filename):
+    """Return the name of the .sym file that symbolication downloads
+    for a library filename. E.g. 'xul.pdb' -> 'xul.sym' and
+    'libxul.so' -> 'libxul.so.sym'."""
+    if lib_filename.endswith('.pdb'):
+        return lib_filename[:-4] + '.sym'
+    return lib_filename + '.sym'
+
+
+def get_stats_redis_connection():
+    """Return the Redis connection where statistics about the modules
+    (e.g. their popularity) are kept. See settings.SYMBOLICATE_STATS_CACHE.
+    """
+    return get_redis_connection(settings.SYMBOLICATE_STATS_CACHE)
+
+
+def get_stored_page_cache_keys(cache_keys):
+    """Return the cache keys of the pages of those of these cache keys
+    that are stored as a PagedSymbolTable index. Only the header of each
+    is read, not the whole value."""
+    headers = get_symbol_table_store().get_prefixes(
+        cache_keys,
+        PagedSymbolTable.HEADER.size,
+    )
+    page_cache_keys = []
+    for cache_key, header in zip(cache_keys, headers):
+        page_cache_keys.extend(
+            PagedSymbolTable.get_page_cache_keys(cache_key, header)
+        )
+    return page_cache_keys
+
+
+def replace_stored_symbol_table(cache_key, items, timeout=None):
+    """Store these (key, value) tuples, that make up the symbol table of
+    this cache key, and delete the pages of whatever was stored there
+    before. Otherwise they'd be left behind, under a generation nobody
+    will ever ask for again, until the store evicts them (which only the
+    Redis LRU does)."""
+    symbol_table_store = get_symbol_table_store()
+    old_page_cache_keys = get_stored_page_cache_keys([cache_key])
+    symbol_table_store.set_many(items, timeout=timeout)
+    new_keys = set(key for key, _ in items)
+    symbol_table_store.delete_many([
+        key for key in old_page_cache_keys if key not in new_keys
+    ])
+
+
 def invalidate_symbolicate_cache(symbol_keys, prefix=None):
     """Makes sure all symbolication caching stored for this list of
-    symbol keys is removed from the Redis store."""
+    symbol keys is removed from the store."""
     all_keys = []
     for symbol_key in symbol_keys:
-        # Every symbol, for the sake of symbolication, is stored in two
-        # ways:
-        # 1) symbol_key + ':keys'  (plain SET)
-        # 2) symbol_key (as hashmap)
+        # Every symbol, for the sake of symbolication, is stored as one
+        # single symbol table value.
         cache_key = make_symbol_key_cache_key(symbol_key, prefix=prefix)
-        all_keys.append(cache_key)  # the hashmap
-        all_keys.append(cache_key + ':keys')  # the list of all offsets
+        all_keys.append(cache_key)
+
+    # The pages too, if any of them is stored as pages plus an index.
+    get_symbol_table_store().delete_many(
+        get_stored_page_cache_keys(all_keys) + all_keys
+    )
 
-    store = caches['store']
-    store.delete_many(all_keys)
+    # Also evict them from this process's in-memory caches, and this
+    # host's disk cache, if they have them. Every other process does the
+    # same when it next polls for invalidations.
+    symbol_table_cache.evict(all_keys)
+    symbol_table_disk_cache.evict(all_keys)
+    frame_cache.evict(all_keys)
+    record_invalidations(all_keys)
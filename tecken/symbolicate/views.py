@@ -2,12 +2,14 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, you can obtain one at http://mozilla.org/MPL/2.0/.
 
+import concurrent.futures
 import datetime
+import math
 import time
 import logging
-import re
-from bisect import bisect
+import zlib
 from functools import wraps
+from io import BytesIO
 from collections import defaultdict
 
 import markus
@@ -15,25 +17,60 @@ import ujson as json
 import requests
 import botocore
 
-from django_redis import get_redis_connection
-
 from django import http
 from django.conf import settings
 from django.http import HttpResponse
-from django.core.cache import caches, cache
+from django.core.cache import cache
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
 
 from tecken.base.symboldownloader import (
     SymbolDownloader,
     SymbolNotFound,
 )
 from tecken.base.decorators import set_request_debug, set_cors_headers
-from .utils import make_symbol_key_cache_key
+from .accounting import record_symbol_table_stored, used_memory_gauge
+from .diskcache import symbol_table_disk_cache
+from .downloadexecutor import RequestDownloads
+from .framecache import frame_cache
+from .invalidation import invalidation_poller
+from .memorycache import symbol_table_cache
+from .parseexecutor import parse_executor
+from .parser import parse_symbol_table
+from .popularity import increment_module_popularity
+from .storage import get_symbol_table_store
+from .symboltable import (
+    EMPTY_SYMBOL_TABLE,
+    InvalidSymbolTable,
+    PagedSymbolTable,
+    SymbolTable,
+    make_page_cache_key,
+    read_symbol_table,
+)
+from .timings import StageTimings, thread_cpu_time
+from .utils import (
+    make_symbol_filename,
+    make_symbol_key_cache_key,
+    replace_stored_symbol_table,
+)
 
 
 logger = logging.getLogger('tecken')
 metrics = markus.get_metrics('tecken')
-store = caches['store']
+
+# When waiting for someone else to download a symbol file, this is how
+# often the store is checked.
+LEASE_POLL_INTERVAL_SECONDS = 0.1
+
+# The request body can be compressed with any of these. The values are the
+# 'wbits' zlib needs to decompress them.
+CONTENT_ENCODING_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+# How much of the request body is read at a time.
+REQUEST_BODY_CHUNK_SIZE = 64 * 1024
 
 downloader = SymbolDownloader(
     settings.SYMBOL_URLS + [settings.UPLOAD_TRY_SYMBOLS_URL],
@@ -81,6 +118,17 @@ class JsonResponse(HttpResponse):
         super().__init__(content=data, **kwargs)
 
 
+def stream_json_results(results):
+    """Yield the JSON serialization, piece by piece, of a dict that looks
+    like '{"results": [...]}' where 'results' is an iterator."""
+    yield b'{"results":['
+    for i, result in enumerate(results):
+        if i:
+            yield b','
+        yield json.dumps(result).encode('utf-8')
+    yield b']}'
+
+
 def get_symbolication_count_key(prefix, dateobj):
     date = dateobj.strftime('%Y%m%d')
     return f'symbolicationcount:{prefix}:{date}'
@@ -95,132 +143,493 @@ def increment_symbolication_count(prefix):
 
 
 class SymbolicateJSON:
-    def __init__(self, downloader, debug=False):
+    def __init__(
+        self,
+        downloader,
+        debug=False,
+        time_budget=None,
+        download_timeout=None,
+    ):
         self.downloader = downloader
         self.debug = debug
-
-        # These dicts fill up as we either query the Redis store or
+        # If set, the number of seconds, from now, we're willing to spend.
+        # Whatever is still being downloaded when that runs out carries on
+        # in the background and is reported as "pending".
+        self.deadline = None
+        if time_budget is not None:
+            self.deadline = time.time() + time_budget
+        # The number of seconds we're willing to wait for the downloads,
+        # math.inf for as long as it takes. Unless the deadline comes
+        # first.
+        if download_timeout is None:
+            download_timeout = settings.SYMBOLICATE_DOWNLOAD_TIMEOUT_SECONDS
+        self.download_timeout = download_timeout
+        # The symbol keys whose symbol table was still being downloaded
+        # when we stopped waiting.
+        self.pending_symbol_keys = set()
+        # Never more than so many downloads at a time, of the thread pool
+        # every request in this process shares.
+        self.downloads = RequestDownloads()
+        # How much time is spent in each stage. Always on, regardless
+        # of 'debug', because it's cheap.
+        self.timings = StageTimings()
+        # All the symbol keys that any of the symbolicated stacks needed.
+        self.symbol_keys_needed = set()
+
+        # This dict fills up as we either query the Redis store or
         # download from S3.
-        # By keeping them as class instance attributes, they stay
+        # By keeping it as a class instance attribute, it stays
         # around between multiple symbolication requests.
-        self.all_symbol_offsets = {}
-        self.all_symbol_maps = {}
-
-    def add_to_symbols_offsets(self, key, offsets, symbol_map=None):
-        self.all_symbol_offsets[key] = sorted(offsets)
-
-        # IF we had to download the symbol file, and parse it, let's
-        # keep it around. This is an optimization technique.
-        # Normally, a download from the Internet results in us stuffing
-        # the Redis store with with all its values, then we actually
-        # doing the symbolication process we query the Redis store for
-        # each symbol key and offset. But if we already have it all
-        # here in memory (because of the download), let's keep it and
-        # save some Redis store queries.
-        if symbol_map:
-            self.all_symbol_maps[key] = symbol_map
+        self.all_symbol_tables = {}
 
     def symbolicate(self, stacks, memory_map):
-        # the result we will populate
-        result = {
-            'symbolicatedStacks': [],
-            'knownModules': [None] * len(memory_map),
-        }
+        result, = self.symbolicate_many([(stacks, memory_map)])
+        return result
 
+    def symbolicate_many(self, jobs):
+        """Return a list of results, one for each job. Each job is a
+        tuple of (stacks, memory map). See iter_symbolicate_many()."""
+        return list(self.iter_symbolicate_many(jobs))
+
+    def iter_symbolicate_many(self, jobs):
+        """Return an iterator of results, one for each job. Each job is a
+        tuple of (stacks, memory map).
+
+        All the modules, and all their offsets, needed by all the jobs are
+        collected first. Then they're looked up (in the caches) and
+        downloaded once. And every distinct offset of every module is
+        only resolved once. Lastly, that's fanned out to each job's result.
+        That way, a batch of jobs that all share the same big modules
+        (e.g. 'xul.pdb') costs barely more than one job.
+
+        All the looking up and downloading happens before this returns,
+        so that's when any (operational) exceptions are raised. But each
+        job's result is only made when the iterator gets to it. So, if
+        the results are consumed one at a time, only one of them needs
+        to be in memory at a time.
+        """
         # Record the total time it took to symbolicate
         t0 = time.time()
 
-        cache_lookup_times = []
-        download_times = []
-        download_sizes = []
-        modules_lookups = {}
+        # Before trusting any of the caches, evict whatever other
+        # processes have invalidated since we last checked.
+        invalidation_poller.poll()
+
+        # For each job, a dict of the symbol keys and each's module index
+        # in that job's memory map.
+        jobs_modules_lookups = []
+        # All the distinct offsets, per symbol key, across all jobs.
+        all_module_offsets = defaultdict(set)
+        for stacks, memory_map in jobs:
+            modules_lookups = {}
+            for stack in stacks:
+                for module_index, module_offset in stack:
+                    if module_index < 0:
+                        continue
+                    filename, debug_id = memory_map[module_index]
+                    symbol_key = (filename, debug_id)
+                    modules_lookups[symbol_key] = module_index
+                    all_module_offsets[symbol_key].add(module_offset)
+            jobs_modules_lookups.append(modules_lookups)
+        self.symbol_keys_needed.update(all_module_offsets)
+
+        # The result is a dict, per symbol key, of each module offset
+        # to a tuple of (function start offset, function name).
+        nearest_functions = {}
+        # Per symbol key, the module offsets that were in the frame cache.
+        cached_offsets = {}
+        for symbol_key, offsets in all_module_offsets.items():
+            if symbol_key in self.all_symbol_tables:
+                continue
+            found = frame_cache.get_many(
+                self._make_cache_key(symbol_key),
+                offsets,
+            )
+            if found:
+                nearest_functions[symbol_key] = found
+                cached_offsets[symbol_key] = set(found)
 
         # First look up all symbols that we're going to need so that
-        # when it's time to really loop over `self.stacks` the
-        # 'self.all_symbol_offsets' should be fully populated as well as it
-        # can be.
-        needs_to_be_downloaded = set()
-        for stack in stacks:
-            for module_index, module_offset in stack:
-                if module_index < 0:
-                    continue
-                filename, debug_id = memory_map[module_index]
-                symbol_key = (filename, debug_id)
-                # Keep a dict of the symbol keys and each's module index
-                modules_lookups[symbol_key] = module_index
+        # when it's time to really loop over the stacks the
+        # 'self.all_symbol_tables' should be fully populated as well as it
+        # can be. Modules whose every offset was in the frame cache
+        # don't need their symbol table at all.
+        loaded = self.load_symbol_tables([
+            symbol_key for symbol_key, offsets in all_module_offsets.items()
+            if symbol_key not in self.all_symbol_tables and
+            len(cached_offsets.get(symbol_key, ())) < len(offsets)
+        ])
+        # Paged symbol tables only come with the pages that the offsets,
+        # that weren't in the frame cache, are in.
+        self.load_symbol_table_pages(
+            {
+                symbol_key: offsets - cached_offsets.get(symbol_key, set())
+                for symbol_key, offsets in all_module_offsets.items()
+            },
+            loaded,
+        )
 
-        # get_symbol_offsets() takes a list of symbol keys, returns a
-        # dict that contains a dict called 'symbols'. Each key, in it,
-        # is the symbol key and the values is the complete list of
-        # ALL keys we have for that symbol key.
-        # E.g. `informations['symbols'][('xul.pdb', 'HEX')] == [45110, 130109]`
-        # If, for a particular symbol key we didn't have anything in the
-        # Redis store, the value is None.
-        needed_modules_lookups = {
-            key: modules_lookups[key] for key in modules_lookups
-            if key not in self.all_symbol_offsets
+        # A module whose symbol table turned out to be empty (i.e. it's
+        # known to be missing) can't have any frames either. Whatever was
+        # in the frame cache for it is left over from before it was
+        # invalidated.
+        for symbol_key in list(cached_offsets):
+            symbol_table = self.all_symbol_tables.get(symbol_key)
+            if (
+                symbol_table is not None and
+                not symbol_table and
+                symbol_key not in self.pending_symbol_keys
+            ):
+                del cached_offsets[symbol_key]
+                del nearest_functions[symbol_key]
+
+        t0_resolve = time.time()
+        # Look up all the (remaining) offsets of each module in one go.
+        # This way each symbol table only needs to be found once and the
+        # offsets can be looked up in order (see
+        # SymbolTable.get_nearest_many()).
+        for symbol_key, offsets in all_module_offsets.items():
+            symbol_table = self.all_symbol_tables.get(symbol_key)
+            # If there was no symbol table, the symbol could ultimately
+            # not be found, at all. There's no point trying to figure out
+            # what the signature is.
+            if symbol_table:
+                # Even if our module offset isn't in that list,
+                # there is still hope to be able to find the
+                # nearest signature.
+                offsets = list(offsets - cached_offsets.get(symbol_key, set()))
+                resolved = dict(zip(
+                    offsets,
+                    symbol_table.get_nearest_many(offsets)
+                ))
+                frame_cache.set_many(
+                    self._make_cache_key(symbol_key),
+                    resolved,
+                )
+                nearest_functions.setdefault(symbol_key, {}).update(resolved)
+        self.timings.add('resolve', time.time() - t0_resolve)
+
+        return self._iter_results(
+            jobs,
+            jobs_modules_lookups,
+            nearest_functions,
+            cached_offsets,
+            loaded,
+            t0,
+        )
+
+    def _iter_results(
+        self,
+        jobs,
+        jobs_modules_lookups,
+        nearest_functions,
+        cached_offsets,
+        loaded,
+        t0,
+    ):
+        # In the debug output, whatever was done to load a symbol table
+        # is accounted for in the first job that needed it.
+        accounted_for = set()
+        cache_lookups_accounted_for = False
+        total_stacks = real_stacks = 0
+        for (stacks, memory_map), modules_lookups in zip(
+            jobs,
+            jobs_modules_lookups
+        ):
+            result = self._make_result(
+                stacks,
+                memory_map,
+                modules_lookups,
+                nearest_functions,
+                cached_offsets,
+            )
+            total_stacks += result.pop('total_stacks')
+            real_stacks += result.pop('real_stacks')
+            if self.debug:
+                new_symbol_keys = set(modules_lookups) - accounted_for
+                accounted_for.update(new_symbol_keys)
+                cache_lookups = []
+                if (
+                    not cache_lookups_accounted_for and
+                    new_symbol_keys & loaded['store_lookups']
+                ):
+                    cache_lookups = loaded['cache_lookups']
+                    cache_lookups_accounted_for = True
+                downloads = [
+                    loaded['downloads'][symbol_key]
+                    for symbol_key in new_symbol_keys
+                    if symbol_key in loaded['downloads']
+                ]
+                download_times = [
+                    x['download_time'] for x in downloads
+                    if 'download_time' in x
+                ]
+                download_sizes = [
+                    x['download_size'] for x in downloads
+                    if 'download_size' in x
+                ]
+                result['debug'].update({
+                    'time': time.time() - t0,
+                    'cache_lookups': {
+                        # Each Redis pipeline is one round-trip.
+                        'count': len(cache_lookups),
+                        'time': float(sum(x['time'] for x in cache_lookups)),
+                        'pipelines': cache_lookups,
+                    },
+                    'memory_cache': {
+                        'hits': len(
+                            new_symbol_keys & loaded['memory_cache_hits']
+                        ),
+                    },
+                    'disk_cache': {
+                        'hits': len(
+                            new_symbol_keys & loaded['disk_cache_hits']
+                        ),
+                    },
+                    'downloads': {
+                        'count': len(download_times),
+                        'time': float(sum(download_times)),
+                        'size': float(sum(download_sizes)),
+                    }
+                })
+            yield result
+
+        t1 = time.time()
+
+        logger.info(
+            'The whole symbolication of {} ({} actual) '
+            'stacks took {:.4f} seconds'.format(
+                total_stacks,
+                real_stacks,
+                t1 - t0,
+            )
+        )
+
+    def load_symbol_tables(self, symbol_keys):
+        """Look up, and if need be download, the symbol table of each
+        of these symbol keys and put them into 'self.all_symbol_tables'.
+
+        Return a dict, for the sake of the debug output, that contains:
+            * 'cache_lookups' - list of Redis store pipelines (see
+              get_symbol_tables())
+            * 'store_lookups' - set of symbol keys looked up in the store
+            * 'memory_cache_hits' - set of symbol keys found in memory
+            * 'disk_cache_hits' - set of symbol keys found on disk
+            * 'downloads' - dict of symbol key to download information
+        """
+        loaded = {
+            'cache_lookups': [],
+            'store_lookups': set(),
+            'memory_cache_hits': set(),
+            'disk_cache_hits': set(),
+            'downloads': {},
         }
+        if not symbol_keys:
+            return loaded
+
+        # get_symbol_tables() takes a list of symbol keys, returns a
+        # dict that contains a dict called 'symbols'. Each key, in it,
+        # is the symbol key and the value is a dict that contains the
+        # SymbolTable instance if we had it in the Redis store.
+        with self.timings.timer('lookup'):
+            informations = self.get_symbol_tables(symbol_keys)
+
+        # Hit or miss, there was a cache (Redis store) lookup.
+        if self.debug:
+            loaded['cache_lookups'] = informations['cache_lookups']
+            loaded['memory_cache_hits'] = informations['memory_cache_hits']
+            loaded['disk_cache_hits'] = informations['disk_cache_hits']
+            loaded['store_lookups'] = (
+                set(symbol_keys) -
+                loaded['memory_cache_hits'] -
+                loaded['disk_cache_hits']
+            )
 
-        if needed_modules_lookups:
-            informations = self.get_symbol_offsets(needed_modules_lookups)
+        # Now loop over every symbol looked up from get_symbol_tables()
+        # Expect that, for every symbol, there is something. Even
+        # though it might be empty. If it's empty (i.e. no 'symbol_table'
+        # key) it means we looked in the cache but it not in the cache.
+        needs_to_be_downloaded = []
+        for symbol_key in informations['symbols']:
+            information = informations['symbols'][symbol_key]
+            if 'symbol_table' in information:
+                # We were able to look it up from cache.
+                # But even though it was in cache it might have just
+                # been cached temporarily because it has previously
+                # failed. Then the symbol table is empty.
+                self.all_symbol_tables[symbol_key] = (
+                    information['symbol_table']
+                )
+            else:
+                # These are the symbols that we're going to have to
+                # download from the Internet.
+                needs_to_be_downloaded.append(symbol_key)
+
+        # Now let's go ahead and download the symbols that need to be
+        # fetch from the Internet.
+        if needs_to_be_downloaded:
+            # The self.load_symbols() method can cope
+            # with 'needs_to_be_downloaded' being an empty list, as
+            # there is simply nothing to do.
+            # But we avoid the call since it has a timer on it. Otherwise
+            # we get many timer timings that are unrealistically small
+            # which makes it hard to see how long it takes.
+            self.download_symbol_tables(needs_to_be_downloaded, loaded)
+        return loaded
+
+    def download_symbol_tables(self, symbol_keys, loaded):
+        """Download (see load_symbols()) these symbol tables and put them
+        into 'self.all_symbol_tables'. But never wait beyond the deadline,
+        if there is one. 'loaded' is the dict returned by
+        load_symbol_tables() and it's updated with the downloads."""
+        timeout = self.download_timeout
+        if self.deadline is not None:
+            timeout = max(0.0, min(timeout, self.deadline - time.time()))
+        with self.timings.timer('download'):
+            downloaded = self.load_symbols(symbol_keys, timeout=timeout)
+        for symbol_key, information in downloaded:
+            self.all_symbol_tables[symbol_key] = information['symbol_table']
+            if information.get('pending'):
+                self.pending_symbol_keys.add(symbol_key)
+            loaded['downloads'][symbol_key] = information
+
+    def load_symbol_table_pages(self, module_offsets, loaded, retry=True):
+        """Make sure that every PagedSymbolTable in 'self.all_symbol_tables'
+        has all the pages it needs to look up these offsets. 'module_offsets'
+        is a dict of symbol key to a set of offsets.
+
+        The pages are looked up in the in-memory cache first and the rest
+        are fetched, for all symbol keys, from the store at once.
+        If a page is gone from the store (e.g. evicted by the LRU),
+        that symbol table is downloaded again and, if that too is paged
+        (e.g. someone else was already downloading it and we got the index
+        they hadn't overwritten yet), its pages are fetched once more. If
+        they're still missing, the module is treated as pending.
+        'loaded' is the dict returned by load_symbol_tables() and it's
+        updated with whatever was done here.
+        """
+        needed = {}
+        pages = defaultdict(dict)
+        for symbol_key, offsets in module_offsets.items():
+            symbol_table = self.all_symbol_tables.get(symbol_key)
+            if not isinstance(symbol_table, PagedSymbolTable):
+                continue
+            cache_key = self._make_cache_key(symbol_key)
+            for page_number in symbol_table.get_missing_pages(offsets):
+                page_cache_key = make_page_cache_key(
+                    cache_key,
+                    symbol_table.generation,
+                    page_number,
+                )
+                page = symbol_table_cache.get(page_cache_key)
+                if page is None:
+                    needed[page_cache_key] = (symbol_key, page_number)
+                else:
+                    pages[symbol_key][page_number] = page
+        if not needed and not pages:
+            return
 
-            # Hit or miss, there was a cache (Redis store) lookup.
+        incomplete = set()
+        if needed:
+            with self.timings.timer('lookup'):
+                t0 = time.time()
+                values = get_symbol_table_store().get_many(list(needed))
+                t1 = time.time()
+            metrics.timing('symbolicate_store_pipeline', (t1 - t0) * 1000)
             if self.debug:
-                cache_lookup_times.extend(
-                    informations['cache_lookup_times']
+                loaded['cache_lookups'].append({
+                    'time': t1 - t0,
+                    'keys': len(needed),
+                    'commands': count_commands(len(needed)),
+                })
+                loaded['store_lookups'].update(
+                    symbol_key for symbol_key, _ in needed.values()
                 )
+            for (page_cache_key, (symbol_key, page_number)), value in zip(
+                needed.items(),
+                values
+            ):
+                page = None
+                if value is not None:
+                    try:
+                        page = SymbolTable(value)
+                    except InvalidSymbolTable:
+                        logger.warning(
+                            f'Invalid symbol table page stored for '
+                            f'{page_cache_key}'
+                        )
+                if page is None:
+                    incomplete.add(symbol_key)
+                    continue
+                symbol_table_cache.set(page_cache_key, page)
+                pages[symbol_key][page_number] = page
+            metrics.incr(
+                'symbolicate_store_page',
+                len(needed) - len(incomplete),
+                tags=['cache:hit']
+            )
 
-            # Now loop over every symbol looked up from get_symbol_offsets()
-            # Expect that, for every symbol, there is something. Even
-            # though it might be empty. If it's empty (i.e. no 'symbol_map'
-            # key) it means we looked in the cache but it not in the cache.
-            for symbol_key in informations['symbols']:
-                module_index = modules_lookups[symbol_key]
-                information = informations['symbols'][symbol_key]
-                if 'symbol_offsets' in information:
-                    # We were able to look it up from cache.
-                    symbol_offsets = information['symbol_offsets']
-                    # But even though it was in cache it might have just
-                    # been cached temporarily because it has previously
-                    # failed.
-                    found = information['found']
-
-                    # If it was successfully fetched from cache,
-                    # these metrics will be available.
-                    result['knownModules'][module_index] = found
-                    self.add_to_symbols_offsets(symbol_key, symbol_offsets)
-                else:
-                    # These are the symbols that we're going to have to
-                    # download from the Internet.
-                    needs_to_be_downloaded.add((
-                        symbol_key,
-                        module_index
-                    ))
-
-            # Now let's go ahead and download the symbols that need to be
-            # fetch from the Internet.
-            if needs_to_be_downloaded:
-                # The self.load_symbols() method can cope
-                # with 'needs_to_be_downloaded' being an empty list, as
-                # there is simply nothing to do.
-                # But we avoid the call since it has a timer on it. Otherwise
-                # we get many timer timings that are unrealistically small
-                # which makes it hard to see how long it takes.
-                downloaded = self.load_symbols(needs_to_be_downloaded)
-                for symbol_key, information, module_index in downloaded:
-                    symbol_offsets = information['symbol_map'].keys()
-                    self.add_to_symbols_offsets(
-                        symbol_key,
-                        symbol_offsets,
-                        symbol_map=information['symbol_map']
+        for symbol_key, symbol_key_pages in pages.items():
+            if symbol_key not in incomplete:
+                self.all_symbol_tables[symbol_key] = (
+                    self.all_symbol_tables[symbol_key].with_pages(
+                        symbol_key_pages
+                    )
+                )
+        if incomplete:
+            metrics.incr(
+                'symbolicate_store_page',
+                len(incomplete),
+                tags=['cache:miss']
+            )
+            # The index, that's in the in-memory cache, is no good.
+            symbol_table_cache.evict([
+                self._make_cache_key(symbol_key) for symbol_key in incomplete
+            ])
+            if retry:
+                self.download_symbol_tables(incomplete, loaded)
+                self.load_symbol_table_pages(
+                    {
+                        symbol_key: module_offsets[symbol_key]
+                        for symbol_key in incomplete
+                    },
+                    loaded,
+                    retry=False,
+                )
+            else:
+                for symbol_key in incomplete:
+                    self.all_symbol_tables[symbol_key] = SymbolTable(
+                        EMPTY_SYMBOL_TABLE
                     )
-                    if self.debug:
-                        if 'download_time' in information:
-                            download_times.append(information['download_time'])
-                        if 'download_size' in information:
-                            download_sizes.append(information['download_size'])
-                    found = information['found']
-                    result['knownModules'][module_index] = found
+                    self.pending_symbol_keys.add(symbol_key)
+
+    def _make_result(
+        self,
+        stacks,
+        memory_map,
+        modules_lookups,
+        nearest_functions,
+        cached_offsets,
+    ):
+        # the result we will populate
+        result = {
+            'symbolicatedStacks': [],
+            'knownModules': [None] * len(memory_map),
+        }
+
+        # Whether it came from this request, a previous job in the same
+        # request, the Redis store or a download, if we have a non-empty
+        # symbol table the module is known. Frames are only ever cached
+        # from non-empty symbol tables too.
+        for symbol_key, module_index in modules_lookups.items():
+            symbol_table = self.all_symbol_tables.get(symbol_key)
+            if symbol_key in self.pending_symbol_keys:
+                # We don't know yet. Try again later.
+                result['knownModules'][module_index] = 'pending'
+            elif symbol_table is not None:
+                result['knownModules'][module_index] = bool(symbol_table)
+            elif symbol_key in cached_offsets:
+                result['knownModules'][module_index] = True
 
         # Initialize counters of how many stacks we do symbolication on.
         # Some stacks are malformed so we can't symbolicate them
@@ -228,90 +637,18 @@ class SymbolicateJSON:
         # expect real_stacks <= total_stacks.
         total_stacks = 0
         real_stacks = 0
-
+        frame_cache_hits = 0
         # This counter is for the sake of the debug output. So you can
         # get an appreciation how much was needed from each module (aka
         # symbol).
         stacks_per_module = defaultdict(int)
 
-        # Before we loop over the stack, loop over it once just to
-        # figure out which HGET commands we're going to need to send.
-        lookups = defaultdict(list)
-
-        # We'll use the module_index repeatedly to figure out what the
-        # of all symbol offsets are. To avoid repeating that logic
-        # too much we'll just a little dict as a cache.
-        _symbol_offset_list_cache = {}
-
-        for stack in stacks:
-            for module_index, module_offset in stack:
-                if module_index < 0:
-                    continue
-                symbol_offset_list = _symbol_offset_list_cache.get(
-                    module_index
-                )
-
-                # First time we encounter this module_index?
-                if symbol_offset_list is None:
-                    symbol_filename, debug_id = memory_map[module_index]
-                    symbol_key = (symbol_filename, debug_id)
-
-                    symbol_offset_list = self.all_symbol_offsets.get(
-                        symbol_key
-                    )
-                    _symbol_offset_list_cache[module_index] = (
-                        symbol_offset_list
-                    )
-
-                if symbol_offset_list:
-                    # There exists a list of offsets for this module!
-
-                    symbol_key = tuple(memory_map[module_index])
-                    nearest = self._get_nearest(
-                        symbol_offset_list,
-                        module_offset
-                    )
-                    if nearest not in lookups[symbol_key]:
-                        lookups[symbol_key].append(nearest)
-
-        # Now we know which lookups we need to do. I.e. Redis store queries.
-        # Actually look them up.
-        signatures = {}
-        redis_store_connection = get_redis_connection('store')
-
-        for symbol_key, keys in lookups.items():
-            signatures[symbol_key] = {}
-            if symbol_key in self.all_symbol_maps:
-                # 'all_symbol_maps' is a dict of *every* offset and signature
-                # for this symbol key.
-                # The reason we have this (and thus won't need to query Redis)
-                # is because the symbol has had to be downloaded from the
-                # Internet and parsed into a dict (for the sake of
-                # storing it in Redis) already. Let's not waste this
-                # opportunity. Basically only possible the first time you
-                # depend on a module for symbolication.
-                for key in keys:
-                    signatures[symbol_key][key] = (
-                        self.all_symbol_maps[symbol_key][key]
-                    )
-            else:
-                cache_key = self._make_cache_key(symbol_key)
-                t0 = time.time()
-                values = redis_store_connection.hmget(
-                    store.make_key(cache_key),
-                    keys
-                )
-                t1 = time.time()
-                cache_lookup_times.append(t1 - t0)
-
-                for i, key in enumerate(keys):
-                    # The list 'values' is a list of byte strings.
-                    value = values[i]
-                    if value is not None:
-                        value = value.decode('utf-8')
-                    signatures[symbol_key][key] = value
-
-        _symbol_offset_list_cache = {}  # reset the cache
+        # Frames with a negative module index have no module of their
+        # own. For those, we use whichever module filename was last
+        # mentioned.
+        symbol_filename = None
+        if modules_lookups:
+            symbol_filename = list(modules_lookups)[-1][0]
 
         # All the downloads (if there were any) *and* all the Redis store
         # lookups have been done. Now, let's focus on making the struct
@@ -331,489 +668,622 @@ class SymbolicateJSON:
 
                 real_stacks += 1
 
-                symbol_offset_list = _symbol_offset_list_cache.get(
-                    module_index,
-                )
-                if symbol_offset_list is None:
-                    symbol_filename, debug_id = memory_map[module_index]
-                    symbol_key = (symbol_filename, debug_id)
-
-                    # This 'stacks_per_module' will only be used in the debug
-                    # output. So give it a string key instead of a tuple.
-                    stacks_per_module['{}/{}'.format(*symbol_key)] += 1
-
-                    symbol_offset_list = self.all_symbol_offsets.get(
-                        symbol_key
-                    )
-                    _symbol_offset_list_cache[module_index] = (
-                        symbol_offset_list
-                    )
-
-                # If there was no list, the symbol could ultimately not
-                # be found, at all. There's no point trying to figure out
-                # what the signature is.
-                function = None
-                if symbol_offset_list:
-                    symbol_key = tuple(memory_map[module_index])
-                    # Even if our module offset isn't in that list,
-                    # there is still hope to be able to find the
-                    # nearest signature.
-                    function_start = self._get_nearest(
-                        symbol_offset_list,
-                        module_offset
-                    )
-                    function_offset = module_offset - function_start
-                    function = signatures[symbol_key][function_start]
-
+                symbol_filename, debug_id = memory_map[module_index]
                 frame = {
                     'module_offset': module_offset,
                     'module': symbol_filename,
                     'frame': j,
                 }
-                if function is not None:
+                symbol_key = (symbol_filename, debug_id)
+                stacks_per_module[symbol_key] += 1
+                # Only some of the module's offsets might be resolved.
+                # E.g. those in the frame cache when the symbol table
+                # itself is still pending.
+                nearest_function = nearest_functions.get(
+                    symbol_key, {}
+                ).get(module_offset)
+                if nearest_function is not None:
+                    function_start, function = nearest_function
                     frame['function'] = function
-                    frame['function_offset'] = function_offset
+                    frame['function_offset'] = module_offset - function_start
+                    if module_offset in cached_offsets.get(symbol_key, ()):
+                        frame_cache_hits += 1
 
                 response_stack.append(frame)
 
             # XXX Stop calling it this. It's an old word.
             result['symbolicatedStacks'].append(response_stack)
 
-        t1 = time.time()
-
-        logger.info(
-            'The whole symbolication of {} ({} actual) '
-            'stacks took {:.4f} seconds'.format(
-                total_stacks,
-                real_stacks,
-                t1 - t0,
-            )
-        )
+        result['total_stacks'] = total_stacks
+        result['real_stacks'] = real_stacks
 
         if self.debug:
             result['debug'] = {
-                'time': t1 - t0,
                 'stacks': {
                     'count': total_stacks,
                     'real': real_stacks,
                 },
                 'modules': {
                     'count': len(modules_lookups),
-                    'stacks_per_module': stacks_per_module,
+                    'stacks_per_module': {
+                        '{}/{}'.format(*symbol_key): (
+                            stacks_per_module[symbol_key]
+                        )
+                        for symbol_key in modules_lookups
+                    },
                 },
-                'cache_lookups': {
-                    'count': len(cache_lookup_times),
-                    'time': float(sum(cache_lookup_times)),
+                'frame_cache': {
+                    'hits': frame_cache_hits,
+                    'ratio': real_stacks and frame_cache_hits / real_stacks,
                 },
-                'downloads': {
-                    'count': len(download_times),
-                    'time': float(sum(download_times)),
-                    'size': float(sum(download_sizes)),
-                }
             }
 
         return result
 
-    @staticmethod
-    def _get_nearest(offset_list, offset):
-        """return the item in the list to the left nearst point.
-        For example, if the 'offset_list' is: [10, 20, 30]
-        and 'offset' is 25, the return 20.
-        This function assumes that the 'offset_list' is sorted.
-        This function also assumes that 'offset' is *not* in
-        'offset_list'.
-
-        The origin of this function is that we look for offsets in
-        a stack as these are kinda like lines of code. Imagine this
-        C++ program::
-
-            10) ...
-            11) void some_function() {
-            12)     ...
-            13)     ...
-            14)     ...
-            15) }
-            17) void other_function() {
-            18)     ...
-            19) }
-            20) ...
-
-        Here, the 'offset_list' is going to be [11, 17]. The offsets
-        where the functions are.
-        Suppose the 'offset' we're being asked to look up is 13, meaning
-        the interesting thing happened on "line" 13. The nearest "function
-        definition line" is 11. That's where the function was defined.
-        To find 11, we bisect the list of all offsets and subtract 1.
-        I.e. bisect([11, 17], 13) == p == 1
-        And [11, 17][p - 1] == 11
-        """
-        return offset_list[bisect(offset_list, offset) - 1]
-
     @staticmethod
     def _make_cache_key(symbol_key):
         return make_symbol_key_cache_key(symbol_key)
 
     @metrics.timer_decorator('symbolicate_get_symbol_maps')
-    def get_symbol_offsets(self, symbol_keys):
+    def get_symbol_tables(self, symbol_keys):
         """Return a dict that contains the following keys:
             * 'symbols'
-            * 'cache_lookup_times' (only present if self.debug==True)
+            * 'cache_lookups' (only present if self.debug==True), a list
+              of dicts with the time, number of keys and number of
+              commands of each Redis pipeline
+            * 'memory_cache_hits' (only present if self.debug==True), the
+              set of symbol keys that were in the in-memory cache
+            * 'disk_cache_hits' (only present if self.debug==True), the
+              set of symbol keys that were in the disk cache
 
         The 'symbols' key contains a dict that looks like this::
 
             {
-                "xul.pdb/HEX": {
-                    "found": True,
-                    "symbol_offsets": [1235, 4577, 6412, 7800]
+                ("xul.pdb", "HEX"): {
+                    "symbol_table": <SymbolTable offsets=123456>
+                },
+                ("ntdll.pdb", "HEX"): {
+                    "symbol_table": <SymbolTable offsets=0>
                 },
-                "win32.dll/HEX": {
-                    "found": False,
-                    "symbol_offsets": None  # Means it wasn't found in Redis
+                ("win32.dll", "HEX"): {
+                    # Means it wasn't found in Redis
                 }
             }
 
-        To optimize the Redis lookups everything that can be queried
-        "in batch" is done so. So multiple lookup keys get turned into
-        a list just so we can do things like MGET Redis queries.
+        Symbol tables that are in this process's in-memory cache, or in
+        this host's disk cache, don't need to be looked up in Redis at
+        all. For the rest, every symbol
+        table is stored as one single value so all the symbol keys are
+        looked up with MGETs in one single pipeline. Big symbol tables
+        might be stored as pages (see settings.SYMBOLICATE_STORE_PAGE_SIZE)
+        in which case it's a PagedSymbolTable without any pages. See
+        load_symbol_table_pages().
         """
         cache_keys = {self._make_cache_key(x): x for x in symbol_keys}
-        redis_store_connection = get_redis_connection('store')
-        cache_lookup_times = []
-
-        # This is the dict we're going to build up. Each key is a
-        # symbol key's cache key. Each value is a list of offsets.
-        many = {}
-
-        # Build up a list of the names of ALL keys that contains the
-        # the keys.
-        cache_keys_keys = []
-        for cache_key in cache_keys:
-            cache_keys_keys.append(cache_key + ':keys')
-        t0 = time.time()
-        # store.get_many() returns an OrderedDict() object that
-        # maps each *available* key to their list of ALL hash map keys.
-        all_keys = store.get_many(cache_keys_keys)
-        t1 = time.time()
-        cache_lookup_times.append(t1 - t0)
-
-        # Important! Why aren't using Redis HKEYS?
-        # tl;dr It's too slow.
-        #
-        # You *could* do this:
-        #   > HSET foo key1 valueX
-        #   > HSET foo key2 valueY
-        #   > HSET foo key3 valueZ
-        # ...and to get that list of [key1, key2, key3] you can do:
-        #   > HKEYS foo
-        #   1) key1
-        #   2) key2
-        #   3) key3
-        #
-        # But that's very slow. HKEYS is O(N).
-        #
-        # Instead, we do one extra simple SET for a list of all keys.
-        # So like this:
-        #   > HSET foo key1 valueX
-        #   > HSET foo key2 valueY
-        #   > HSET foo key3 valueZ
-        #   > SET foo:keys "[key1, key2, key3]"
-        #
-        # Now, instead of HKEYS we use simple GET:
-        #   > GET foo
-        #   1) "[key1, key2, key3]"
-        #
-        # That list gets serialized (and compressed) by django_redis
-        # so we don't have to worry about turning it back into a pure
-        # Python list.
-        #
-        # The caveat is that we now have 2 "top level keys" (foo the
-        # hash map and foo:keys the plain key/value).
-        #
-        # What *can* happen is that since the Redis store is configured
-        # as a LRU cache, one of these might get evicted.
-        # If the plain key/value "foo:keys" gets evicted, we plainly
-        # assume it has never existed and we "start over" download
-        # it from the Internet. Just as if we've never ever encounted
-        # it before.
-        # Alternatively, the hash map "foo" might have been evicted.
-        # It's impossible to know so we have to make a HLEN query to
-        # check if the hash map is still there.
-
-        # If there are no offsets at all, it means there are no
-        # hash maps of this symbol key. But perhaps we've previously
-        # attempted to download the symbols file from the Internet
-        # and failed. In that case, we don't want to repeatedly try
-        # to download it again (and fail repeatedly).
-        # All "failed" attempts are stored as regular keys with an
-        # empty dict.
-        # The reason for using a list is so that we can do an MGET
-        # later.
-        maybes = []
-
-        for cache_key in cache_keys:
-            keys = all_keys.get(cache_key + ':keys')
-            if keys:
-                # Cool! The list of all hash map keys exists in Redis.
-                # But, what if the LRU kicked out the hash map??
-                # The quickest way to find out is to ask to the length
-                # of the hash map.
-                t0 = time.time()
-                length = redis_store_connection.hlen(
-                    store.make_key(cache_key)
-                )
-                t1 = time.time()
-                cache_lookup_times.append(t1 - t0)
-                if not length:
-                    # The list of keys existed but not the hashmap :(
-                    keys = []
-            if keys:
-                many[cache_key] = keys
-            else:
-                maybes.append(cache_key)
-        if maybes:
-            t0 = time.time()
-            empties = store.get_many(maybes)
-            t1 = time.time()
-            cache_lookup_times.append(t1 - t0)
-            many.update(empties)
-
-        t1 = time.time()
-
-        # All Redis queries that can be done have been done.
-        # Time to "package it up".
+        cache_lookups = []
 
         informations = {
             'symbols': {},
         }
-        for cache_key in cache_keys:
+        for cache_key, symbol_key in list(cache_keys.items()):
+            symbol_table = symbol_table_cache.get(cache_key)
+            if symbol_table is not None:
+                informations['symbols'][symbol_key] = {
+                    'symbol_table': symbol_table,
+                }
+                del cache_keys[cache_key]
+        memory_cache_hits = set(informations['symbols'])
+
+        # Next, the files shared by all processes on this host.
+        for cache_key, symbol_key in list(cache_keys.items()):
+            symbol_table = symbol_table_disk_cache.get(cache_key)
+            if symbol_table is not None:
+                informations['symbols'][symbol_key] = {
+                    'symbol_table': symbol_table,
+                }
+                symbol_table_cache.set(cache_key, symbol_table)
+                del cache_keys[cache_key]
+        disk_cache_hits = set(informations['symbols']) - memory_cache_hits
+
+        values = []
+        if cache_keys:
+            # All the reads are sent at once. With the Redis store, that's
+            # one pipeline, i.e. one network round-trip, no matter how
+            # many modules.
+            t0 = time.time()
+            values = get_symbol_table_store().get_many(list(cache_keys))
+            t1 = time.time()
+            metrics.timing('symbolicate_store_pipeline', (t1 - t0) * 1000)
+            cache_lookups.append({
+                'time': t1 - t0,
+                'keys': len(cache_keys),
+                'commands': count_commands(len(cache_keys)),
+            })
+
+        for cache_key, value in zip(cache_keys, values):
             symbol_key = cache_keys[cache_key]
             information = {}
+            if value is not None:
+                try:
+                    information['symbol_table'] = read_symbol_table(value)
+                except InvalidSymbolTable:
+                    # Most likely stored by an older version of this code.
+                    # Treat it as if it was never there and it'll get
+                    # overwritten once downloaded again.
+                    logger.warning(
+                        f'Invalid symbol table stored for {cache_key}'
+                    )
 
-            symbol_offsets = many.get(cache_key)
-            if symbol_offsets is None:  # not existant in cache
+            if 'symbol_table' not in information:  # not existant in cache
                 # Need to download this from the Internet.
-                metrics.incr('symbolicate_symbol_key', tags=["cache:miss"])
+                metrics.incr('symbolicate_symbol_key', tags=['cache:miss'])
                 # If the symbols weren't in the cache, this will be dealt
                 # with later by this method's caller.
-                # XXX I don't like this! That would can be done here instead.
-            else:
-                # We *used* store the whole symbol map as a dict.
-                # Both if it actually existed and both if it was not found
-                # in S3.
-                # This makes things complicated for upgrading existing
-                # systems. So let's make a fix for that.
-                if isinstance(symbol_offsets, dict):  # pragma: no cover
-                    symbol_offsets = []
-
-                assert isinstance(symbol_offsets, list), type(symbol_offsets)
-                if not symbol_offsets:  # e.g. an empty list
-                    # It was cached but empty. That means it was logged that
-                    # it was previously attempted but failed.
-                    # The reason it's cached is to avoid it being looked up
-                    # again and again when it's just going to continue to fail.
-                    information['symbol_offsets'] = []
-                    information['found'] = False
-                else:
-                    metrics.incr('symbolicate_symbol_key', tags=["cache:hit"])
-                    # If it was in cache, that means it was originally found.
-                    information['symbol_offsets'] = symbol_offsets
-                    information['found'] = True
+            elif information['symbol_table']:
+                metrics.incr('symbolicate_symbol_key', tags=['cache:hit'])
+                if isinstance(information['symbol_table'], SymbolTable):
+                    # Paged symbol tables aren't whole so they're only
+                    # kept in memory.
+                    information['symbol_table'] = symbol_table_disk_cache.set(
+                        cache_key,
+                        information['symbol_table']
+                    )
+                symbol_table_cache.set(
+                    cache_key,
+                    information['symbol_table']
+                )
+            # Else, it was cached but empty. That means it was logged that
+            # it was previously attempted but failed.
+            # The reason it's cached is to avoid it being looked up
+            # again and again when it's just going to continue to fail.
             informations['symbols'][symbol_key] = information
 
         if self.debug:
-            informations['cache_lookup_times'] = cache_lookup_times
+            informations['cache_lookups'] = cache_lookups
+            informations['memory_cache_hits'] = memory_cache_hits
+            informations['disk_cache_hits'] = disk_cache_hits
         return informations
 
-    def load_symbols(self, requirements):
-        """return a list that contains items of 3-tuples of
-        (symbol_key, information, module_index)
+    def load_symbols(self, symbol_keys, timeout=None):
+        """return a list that contains items of 2-tuples of
+        (symbol_key, information)
+
+        All the symbols are downloaded, parsed and stored concurrently,
+        in the thread pool every request in this process shares (see
+        DownloadExecutor and RequestDownloads), which also makes sure the
+        same symbol isn't downloaded twice at the same time in this
+        process. If they haven't all finished within 'timeout' seconds
+        (default settings.SYMBOLICATE_DOWNLOAD_TIMEOUT_SECONDS, math.inf
+        for no limit), we stop
+        waiting and those that didn't finish are treated as not found for
+        this request (and their information has 'pending': True). Those
+        downloads still carry on in the background though, and get stored
+        once done, so the next request will have them.
+
+        If some other process is already downloading a symbol, we wait
+        for it here, within the same 'timeout', rather than in a thread
+        of the pool. See wait_for_symbol_tables().
         """
-        redis_store_connection = get_redis_connection('store')
-        # This could be done concurrently, but from experience we see that
-        # the LRU cache does a very good job staying warm and containing
-        # lots of objects so it's rare that we need to download more things
-        # from S3 via the network. If we do it's very often just 1 more
-        # so there's little point in making that parallel.
-        for symbol_key, module_index in requirements:
-            cache_key = self._make_cache_key(symbol_key)
-            information = {}
-            try:
-                information.update(self.load_symbol(*symbol_key))
-                if not information['download_size']:
-                    raise SymbolFileEmpty()
-                assert isinstance(information['symbol_map'], dict)
-
-                with metrics.timer('symbolicate_store_hashmap'):
-                    t0 = time.time()
-                    # This big dict we're about to send to Redis with HMSET
-                    # might be too large to fit and if it is too large
-                    # redis-py will throw a ConnectionError with something
-                    # like 'Errno 104' because Redis simply shuts down the
-                    # socket.
-                    # To avoid that, set this monster dict in batches.
-                    # Empirically we found the ConnectionError happens when
-                    # the dict, converted to a string, is around 9MB.
-                    # Also empirically, the *average* value is 90 bytes and the
-                    # average key is 8 bytes. So if each key+value is about
-                    # 100 bytes, to make a batch of the dict into copies that
-                    # are no larger than 5MB you have to read about 50,000
-                    # keys at a time.
-                    count = 0
-                    buffer = {}
-                    hmset_key = store.make_key(cache_key)
-                    all_keys = []
-                    for key in information['symbol_map']:
-                        all_keys.append(key)
-                        buffer[key] = information['symbol_map'][key]
-                        count += 1
-                        if count > 50_000:
-                            redis_store_connection.hmset(hmset_key, buffer)
-                            count = 0
-                            buffer = {}
-                    if count:
-                        redis_store_connection.hmset(hmset_key, buffer)
-
-                    store.set(
-                        cache_key + ':keys',
-                        all_keys,
-                        timeout=None,
-                    )
-                    t1 = time.time()
-
-                store_time = t1 - t0
+        t0 = time.time()
+        if timeout is None:
+            timeout = settings.SYMBOLICATE_DOWNLOAD_TIMEOUT_SECONDS
+        deadline = t0 + timeout
+        futures = {}
+        for symbol_key in symbol_keys:
+            future = self.downloads.submit(
+                self._make_cache_key(symbol_key),
+                self.load_and_store_symbol,
+                symbol_key,
+            )
+            futures[future] = symbol_key
+
+        informations = {}
+        serial_time = 0.0
+        # Symbol key to when we started waiting for some other process
+        # to download it.
+        waiting_since = {}
+        while futures:
+            # Those that are still running carry on in the background.
+            done, _ = concurrent.futures.wait(
+                futures,
+                timeout=(
+                    None if deadline == math.inf
+                    else max(0.0, deadline - time.time())
+                ),
+            )
+            leased = []
+            for future in done:
+                symbol_key = futures.pop(future)
+                # Note, this will re-raise any (operational) exception
+                # that happened in the thread. The same future might be
+                # shared with other requests so it's a copy.
+                information = dict(future.result())
+                serial_time += information.pop('load_time')
+                if information.get('leased'):
+                    waiting_since.setdefault(symbol_key, time.time())
+                    leased.append(symbol_key)
+                    continue
+                # Whichever request started the download, the time it
+                # took is part of every request that waited for it.
+                stage_timings = information.pop('stage_timings', {})
+                for stage, seconds in stage_timings.items():
+                    self.timings.add(stage, seconds)
+                informations[symbol_key] = information
+            if futures or not leased:
+                # Either out of time or all done.
+                break
+            symbol_tables, take_over = self.wait_for_symbol_tables(
+                leased,
+                waiting_since,
+                deadline,
+            )
+            for symbol_key, symbol_table in symbol_tables.items():
+                informations[symbol_key] = {'symbol_table': symbol_table}
+            for symbol_key, force in take_over:
+                future = self.downloads.submit(
+                    self._make_cache_key(symbol_key),
+                    self.load_and_store_symbol,
+                    symbol_key,
+                    force,
+                )
+                futures[future] = symbol_key
+        t1 = time.time()
 
-                logger.info(
-                    'Storing hash map for {} ({} keys). '
-                    'Took {:.2f}s to download. '
-                    'Took {:.2f}s to store in LRU.'
-                    ''.format(
+        loaded = []
+        for symbol_key in symbol_keys:
+            information = informations.get(symbol_key)
+            if information is None:
+                logger.warning(
+                    'Gave up waiting for {} after {:.2f}s'.format(
                         '/'.join(symbol_key),
-                        format(len(all_keys), ','),
-                        information['download_time'],
-                        store_time,
+                        t1 - t0,
                     )
                 )
-                information['found'] = True
-
-                # We don't *need* to know the store cache's memory usage
-                # but it's a useful number in understanding how the LRU
-                # is behaving. Take this opportunity to send a gauge of
-                # the amount of memory the store is using
-                info = redis_store_connection.info()
-                metrics.gauge('symbolicate_used_memory', info['used_memory'])
-
-            except (SymbolNotFound, SymbolFileEmpty):
-                # If it can't be downloaded, cache it as an empty result
-                # so we don't need to do this every time we're asked to
-                # look up this symbol.
-                metrics.incr('symbolicate_download_fail', 1)
-                store.set(
-                    cache_key,
-                    [],
-                    settings.DEBUG and 60 or 60 * 60,
-                )
-                # If nothing could be downloaded, keep it anyway but
-                # to avoid having to check if 'symbol_map' is None, just
-                # turn it into a dict.
-                information['symbol_map'] = {}  # override
-                information['found'] = False
-            yield (symbol_key, information, module_index)
+                metrics.incr('symbolicate_download_timeout', 1)
+                information = {
+                    'symbol_table': SymbolTable(EMPTY_SYMBOL_TABLE),
+                    'pending': True,
+                }
+            loaded.append((symbol_key, information))
 
-    @metrics.timer_decorator('symbolicate_load_symbol')
-    def load_symbol(self, filename, debug_id):
-        t0 = time.time()
-        stream = self.get_download_symbol_stream(filename, debug_id)
-
-        # We are only interested in lines that match this regex.
-        # The 'm' is special. It's an extra *optional* prefix which,
-        # we currently omit.
-        # Origin: https://bugs.chromium.org/p/google-breakpad/issues/detail?id=751
-        # Note, as pointed out in
-        # https://github.com/mozilla-services/tecken/issues/924#issuecomment-399130860
-        # some day we might actually extract and use the presence of this 'm'
-        # as a potential factor of the symbolication.
-        # As of June 2018, we deliberately omit it.
-        starts_regex = re.compile(r'^(FUNC|PUBLIC) (m )?')
-
-        # Need to parse it by line and make a dict of of offset->function
-        public_symbols = {}
-        func_symbols = {}
-        line_number = 0
-        total_size = 0
+        # How much wall-clock time did we save by doing it concurrently
+        # compared to if they'd been done one after another?
+        metrics.timing(
+            'symbolicate_download_time_saved',
+            max(0.0, serial_time - (t1 - t0)) * 1000
+        )
+        return loaded
+
+    def load_and_store_symbol(self, symbol_key, force=False):
+        """Download, parse and store the symbol table in the store
+        (and the in-memory cache). Return a dict that always contains
+        a 'symbol_table' key and a 'load_time' key. And, if it was
+        downloaded, a 'stage_timings' key of stage (see StageTimings)
+        to seconds.
+
+        If some other process (or thread) is already downloading the same
+        symbol, i.e. holds the lease, return a dict with a 'leased' key
+        instead, unless 'force' is true. See load_symbols().
+
+        This runs in the shared thread pool, maybe for more than one
+        request or after the request has given up on it, so it never
+        touches 'self.timings'. See load_symbols().
+        """
         t0 = time.time()
-        url = next(stream)
-        for line in stream:
-            total_size += len(line)
-            line_number += 1
-
-            try:
-                found, = starts_regex.findall(line)
-                prefix = found[0]
-            except ValueError:
-                # If it didn't match anything at the start, don't bother
-                # with this line.
-                continue
+        cache_key = self._make_cache_key(symbol_key)
+        lease = get_symbol_table_store().get_lease(
+            cache_key,
+            settings.SYMBOLICATE_DOWNLOAD_LEASE_SECONDS,
+        )
+        if not lease.acquire() and not force:
+            return {
+                'symbol_table': SymbolTable(EMPTY_SYMBOL_TABLE),
+                'leased': True,
+                'load_time': time.time() - t0,
+            }
+        try:
+            information = self._load_and_store_symbol(symbol_key, cache_key)
+        finally:
+            lease.release()
+        information['load_time'] = time.time() - t0
+        return information
 
-            rest = starts_regex.sub('', line)
-            if prefix == 'PUBLIC':
-                fields = rest.strip().split(None, 2)
-                if len(fields) != 3:
-                    logger.warning(
-                        'PUBLIC line {} in {} has too few fields'.format(
-                            line_number,
-                            url,
-                        )
+    def wait_for_symbol_tables(self, symbol_keys, waiting_since, deadline):
+        """Someone else holds the lease to download each of these symbols.
+        Poll the store, till the 'deadline', till they've stored them.
+        'waiting_since' is a dict of symbol key to when we started
+        waiting for it.
+
+        Return a dict of symbol key to symbol table, of those that got
+        stored, and a list of (symbol key, force) of those we should
+        download ourselves (see load_and_store_symbol()). Either because
+        whoever had the lease gave up (or died) without storing anything,
+        or because we've waited longer than
+        settings.SYMBOLICATE_DOWNLOAD_LEASE_WAIT_SECONDS. Then 'force'
+        is true. The rest, if any, weren't done by the deadline.
+        """
+        store = get_symbol_table_store()
+        cache_keys = {self._make_cache_key(x): x for x in symbol_keys}
+        symbol_tables = {}
+        take_over = []
+        while cache_keys and time.time() < deadline:
+            time.sleep(max(
+                0.0,
+                min(LEASE_POLL_INTERVAL_SECONDS, deadline - time.time())
+            ))
+            values = store.get_many(list(cache_keys))
+            for (cache_key, symbol_key), value in zip(
+                list(cache_keys.items()),
+                values,
+            ):
+                symbol_table = None
+                if value is not None:
+                    try:
+                        symbol_table = read_symbol_table(value)
+                    except InvalidSymbolTable:
+                        # Left over from an older version. Keep waiting
+                        # for it to be overwritten.
+                        pass
+                waited = time.time() - waiting_since[symbol_key]
+                if symbol_table is not None:
+                    metrics.incr('symbolicate_download_coalesced', 1)
+                    metrics.timing(
+                        'symbolicate_download_coalesced_wait',
+                        waited * 1000
                     )
+                    if isinstance(symbol_table, SymbolTable):
+                        symbol_table = symbol_table_disk_cache.set(
+                            cache_key,
+                            symbol_table,
+                        )
+                    if symbol_table:
+                        symbol_table_cache.set(cache_key, symbol_table)
+                    symbol_tables[symbol_key] = symbol_table
+                    del cache_keys[cache_key]
                     continue
-                address = int(fields[0], 16)
-                symbol = fields[2]
-                public_symbols[address] = symbol
-            elif prefix == 'FUNC':
-                fields = rest.strip().split(None, 3)
-                if len(fields) != 4:
+                lease = store.get_lease(
+                    cache_key,
+                    settings.SYMBOLICATE_DOWNLOAD_LEASE_SECONDS,
+                )
+                if lease.acquire():
+                    # Whoever had it, released it without storing
+                    # anything. Whichever thread of the pool gets to it
+                    # first takes it.
+                    lease.release()
+                    take_over.append((symbol_key, False))
+                    del cache_keys[cache_key]
+                elif waited > settings.SYMBOLICATE_DOWNLOAD_LEASE_WAIT_SECONDS:
                     logger.warning(
-                        'FUNC line {} in {} has too few fields'.format(
-                            line_number,
-                            url,
-                        )
+                        'Gave up waiting for someone else to download {} '
+                        'after {:.2f}s'.format('/'.join(symbol_key), waited)
                     )
-                    continue
-                address = int(fields[0], 16)
-                symbol = fields[3]
-                func_symbols[address] = symbol
+                    metrics.incr('symbolicate_download_coalesce_timeout', 1)
+                    take_over.append((symbol_key, True))
+                    del cache_keys[cache_key]
+        return symbol_tables, take_over
 
-        # Prioritize PUBLIC symbols over FUNC symbols # XXX why?
-        func_symbols.update(public_symbols)
-        t1 = time.time()
+    def _load_and_store_symbol(self, symbol_key, cache_key):
+        information = {}
+        symbol_table_store = get_symbol_table_store()
+        try:
+            information.update(self.load_symbol(*symbol_key))
+            if not information['download_size']:
+                raise SymbolFileEmpty()
+            symbol_table = information['symbol_table']
+
+            with metrics.timer('symbolicate_store_symbol_table'):
+                t0_store = time.time()
+                # The whole symbol table is one single value. Unless it's
+                # big, then it's stored as pages plus an index of them.
+                # The pages are stored first so that nobody can get the
+                # index without its pages. The pages of what was stored
+                # before, if anything, are deleted.
+                page_size = settings.SYMBOLICATE_STORE_PAGE_SIZE
+                if page_size and len(symbol_table) > page_size:
+                    generation, index, pages = PagedSymbolTable.serialize(
+                        symbol_table,
+                        page_size,
+                    )
+                    items = [
+                        (
+                            make_page_cache_key(
+                                cache_key,
+                                generation,
+                                page_number,
+                            ),
+                            page,
+                        )
+                        for page_number, page in enumerate(pages)
+                    ]
+                    items.append((cache_key, index))
+                else:
+                    items = [(cache_key, symbol_table.buffer)]
+                replace_stored_symbol_table(cache_key, items)
+                t1_store = time.time()
+
+            store_time = t1_store - t0_store
+            information['stage_timings']['store'] = store_time
+
+            logger.info(
+                'Storing symbol table for {} ({} offsets, {} bytes). '
+                'Took {:.2f}s to download. '
+                'Took {:.2f}s to store in LRU.'
+                ''.format(
+                    '/'.join(symbol_key),
+                    format(len(symbol_table), ','),
+                    format(symbol_table.nbytes, ','),
+                    information['download_time'],
+                    store_time,
+                )
+            )
+            symbol_table = symbol_table_disk_cache.set(
+                cache_key,
+                symbol_table,
+            )
+            information['symbol_table'] = symbol_table
+            symbol_table_cache.set(cache_key, symbol_table)
+            record_symbol_table_stored(symbol_key, symbol_table.nbytes)
+            # We don't *need* to know the store's memory usage but it's a
+            # useful number in understanding how the LRU is behaving.
+            # Every now and then, get the amount of memory it's using.
+            if used_memory_gauge.is_due():
+                used_memory = symbol_table_store.get_used_memory()
+                if used_memory is not None:
+                    metrics.gauge('symbolicate_used_memory', used_memory)
+
+        except (SymbolNotFound, SymbolFileEmpty):
+            # If it can't be downloaded, cache it as an empty result
+            # so we don't need to do this every time we're asked to
+            # look up this symbol.
+            metrics.incr('symbolicate_download_fail', 1)
+            replace_stored_symbol_table(
+                cache_key,
+                [(cache_key, EMPTY_SYMBOL_TABLE)],
+                timeout=settings.DEBUG and 60 or 60 * 60,
+            )
+            # If nothing could be downloaded, keep it anyway but
+            # as an empty symbol table.
+            information['symbol_table'] = SymbolTable(EMPTY_SYMBOL_TABLE)
+        return information
+
+    @metrics.timer_decorator('symbolicate_load_symbol')
+    def load_symbol(self, filename, debug_id):
+        t0 = time.time()
+        t0_cpu = thread_cpu_time()
+        stream = self.get_download_symbol_stream(
+            filename,
+            debug_id,
+            decode=False,
+        )
+        url = next(stream)
+        if parse_executor.enabled:
+            # This thread only downloads. Another process parses.
+            symbol_table, total_size, fetch_time, parse_time = (
+                parse_executor.parse(stream, url=url)
+            )
+            t1 = time.time()
+        else:
+            # The lines are never decoded. Only the function names of the
+            # FUNC and PUBLIC lines are kept, as UTF-8 encoded bytes, and
+            # written straight into the symbol table.
+            symbol_table, total_size = parse_symbol_table(stream, url=url)
+            t1 = time.time()
+            # The download is streamed and parsed as it comes in. So the
+            # time this thread spent on the CPU was mostly parsing and the
+            # rest of the time it was waiting on the network.
+            parse_time = min(thread_cpu_time() - t0_cpu, t1 - t0)
+            fetch_time = t1 - t0 - parse_time
         if not total_size:
             logger.warning('Downloaded content empty ({!r}, {!r})'.format(
                 filename,
                 debug_id,
             ))
         information = {}
-        information['symbol_map'] = func_symbols
+        information['symbol_table'] = symbol_table
         information['download_time'] = t1 - t0
         information['download_size'] = total_size
+        information['stage_timings'] = {
+            'fetch': fetch_time,
+            'parse': parse_time,
+        }
         return information
 
-    def get_download_symbol_stream(self, lib_filename, debug_id):
+    def get_download_symbol_stream(self, lib_filename, debug_id, decode=True):
         """
         Return a requests.response stream or raise SymbolNotFound
         if the symbol can't be found at all.
         """
-        if lib_filename.endswith('.pdb'):
-            symbol_filename = lib_filename[:-4] + '.sym'
-        else:
-            symbol_filename = lib_filename + '.sym'
-
+        symbol_filename = make_symbol_filename(lib_filename)
         stream = self.downloader.get_symbol_stream(
             lib_filename,
             debug_id,
-            symbol_filename
+            symbol_filename,
+            decode=decode,
         )
         return stream
 
 
+def count_commands(keys):
+    """Return the number of commands (MGETs, with the Redis store) it
+    takes to look up this many keys from the store."""
+    batch_size = settings.SYMBOLICATE_STORE_PIPELINE_BATCH_SIZE
+    return -(-keys // batch_size)
+
+
+def set_server_timing(response, timings, version):
+    """Emit the time spent in each stage as metrics and add them, as a
+    'Server-Timing' header, to the response."""
+    timings.emit(version)
+    response['Server-Timing'] = timings.server_timing_header()
+    return response
+
+
+def timed_stream(chunks, timings, version):
+    """Yield the chunks of a streamed response and, once they've all
+    been sent, emit the time spent in each stage as metrics."""
+    try:
+        t0 = time.time()
+        for chunk in chunks:
+            timings.add('assemble', time.time() - t0)
+            yield chunk
+            t0 = time.time()
+    finally:
+        timings.emit(version)
+
+
+class InvalidRequestBody(Exception):
+    """Happens when the request body can't be read (or decompressed)."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def read_request_body(request):
+    """Return the request body, as bytes, decompressed according to its
+    'Content-Encoding' header. It's read from the request, and
+    decompressed, a chunk at a time so the whole compressed body is
+    never in memory at the same time as the decompressed one."""
+    encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+    if encoding in ('', 'identity'):
+        decompressor = None
+    elif encoding in CONTENT_ENCODING_WBITS:
+        decompressor = zlib.decompressobj(CONTENT_ENCODING_WBITS[encoding])
+    else:
+        raise InvalidRequestBody(
+            f'Unsupported Content-Encoding {encoding!r}',
+            status=415
+        )
+    max_size = settings.SYMBOLICATE_MAX_REQUEST_BODY_SIZE
+    body = BytesIO()
+    while True:
+        chunk = request.read(REQUEST_BODY_CHUNK_SIZE)
+        if not chunk:
+            break
+        if decompressor:
+            try:
+                # Never decompress more than one byte past the max. so
+                # a small "zip bomb" can't use up all the memory.
+                chunk = decompressor.decompress(
+                    chunk,
+                    max_size - body.tell() + 1
+                )
+            except zlib.error as exception:
+                raise InvalidRequestBody(
+                    f'Unable to decompress ({exception})'
+                )
+        body.write(chunk)
+        if body.tell() > max_size:
+            raise InvalidRequestBody(
+                f'Request body bigger than {max_size:,} bytes',
+                status=413
+            )
+    if decompressor and not decompressor.eof:
+        raise InvalidRequestBody('Incomplete compressed request body')
+    # This doesn't make a copy when nothing else references the buffer.
+    return body.getvalue()
+
+
 def json_post(view_function):
     """The minimum for posting a symbolication request is that you use
     POST and that you have a valid JSON payload in the body."""
@@ -824,7 +1294,20 @@ def json_post(view_function):
             return JsonResponse({'error': 'Must use HTTP POST'}, status=405)
 
         try:
-            json_body = json.loads(request.body.decode('utf-8'))
+            body = read_request_body(request)
+        except InvalidRequestBody as exception:
+            return JsonResponse(
+                {'error': str(exception)},
+                status=exception.status
+            )
+
+        try:
+            # The JSON parser reads the UTF-8 encoded bytes as they are.
+            # No need to first decode it all into another, just as big,
+            # string.
+            json_body = json.loads(body)
+            # Not needed any more, whilst the view runs.
+            del body
             if not isinstance(json_body, dict):
                 return JsonResponse({'error': 'Not a dict'}, status=400)
         except ValueError as exception:
@@ -838,6 +1321,82 @@ def json_post(view_function):
     return inner
 
 
+def format_v4_result(result):
+    """Rewrite, in place, a result of SymbolicateJSON.symbolicate() into
+    the version 4 format where every frame is a string. Return it."""
+
+    def rewrite_dict_to_list(d):
+        if 'function' not in d:
+            try:
+                function = hex(d['module_offset'])
+            except TypeError:
+                # Happens if 'module_offset' is not an int16
+                # and thus can't be represented in hex.
+                function = str(d['module_offset'])
+        else:
+            function = d['function']
+        return '{} (in {})'.format(
+            function,
+            d['module']
+        )
+
+    for i, stack in enumerate(result['symbolicatedStacks']):
+        result['symbolicatedStacks'][i] = [
+            rewrite_dict_to_list(x) for x in stack
+        ]
+    return result
+
+
+def format_v5_job_result(memory_map, result):
+    """Return the version 5 result of one job from its memory map and
+    its result of SymbolicateJSON.symbolicate_many()."""
+
+    def serialize_frames(frames):
+        for frame in frames:
+            try:
+                frame['module_offset'] = hex(frame['module_offset'])
+            except TypeError:
+                # Happens if 'module_offset' is not an int16
+                # and thus can't be represented in hex.
+                frame['module_offset'] = str(frame['module_offset'])
+            if 'function_offset' in frame and frame.get('function'):
+                frame['function_offset'] = hex(frame['function_offset'])
+        return frames
+
+    found_modules = {}
+    for i, module in enumerate(memory_map):
+        found_modules['/'.join(module)] = result['knownModules'][i]
+
+    job_result = {
+        'stacks': [
+            serialize_frames(x) for x in result['symbolicatedStacks']
+        ],
+        'found_modules': found_modules,
+    }
+    if 'debug' in result:
+        job_result['debug'] = result['debug']
+    return job_result
+
+
+def get_time_budget(request):
+    """Return the number of seconds this symbolication request may take,
+    or None if there's no limit. It's settings.SYMBOLICATE_TIME_BUDGET_SECONDS
+    but the caller can lower it with a 'Symbolicate-Time-Budget' header.
+    Raises ValueError if that header isn't a (positive) number."""
+    time_budget = settings.SYMBOLICATE_TIME_BUDGET_SECONDS or None
+    value = request.META.get('HTTP_SYMBOLICATE_TIME_BUDGET')
+    if value:
+        try:
+            requested = float(value)
+        except ValueError:
+            requested = -1
+        if not requested >= 0:
+            raise ValueError(f'Invalid Symbolicate-Time-Budget {value!r}')
+        if time_budget is None or requested < time_budget:
+            time_budget = requested
+    return time_budget
+
+
 class InvalidStacks(Exception):
     """Happens when the input stacks does not confirm to the standard."""
     # XXX This would perhaps be best replaced with a JSON Schema solution.
@@ -883,6 +1442,7 @@ def validate_memory_map(memory_map):
 
 @set_cors_headers(origin='*', methods='POST')
 @csrf_exempt
+@gzip_page
 @set_request_debug
 @metrics.timer_decorator('symbolicate_json', tags=['version:v4'])
 @json_post
@@ -904,10 +1464,15 @@ def symbolicate_v4_json(request, json_body):
         return JsonResponse({'error': 'Missing key JSON "{}"'.format(
             exception
         )}, status=400)
+    try:
+        time_budget = get_time_budget(request)
+    except ValueError as exception:
+        return JsonResponse({'error': str(exception)}, status=400)
 
     symbolicator = SymbolicateJSON(
         downloader,
         debug=request._request_debug,
+        time_budget=time_budget,
     )
     try:
         result = symbolicator.symbolicate(stacks, memory_map)
@@ -915,36 +1480,19 @@ def symbolicate_v4_json(request, json_body):
         return http.HttpResponse(str(exception), status=503)
     # except SymbolDownloader as exception:
     #     return http.HttpResponse(str(exception), status=503)
-    # The result will have 'symbolicatedStacks' list that isn't in the
-    # old v4 format so we have to rewrite it.
-
-    def rewrite_dict_to_list(d):
-        if 'function' not in d:
-            try:
-                function = hex(d['module_offset'])
-            except TypeError:
-                # Happens if 'module_offset' is not an int16
-                # and thus can't be represented in hex.
-                function = str(d['module_offset'])
-        else:
-            function = d['function']
-        return '{} (in {})'.format(
-            function,
-            d['module']
-        )
 
     increment_symbolication_count('v4')
+    increment_module_popularity(symbolicator.symbol_keys_needed)
     metrics.incr('symbolicate_symbolication', tags=['version:v4'])
 
-    for i, stack in enumerate(result['symbolicatedStacks']):
-        result['symbolicatedStacks'][i] = [
-            rewrite_dict_to_list(x) for x in stack
-        ]
-    return JsonResponse(result)
+    with symbolicator.timings.timer('assemble'):
+        response = JsonResponse(format_v4_result(result))
+    return set_server_timing(response, symbolicator.timings, 'v4')
 
 
 @set_cors_headers(origin='*', methods='POST')
 @csrf_exempt
+@gzip_page
 @set_request_debug
 @metrics.timer_decorator('symbolicate_json', tags=['version:v5'])
 @json_post
@@ -1018,28 +1566,22 @@ def symbolicate_v5_json(request, json_body):
             status=400
         )
 
+    try:
+        time_budget = get_time_budget(request)
+    except ValueError as exception:
+        return JsonResponse({'error': str(exception)}, status=400)
+
     # By creating 1 instance per multiple jobs, we can benefit from
     # re-used downloads of memory maps.
     symbolicator = SymbolicateJSON(
         downloader,
         debug=request._request_debug,
+        time_budget=time_budget,
     )
     results = {
         'results': []
     }
 
-    def serialize_frames(frames):
-        for frame in frames:
-            try:
-                frame['module_offset'] = hex(frame['module_offset'])
-            except TypeError:
-                # Happens if 'module_offset' is not an int16
-                # and thus can't be represented in hex.
-                frame['module_offset'] = str(frame['module_offset'])
-            if 'function_offset' in frame and frame.get('function'):
-                frame['function_offset'] = hex(frame['function_offset'])
-        return frames
-
     increment_symbolication_count('v5')
     metrics.incr('symbolicate_symbolication', tags=['version:v5'])
     metrics.incr(
@@ -1048,40 +1590,54 @@ def symbolicate_v5_json(request, json_body):
         tags=['version:v5']
     )
 
-    try:
-        for job in json_body['jobs']:
-            try:
-                validate_stacks(job['stacks'])
-            except InvalidStacks as exception:
-                return JsonResponse(
-                    {'error': str(exception)},
-                    status=400
-                )
-            try:
-                validate_memory_map(job['memoryMap'])
-            except InvalidMemoryMap as exception:
-                return JsonResponse(
-                    {'error': str(exception)},
-                    status=400
-                )
-
-            result = symbolicator.symbolicate(
-                job['stacks'],
-                job['memoryMap'],
+    for job in json_body['jobs']:
+        try:
+            validate_stacks(job['stacks'])
+        except InvalidStacks as exception:
+            return JsonResponse(
+                {'error': str(exception)},
+                status=400
+            )
+        try:
+            validate_memory_map(job['memoryMap'])
+        except InvalidMemoryMap as exception:
+            return JsonResponse(
+                {'error': str(exception)},
+                status=400
             )
-            found_modules = {}
-            for i, module in enumerate(job['memoryMap']):
-                found_modules['/'.join(module)] = result['knownModules'][i]
 
-            job_result = {
-                'stacks': [
-                    serialize_frames(x) for x in result['symbolicatedStacks']
-                ],
-                'found_modules': found_modules,
-            }
-            if 'debug' in result:
-                job_result['debug'] = result['debug']
-            results['results'].append(job_result)
-        return JsonResponse(results)
+    def serialize_job_results(job_results):
+        for job, result in zip(json_body['jobs'], job_results):
+            yield format_v5_job_result(job['memoryMap'], result)
+
+    try:
+        # All jobs are symbolicated together so that every module, that
+        # more than one job needs, is only looked up (and downloaded) once.
+        job_results = symbolicator.iter_symbolicate_many([
+            (job['stacks'], job['memoryMap'])
+            for job in json_body['jobs']
+        ])
+        increment_module_popularity(symbolicator.symbol_keys_needed)
+        if settings.ENABLE_SYMBOLICATE_STREAMING_RESPONSE:
+            # Send each job's result as soon as it's been made instead of
+            # keeping all of them in memory till the end.
+            # The assembling happens after the headers have been sent
+            # so it can only be in the metrics, not in the header.
+            response = http.StreamingHttpResponse(
+                timed_stream(
+                    stream_json_results(serialize_job_results(job_results)),
+                    symbolicator.timings,
+                    'v5',
+                ),
+                content_type='application/json',
+            )
+            response['Server-Timing'] = (
+                symbolicator.timings.server_timing_header()
+            )
+            return response
+        with symbolicator.timings.timer('assemble'):
+            results['results'].extend(serialize_job_results(job_results))
+            response = JsonResponse(results)
+        return set_server_timing(response, symbolicator.timings, 'v5')
     except operational_exceptions as exception:
         return http.HttpResponse(str(exception), status=503)
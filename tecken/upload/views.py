@@ -34,7 +34,11 @@ from tecken.upload.utils import (
     UnrecognizedArchiveFileExtension,
     upload_file_upload,
 )
-from tecken.symbolicate.tasks import invalidate_symbolicate_cache_task
+from tecken.symbolicate.tasks import (
+    invalidate_symbolicate_cache_task,
+    queue_prebuild_symbolicate_cache,
+)
+from tecken.symbolicate.utils import make_symbol_filename
 from tecken.upload.models import Upload
 from tecken.upload.forms import UploadByDownloadForm
 from tecken.s3 import S3Bucket
@@ -332,6 +336,8 @@ def upload_archive(request, upload_dir):
         )
     file_uploads_created = 0
     uploaded_symbol_keys = []
+    # The subset of uploaded symbol keys whose .sym file was uploaded.
+    symbolicatable_symbol_keys = []
     key_to_symbol_keys = {}
     with thread_pool as executor:
         future_to_key = {}
@@ -364,9 +370,14 @@ def upload_archive(request, upload_dir):
             file_upload = future.result()
             if file_upload:
                 file_uploads_created += 1
-                uploaded_symbol_keys.append(
-                    key_to_symbol_keys[file_upload.key]
-                )
+                symbol_key = key_to_symbol_keys[file_upload.key]
+                uploaded_symbol_keys.append(symbol_key)
+                # Is this the .sym file that symbolication would download
+                # for this symbol key?
+                if os.path.basename(file_upload.key) == make_symbol_filename(
+                    symbol_key[0]
+                ):
+                    symbolicatable_symbol_keys.append(symbol_key)
             else:
                 skipped_keys.append(future_to_key[future])
                 metrics.incr('upload_file_upload_skip', 1)
@@ -375,7 +386,20 @@ def upload_archive(request, upload_dir):
         logger.info(f'Created {file_uploads_created} FileUpload objects')
         # If there were some file uploads, there will be some symbol keys
         # that we can send to a background task to invalidate.
-        invalidate_symbolicate_cache_task.delay(uploaded_symbol_keys)
+        # If enabled, the symbol tables of those that can be symbolicated
+        # are also built straight away. That task does its own
+        # invalidation first.
+        if (
+            settings.ENABLE_SYMBOLICATE_PREBUILD and
+            symbolicatable_symbol_keys and
+            queue_prebuild_symbolicate_cache(symbolicatable_symbol_keys)
+        ):
+            uploaded_symbol_keys = [
+                symbol_key for symbol_key in uploaded_symbol_keys
+                if symbol_key not in symbolicatable_symbol_keys
+            ]
+        if uploaded_symbol_keys:
+            invalidate_symbolicate_cache_task.delay(uploaded_symbol_keys)
     else:
         logger.info(f'No file uploads created for {upload_obj!r}')
 
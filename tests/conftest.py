@@ -2,8 +2,10 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, you can obtain one at http://mozilla.org/MPL/2.0/.
 
+import concurrent.futures
 import json
 import tempfile
+import time
 
 import pytest
 import mock
@@ -14,6 +16,12 @@ from markus.testing import MetricsMock
 from django.core.cache import caches
 from django.contrib.auth.models import User
 
+from tecken.symbolicate.accounting import used_memory_gauge
+from tecken.symbolicate.downloadexecutor import download_executor
+from tecken.symbolicate.framecache import frame_cache
+from tecken.symbolicate.invalidation import invalidation_poller
+from tecken.symbolicate.memorycache import symbol_table_cache
+
 pytest_plugins = ['blockade']
 
 
@@ -27,6 +35,31 @@ def clear_cache():
     caches['default'].clear()
 
 
+@pytest.fixture(autouse=True)
+def clear_symbol_table_cache():
+    symbol_table_cache.clear()
+    frame_cache.clear()
+    used_memory_gauge.reset()
+    invalidation_poller.reset()
+
+
+@pytest.fixture(autouse=True)
+def wait_for_downloads():
+    """Downloads that a test gave up waiting for carry on in the
+    background. Don't let the next test get those (deduplicated). Nor
+    the pool, since the next test's settings might make it a different
+    size."""
+    yield
+    deadline = time.time() + 30
+    while download_executor._in_flight and time.time() < deadline:
+        with download_executor._lock:
+            futures = list(download_executor._in_flight.values())
+        concurrent.futures.wait(futures, timeout=deadline - time.time())
+        # The done callback, that forgets it, might run just after.
+        time.sleep(0.01)
+    download_executor.shutdown()
+
+
 @pytest.fixture
 def json_poster(client):
     """
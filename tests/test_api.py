@@ -16,6 +16,8 @@ from tecken.upload.models import Upload, FileUpload
 from tecken.download.models import MissingSymbol, MicrosoftDownload
 from tecken.api.views import filter_uploads
 from tecken.api.forms import UploadsForm, BaseFilteringForm
+from tecken.symbolicate.accounting import record_symbol_table_stored
+from tecken.symbolicate.popularity import increment_module_popularity
 
 
 @pytest.mark.django_db
@@ -1617,3 +1619,103 @@ def test_stats_symbolication(client):
     assert 'yesterday' in data['symbolications']['v4']
     assert 'today' in data['symbolications']['v5']
     assert 'yesterday' in data['symbolications']['v5']
+
+
+@pytest.mark.django_db
+def test_stats_symbolication_modules(client, clear_redis_store):
+    url = reverse('api:stats_symbolication_modules')
+    response = client.get(url)
+    assert response.status_code == 403
+
+    user = User.objects.create(username='peterbe', email='peterbe@example.com')
+    user.set_password('secret')
+    user.save()
+    assert client.login(username='peterbe', password='secret')
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.json()['modules'] == []
+
+    increment_module_popularity([
+        ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
+        ('wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'),
+    ])
+    increment_module_popularity([
+        ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
+    ])
+    response = client.get(url, {'limit': 1, 'days': 2})
+    assert response.status_code == 200
+    data = response.json()
+    assert data['days'] == 2
+    assert data['modules'] == [
+        {
+            'symbol': 'xul.pdb',
+            'debugid': '44E4EC8C2F41492B9369D6B9A059577C2',
+            'count': 2,
+        },
+    ]
+
+    response = client.get(url, {'limit': 'x'})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_stats_symbolication_store(client, clear_redis_store):
+    url = reverse('api:stats_symbolication_store')
+    response = client.get(url)
+    assert response.status_code == 403
+
+    user = User.objects.create(username='peterbe', email='peterbe@example.com')
+    user.set_password('secret')
+    user.save()
+    assert client.login(username='peterbe', password='secret')
+    response = client.get(url)
+    # Only superusers.
+    assert response.status_code == 403
+
+    user.is_superuser = True
+    user.save()
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.json() == {
+        'count': 0, 'size': 0, 'largest': [], 'most_churned': [],
+    }
+
+    record_symbol_table_stored(
+        ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
+        1000
+    )
+    record_symbol_table_stored(
+        ('wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'),
+        100
+    )
+    record_symbol_table_stored(
+        ('wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'),
+        100
+    )
+    response = client.get(url, {'limit': 1})
+    assert response.status_code == 200
+    data = response.json()
+    assert data['count'] == 2
+    assert data['size'] == 1100
+    assert data['largest'] == [
+        {
+            'symbol': 'xul.pdb',
+            'debugid': '44E4EC8C2F41492B9369D6B9A059577C2',
+            'size': 1000,
+            'loads': 1,
+            'stored': False,
+        }
+    ]
+    assert data['most_churned'] == [
+        {
+            'symbol': 'wntdll.pdb',
+            'debugid': 'D74F79EB1F8D4A45ABCD2F476CCABACC2',
+            'size': 100,
+            'loads': 2,
+            'stored': False,
+        }
+    ]
+
+    response = client.get(url, {'limit': 0})
+    assert response.status_code == 400
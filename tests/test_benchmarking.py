@@ -0,0 +1,90 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+from io import StringIO
+
+import pytest
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+
+SYMBOLS_ZIP = os.path.join(
+    os.path.dirname(__file__),
+    'systemtest',
+    'symbols-for-systemtests.zip'
+)
+
+
+def test_benchmark_symbolicate(tmpdir, clear_redis_store, settings):
+    # Even if the invalidations are polled for on every request, that's
+    # not counted.
+    settings.SYMBOLICATE_INVALIDATION_POLL_SECONDS = 0
+    payloads = os.path.join(tmpdir, 'payloads.jsonl')
+    with open(payloads, 'w') as f:
+        # Version 4
+        f.write(json.dumps({
+            'stacks': [[[0, 65802], [1, 100]]],
+            'memoryMap': [
+                ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+                ['nothere.pdb', '1234567890ABCDEF'],
+            ],
+            'version': 4,
+        }) + '\n')
+        # Version 5
+        f.write(json.dumps({
+            'jobs': [
+                {
+                    'stacks': [[[0, 65802]]],
+                    'memoryMap': [
+                        ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+                    ],
+                },
+                {
+                    'stacks': [[[0, 1000], [0, 2000]]],
+                    'memoryMap': [
+                        ['firefox.pdb', '448794C699914DB8A8F9B9F88B98D7412'],
+                    ],
+                },
+            ]
+        }) + '\n')
+    output = os.path.join(tmpdir, 'results.json')
+
+    out = StringIO()
+    call_command(
+        'benchmark-symbolicate',
+        payloads,
+        '--symbols', SYMBOLS_ZIP,
+        iterations=2,
+        output=output,
+        stdout=out,
+    )
+    assert 'WARM' in out.getvalue()
+    with open(output) as f:
+        results = json.load(f)
+    assert results['payloads'] == 2
+    assert set(results['modes']) == {'cold', 'warm', 'mixed'}
+    cold = results['modes']['cold']
+    assert cold['requests'] == 4
+    assert cold['frames'] == 2 * 5
+    assert cold['p50'] <= cold['p95'] <= cold['p99']
+    assert cold['frames_per_second'] > 0
+    assert cold['peak_rss'] > 0
+    # Once warm, the symbol tables are all in the in-memory cache. Only
+    # the symbol that doesn't exist is looked up in the Redis store, once
+    # per iteration.
+    warm = results['modes']['warm']
+    assert warm['round_trips'] == 2
+    assert cold['round_trips'] > warm['round_trips']
+
+
+def test_benchmark_symbolicate_no_symbols(tmpdir):
+    with pytest.raises(CommandError):
+        call_command(
+            'benchmark-symbolicate',
+            tmpdir,
+            '--symbols', os.path.join(tmpdir, 'nothere.zip'),
+        )
@@ -2,6 +2,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, you can obtain one at http://mozilla.org/MPL/2.0/.
 
+import threading
+import time
+
 import mock
 import pytest
 
@@ -83,6 +86,38 @@ def test_s3bucket_client():
         )
 
 
+def test_s3bucket_client_threads():
+
+    clients_created = []
+
+    def get_client(*args, **kwargs):
+        # Slow enough that all threads would get here without the lock.
+        time.sleep(0.05)
+        client = mock.Mock()
+        clients_created.append(client)
+        return client
+
+    mock_session = mock.Mock()
+    mock_session.client.side_effect = get_client
+
+    def new_session():
+        return mock_session
+
+    with mock.patch('tecken.s3.boto3.session.Session', new=new_session):
+        bucket = S3Bucket('https://s3.amazonaws.com/some-bucket')
+        clients = []
+        threads = [
+            threading.Thread(target=lambda: clients.append(bucket.s3_client))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(clients_created) == 1
+        assert all(client is clients_created[0] for client in clients)
+
+
 def test_region_checking():
     bucket = S3Bucket('https://s3.amazonaws.com/some-bucket')
     assert bucket.region is None
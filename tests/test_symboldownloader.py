@@ -3,7 +3,7 @@
 # file, you can obtain one at http://mozilla.org/MPL/2.0/.
 
 from io import BytesIO
-from gzip import GzipFile
+from gzip import GzipFile, compress, decompress
 
 import pytest
 from botocore.exceptions import ClientError
@@ -12,6 +12,7 @@ from requests.packages.urllib3.response import HTTPResponse
 
 from tecken.s3 import S3Bucket
 from tecken.base.symboldownloader import (
+    GzipStreamReader,
     SymbolDownloader,
     SymbolNotFound,
     iter_lines,
@@ -582,6 +583,27 @@ def test_get_stream_public(requestsmock):
         list(stream)
 
 
+def test_get_stream_public_not_decoded(requestsmock):
+    requestsmock.get(
+        'https://s3.example.com/public/prefix/v0/xul.pdb/'
+        '44E4EC8C2F41492B9369D6B9A059577C2/xul.sym',
+        content='LINE ONE\nLINE TVÅ\n'.encode('utf-8')
+    )
+    urls = (
+        'https://s3.example.com/public/prefix/?access=public',
+    )
+    downloader = SymbolDownloader(urls)
+    stream = downloader.get_symbol_stream(
+        'xul.pdb',
+        '44E4EC8C2F41492B9369D6B9A059577C2',
+        'xul.sym',
+        decode=False,
+    )
+    next(stream)
+    lines = list(stream)
+    assert lines == [b'LINE ONE', 'LINE TVÅ'.encode('utf-8')]
+
+
 def test_get_stream_private(botomock):
 
     long_line = 'x' * 600
@@ -671,6 +693,56 @@ def test_get_stream_gzipped(botomock):
         ]
 
 
+def test_gzip_stream_reader():
+
+    class Body(BytesIO):
+        # Like botocore's StreamingBody, never read all at once.
+        def read(self, amt=None):
+            assert amt is not None
+            return super().read(amt)
+
+    payload = b''.join(b'line %d\n' % i for i in range(10000))
+    buffer_ = BytesIO()
+    with GzipFile(fileobj=buffer_, mode='w') as f:
+        f.write(payload[:1000])
+    # A second gzip member concatenated to the first.
+    with GzipFile(fileobj=buffer_, mode='w') as f:
+        f.write(payload[1000:])
+    payload_gz = buffer_.getvalue()
+
+    stream = GzipStreamReader(Body(payload_gz), chunk_size=100)
+    lines = list(iter_lines(stream))
+    assert lines == payload.splitlines()
+    assert stream.read() == b''
+
+    stream = GzipStreamReader(Body(payload_gz), chunk_size=100)
+    assert stream.read() == payload
+
+    # Padded with NULs after (and between) the members, which GzipFile
+    # accepts too. Even when the padding spans several chunks.
+    first_gz = compress(payload[:1000])
+    padded_gz = (
+        first_gz + b'\x00' * 250 + compress(payload[1000:]) +
+        b'\x00' * 250
+    )
+    assert decompress(padded_gz) == payload
+    stream = GzipStreamReader(Body(padded_gz), chunk_size=100)
+    assert stream.read() == payload
+    stream = GzipStreamReader(Body(first_gz + b'\x00' * 3), chunk_size=100)
+    assert stream.read() == payload[:1000]
+
+    # Not gzipped at all.
+    stream = GzipStreamReader(Body(payload))
+    with pytest.raises(OSError) as exception:
+        stream.read(10)
+    assert 'Not a gzipped file' in str(exception.value)
+
+    # Truncated.
+    stream = GzipStreamReader(Body(payload_gz[:-100]), chunk_size=100)
+    with pytest.raises(EOFError):
+        stream.read()
+
+
 def test_get_stream_gzipped_but_not_gzipped(botomock):
 
     def mock_api_call(self, operation_name, api_params):
@@ -3,22 +3,86 @@
 # file, you can obtain one at http://mozilla.org/MPL/2.0/.
 
 import copy
+import gzip
+import json
+import os
 import re
-from io import BytesIO
+import signal
+import sqlite3
+import threading
+import time
+import zlib
+from io import BytesIO, StringIO
 
 import botocore
+import mock
 import requests
 import pytest
-from markus import INCR, GAUGE
+from redis.client import StrictPipeline
+from markus import INCR, GAUGE, HISTOGRAM, TIMING
 from botocore.exceptions import ClientError
+from django_redis import get_redis_connection
 
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.urls import reverse
 from django.core.cache import caches, cache
 from django.utils import timezone
 
 from tecken.base.symboldownloader import SymbolDownloader, SymbolDownloadError
-from tecken.symbolicate import views
-from tecken.symbolicate.tasks import invalidate_symbolicate_cache
+from tecken.symbolicate import memorycache, tasks, views
+from tecken.symbolicate.accounting import get_store_accounting
+from tecken.symbolicate.diskcache import SymbolTableDiskCache
+from tecken.symbolicate.downloadexecutor import (
+    DownloadExecutor,
+    RequestDownloads,
+    download_executor,
+)
+from tecken.symbolicate.files import is_locked
+from tecken.symbolicate.framecache import FrameCache, frame_cache
+from tecken.symbolicate.invalidation import (
+    InvalidationPoller,
+    record_invalidations,
+)
+from tecken.symbolicate.lease import Lease
+from tecken.symbolicate.memorycache import (
+    SymbolTableCache,
+    symbol_table_cache,
+)
+from tecken.symbolicate.parseexecutor import (
+    LOCK_FILE_SUFFIX,
+    ParseExecutor,
+    parse_executor,
+)
+from tecken.symbolicate.parser import (
+    parse_symbol_file,
+    parse_symbol_lines,
+    parse_symbol_table,
+)
+from tecken.symbolicate.storage import (
+    FileSystemSymbolTableStore,
+    RedisSymbolTableStore,
+    SQLiteSymbolTableStore,
+    get_symbol_table_store,
+)
+from tecken.symbolicate.popularity import (
+    get_hot_modules,
+    increment_module_popularity,
+)
+from tecken.symbolicate.symboltable import (
+    EMPTY_SYMBOL_TABLE,
+    InvalidSymbolTable,
+    PagedSymbolTable,
+    SymbolTable,
+    read_symbol_table,
+)
+from tecken.symbolicate.tasks import (
+    invalidate_symbolicate_cache,
+    prebuild_symbolicate_cache_task,
+    prewarm_symbolicate_cache,
+    queue_prebuild_symbolicate_cache,
+)
+from tecken.symbolicate.timings import StageTimings
 
 
 SAMPLE_SYMBOL_CONTENT = {
@@ -316,9 +380,19 @@ def test_client_happy_path_v5(
         INCR, 'tecken.symbolicate_symbolication_jobs', 1, ['version:v5']
     )
     assert metrics_records[2] == (
-        INCR, 'tecken.symbolicate_symbol_key', 1, ['cache:miss']
+        INCR, 'tecken.symbolicate_memory_cache_lookup', 1, ['cache:miss']
     )
     assert metrics_records[3] == (
+        INCR, 'tecken.symbolicate_memory_cache_lookup', 1, ['cache:miss']
+    )
+    # One pipeline of all the Redis store reads. Its timing varies.
+    assert metrics_records[4][:2] == (
+        TIMING, 'tecken.symbolicate_store_pipeline'
+    )
+    assert metrics_records[5] == (
+        INCR, 'tecken.symbolicate_symbol_key', 1, ['cache:miss']
+    )
+    assert metrics_records[6] == (
         INCR, 'tecken.symbolicate_symbol_key', 1, ['cache:miss']
     )
 
@@ -333,7 +407,9 @@ def test_client_happy_path_v5(
         record for record in metrics_records
         if record[0] == GAUGE and 'used_memory' in record[1]
     ]
-    assert len(memory_gauges) == 2
+    # Two symbol tables were stored but the used memory is only sent
+    # once per settings.SYMBOLICATE_USED_MEMORY_GAUGE_INTERVAL_SECONDS.
+    assert len(memory_gauges) == 1
 
     # Called the first time it had to do a symbol store
     metricsmock.has_record(GAUGE, 'tecken.store_keys', 1, None)
@@ -355,7 +431,10 @@ def test_client_happy_path_v5_with_debug(
     url = reverse('symbolicate:symbolicate_v5_json')
     with botomock(default_mock_api_call):
         job = {
-            'stacks': [[[0, 11723767], [1, 65802]]],
+            'stacks': [
+                [[0, 11723767], [1, 65802]],
+                [[0, 11723767], [0, 11723767]],
+            ],
             'memoryMap': [
                 ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
                 ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2']
@@ -368,6 +447,11 @@ def test_client_happy_path_v5_with_debug(
     # There are other tests that do a better job of testing the debug
     # content.
     assert result1['debug']
+    # Every frame, of every stack, in that module.
+    assert result1['debug']['modules']['stacks_per_module'] == {
+        'xul.pdb/44E4EC8C2F41492B9369D6B9A059577C2': 3,
+        'wntdll.pdb/D74F79EB1F8D4A45ABCD2F476CCABACC2': 1,
+    }
 
 
 def test_client_happy_path_v5_with_m_prefix(
@@ -474,7 +558,7 @@ def test_v5_first_download_address_missing(
                 'frame': 2,
                 'function': 'KiUserExceptionDispatcher',
                 'function_offset': '0x4f',
-                'module': 'xul.pdb',
+                'module': 'wntdll.pdb',
                 'module_offset': '0x10173'
             }
         ]
@@ -528,9 +612,19 @@ def test_client_happy_path_v4(
 
     metrics_records = metricsmock.get_records()
     assert metrics_records[0] == (
-        INCR, 'tecken.symbolicate_symbol_key', 1, ['cache:miss']
+        INCR, 'tecken.symbolicate_memory_cache_lookup', 1, ['cache:miss']
     )
     assert metrics_records[1] == (
+        INCR, 'tecken.symbolicate_memory_cache_lookup', 1, ['cache:miss']
+    )
+    # One pipeline of all the Redis store reads. Its timing varies.
+    assert metrics_records[2][:2] == (
+        TIMING, 'tecken.symbolicate_store_pipeline'
+    )
+    assert metrics_records[3] == (
+        INCR, 'tecken.symbolicate_symbol_key', 1, ['cache:miss']
+    )
+    assert metrics_records[4] == (
         INCR, 'tecken.symbolicate_symbol_key', 1, ['cache:miss']
     )
 
@@ -545,7 +639,9 @@ def test_client_happy_path_v4(
         record for record in metrics_records
         if record[0] == GAUGE and 'used_memory' in record[1]
     ]
-    assert len(memory_gauges) == 2
+    # Two symbol tables were stored but the used memory is only sent
+    # once per settings.SYMBOLICATE_USED_MEMORY_GAUGE_INTERVAL_SECONDS.
+    assert len(memory_gauges) == 1
 
     # Called the first time it had to do a symbol store
     metricsmock.has_record(GAUGE, 'tecken.store_keys', 1, None)
@@ -597,7 +693,7 @@ def test_symbolicate_v4_json_one_cache_lookup(
     assert result['debug']['downloads']['count'] == 2
     # 'xul.pdb' is needed once, 'wntdll.pdb' is needed twice
     # but it should only require 1 cache lookup.
-    assert result['debug']['cache_lookups']['count'] == 2
+    assert result['debug']['cache_lookups']['count'] == 1
 
 
 def test_symbolicate_v4_json_lru_causing_mischief(
@@ -645,15 +741,18 @@ def test_symbolicate_v4_json_lru_causing_mischief(
         ]
     ]
     assert result['debug']['downloads']['count'] == 2
-    assert result['debug']['cache_lookups']['count'] == 2
+    assert result['debug']['cache_lookups']['count'] == 1
 
-    # Pretend the LRU evicted the 'xul.pdb/...' hashmap.
+    # Pretend the LRU evicted the 'xul.pdb/...' symbol table.
     store = caches['store']
-    hashmap_key, = [
+    symbol_table_key, = [
         key for key in store.iter_keys('*')
-        if not key.endswith(':keys') and 'xul.pdb' in key
+        if 'xul.pdb' in key
     ]
-    assert store.delete(hashmap_key)
+    assert store.delete(symbol_table_key)
+    # And pretend the next request goes to a different web worker that
+    # doesn't have anything in its in-memory cache.
+    symbol_table_cache.clear()
 
     # Same symbolication one more time
     response = json_poster(url, {
@@ -788,7 +887,7 @@ def test_symbolicate_v4_json_happy_path_with_debug(
     assert result['debug']['stacks']['real'] == 2
     assert result['debug']['time'] > 0.0
     # One cache lookup was attempted
-    assert result['debug']['cache_lookups']['count'] == 2
+    assert result['debug']['cache_lookups']['count'] == 1
     assert result['debug']['cache_lookups']['time'] > 0.0
     assert result['debug']['downloads']['count'] == 2
     assert result['debug']['downloads']['size'] > 0.0
@@ -821,12 +920,67 @@ def test_symbolicate_v4_json_happy_path_with_debug(
     assert result['debug']['stacks']['real'] == 2
     assert result['debug']['stacks']['count'] == 2
     assert result['debug']['time'] > 0.0
-    assert result['debug']['cache_lookups']['count'] == 5
-    assert result['debug']['cache_lookups']['time'] > 0.0
+    # Both symbol tables are in the in-memory cache now.
+    assert result['debug']['cache_lookups']['count'] == 0
+    assert result['debug']['memory_cache']['hits'] == 2
     assert result['debug']['downloads']['count'] == 0
     assert result['debug']['downloads']['size'] == 0.0
     assert result['debug']['downloads']['time'] == 0.0
 
+    # Pretend it's a different web worker process and look it up again.
+    # This time they should be drawn from the Redis store.
+    symbol_table_cache.clear()
+    with botomock(default_mock_api_call):
+        response = json_poster(url, {
+            'stacks': [[[0, 11723767], [1, 65802]]],
+            'memoryMap': [
+                ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+                ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2']
+            ],
+            'version': 4,
+        }, debug=True)
+    result = response.json()
+    assert result['knownModules'] == [True, True]
+    # Both symbol tables are fetched with one single lookup.
+    assert result['debug']['cache_lookups']['count'] == 1
+    assert result['debug']['cache_lookups']['time'] > 0.0
+    pipeline, = result['debug']['cache_lookups']['pipelines']
+    assert pipeline['keys'] == 2
+    assert pipeline['commands'] == 1
+    assert result['debug']['memory_cache']['hits'] == 0
+    assert result['debug']['downloads']['count'] == 0
+
+
+def test_symbolicate_v5_json_pipeline_batches(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    settings,
+):
+    settings.SYMBOLICATE_STORE_PIPELINE_BATCH_SIZE = 2
+    reload_downloader('https://s3.example.com/public/prefix/')
+
+    url = reverse('symbolicate:symbolicate_v5_json')
+    job = {
+        'stacks': [[[0, 11723767], [1, 65802], [2, 100]]],
+        'memoryMap': [
+            ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+            ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+            ['firefox.pdb', '9A8C8930C5E935E3B441CC9D6E72BB990'],
+        ],
+    }
+    with botomock(default_mock_api_call):
+        json_poster(url, job)
+    symbol_table_cache.clear()
+    response = json_poster(url, job, debug=True)
+    result1, = response.json()['results']
+    assert all(result1['found_modules'].values())
+    assert result1['debug']['downloads']['count'] == 0
+    # Still one round-trip but the 3 keys were split up in 2 MGETs.
+    pipeline, = result1['debug']['cache_lookups']['pipelines']
+    assert pipeline['keys'] == 3
+    assert pipeline['commands'] == 2
+
 
 def test_symbolicate_v4_json_one_symbol_not_found_with_debug(
     json_poster,
@@ -911,6 +1065,265 @@ def test_symbolicate_v5_json_one_symbol_not_found(
     }
 
 
+def test_symbolicate_v5_json_download_timeout(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    metricsmock,
+    settings,
+):
+    settings.SYMBOLICATE_DOWNLOAD_TIMEOUT_SECONDS = 1
+    reload_downloader('https://s3.example.com/public/prefix/')
+
+    released = threading.Event()
+
+    def mock_api_call(self, operation_name, api_params):
+        filename = api_params['Key'].split('/')[-1]
+        if filename == 'wntdll.sym':
+            # Take longer than the whole request is willing to wait.
+            released.wait(10)
+        return default_mock_api_call(self, operation_name, api_params)
+
+    url = reverse('symbolicate:symbolicate_v5_json')
+    with botomock(mock_api_call):
+        response = json_poster(url, {
+            'stacks': [[[0, 11723767], [1, 65802]]],
+            'memoryMap': [
+                ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+                ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2']
+            ],
+        })
+        result = response.json()
+        result1, = result['results']
+        # Not known yet. The caller can try again later.
+        assert result1['found_modules'] == {
+            'xul.pdb/44E4EC8C2F41492B9369D6B9A059577C2': True,
+            'wntdll.pdb/D74F79EB1F8D4A45ABCD2F476CCABACC2': 'pending',
+        }
+        assert result1['stacks'][0][1] == {
+            'module_offset': '0x1010a',
+            'module': 'wntdll.pdb',
+            'frame': 1,
+        }
+        metricsmock.has_record(INCR, 'tecken.symbolicate_download_timeout', 1)
+
+        # The download that we gave up on keeps going in the background
+        # and, once done, it gets stored for the next request.
+        released.set()
+        cache_key = views.SymbolicateJSON._make_cache_key(
+            ('wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2')
+        )
+        for _ in range(50):
+            if cache_key in symbol_table_cache:
+                break
+            time.sleep(0.1)
+        else:
+            raise AssertionError('Never stored')
+
+        response = json_poster(url, {
+            'stacks': [[[0, 65802]]],
+            'memoryMap': [
+                ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2']
+            ],
+        })
+        result1, = response.json()['results']
+        assert result1['found_modules'] == {
+            'wntdll.pdb/D74F79EB1F8D4A45ABCD2F476CCABACC2': True,
+        }
+
+
+def test_symbolicate_json_time_budget(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    settings,
+):
+    settings.SYMBOLICATE_TIME_BUDGET_SECONDS = 30
+    reload_downloader('https://s3.example.com/public/prefix/')
+
+    released = threading.Event()
+
+    def mock_api_call(self, operation_name, api_params):
+        filename = api_params['Key'].split('/')[-1]
+        if filename == 'wntdll.sym':
+            # Take longer than the caller is willing to wait.
+            released.wait(10)
+        return default_mock_api_call(self, operation_name, api_params)
+
+    url = reverse('symbolicate:symbolicate_v4_json')
+    with botomock(mock_api_call):
+        t0 = time.time()
+        response = json_poster(
+            url,
+            {
+                'stacks': [[[0, 11723767], [1, 65802]]],
+                'memoryMap': [
+                    ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+                    ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2']
+                ],
+                'version': 4,
+            },
+            HTTP_SYMBOLICATE_TIME_BUDGET='0.5',
+        )
+        t1 = time.time()
+        released.set()
+    assert response.status_code == 200
+    assert t1 - t0 < 5
+    result = response.json()
+    assert result['knownModules'] == [True, 'pending']
+    assert result['symbolicatedStacks'] == [[
+        'XREMain::XRE_mainRun() (in xul.pdb)',
+        '0x1010a (in wntdll.pdb)',
+    ]]
+
+    for value in ('junk', '-1', 'nan'):
+        response = json_poster(
+            reverse('symbolicate:symbolicate_v5_json'),
+            {
+                'stacks': [[[0, 11723767]]],
+                'memoryMap': [
+                    ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+                ],
+            },
+            HTTP_SYMBOLICATE_TIME_BUDGET=value,
+        )
+        assert response.status_code == 400
+        assert 'Symbolicate-Time-Budget' in response.json()['error']
+
+
+def test_symbolicate_v5_json_coalesced_download(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    metricsmock,
+):
+    reload_downloader('https://s3.example.com/public/prefix/')
+    symbol_key = ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2')
+    cache_key = views.SymbolicateJSON._make_cache_key(symbol_key)
+    store = caches['store']
+    redis_store_connection = get_redis_connection('store')
+
+    # Pretend some other web worker is busy downloading this symbol.
+    lease = Lease(
+        redis_store_connection,
+        store.make_key(f'{cache_key}:lease'),
+        10,
+    )
+    assert lease.acquire()
+
+    def other_worker_finishes():
+        time.sleep(0.3)
+        redis_store_connection.set(
+            store.make_key(cache_key),
+            SymbolTable.serialize({0xb2e3f7: 'XREMain::XRE_mainRun()'}),
+        )
+        lease.release()
+
+    thread = threading.Thread(target=other_worker_finishes)
+    thread.start()
+
+    def mock_api_call(self, operation_name, api_params):
+        raise AssertionError('Should not need to download')
+
+    url = reverse('symbolicate:symbolicate_v5_json')
+    with botomock(mock_api_call):
+        response = json_poster(url, {
+            'stacks': [[[0, 11723767]]],
+            'memoryMap': [list(symbol_key)],
+        })
+    thread.join()
+    result1, = response.json()['results']
+    assert result1['stacks'][0][0]['function'] == 'XREMain::XRE_mainRun()'
+    metricsmock.has_record(INCR, 'tecken.symbolicate_download_coalesced', 1)
+    assert not redis_store_connection.exists(
+        store.make_key(f'{cache_key}:lease')
+    )
+
+
+def test_symbolicate_v5_json_coalesced_download_timeout(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    metricsmock,
+    settings,
+):
+    settings.SYMBOLICATE_DOWNLOAD_LEASE_WAIT_SECONDS = 0.2
+    reload_downloader('https://s3.example.com/public/prefix/')
+    symbol_key = ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2')
+    cache_key = views.SymbolicateJSON._make_cache_key(symbol_key)
+    store = caches['store']
+    lease_key = store.make_key(f'{cache_key}:lease')
+    redis_store_connection = get_redis_connection('store')
+
+    # Pretend some other web worker is downloading it but never finishes.
+    lease = Lease(redis_store_connection, lease_key, 10)
+    assert lease.acquire()
+
+    url = reverse('symbolicate:symbolicate_v5_json')
+    with botomock(default_mock_api_call):
+        response = json_poster(url, {
+            'stacks': [[[0, 11723767]]],
+            'memoryMap': [list(symbol_key)],
+        })
+    result1, = response.json()['results']
+    # It gave up waiting and downloaded it itself.
+    assert result1['stacks'][0][0]['function'] == 'XREMain::XRE_mainRun()'
+    metricsmock.has_record(
+        INCR, 'tecken.symbolicate_download_coalesce_timeout', 1
+    )
+    # The other worker's lease is left alone.
+    assert redis_store_connection.get(lease_key) == lease.token.encode()
+
+
+def test_symbolicate_v5_json_coalesced_download_time_budget(
+    json_poster,
+    clear_redis_store,
+    botomock,
+):
+    reload_downloader('https://s3.example.com/public/prefix/')
+    symbol_key = ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2')
+    cache_key = views.SymbolicateJSON._make_cache_key(symbol_key)
+    store = caches['store']
+    redis_store_connection = get_redis_connection('store')
+
+    # Pretend some other web worker is downloading it but never finishes.
+    lease = Lease(
+        redis_store_connection,
+        store.make_key(f'{cache_key}:lease'),
+        10,
+    )
+    assert lease.acquire()
+
+    def mock_api_call(self, operation_name, api_params):
+        raise AssertionError('Should not need to download')
+
+    url = reverse('symbolicate:symbolicate_v5_json')
+    t0 = time.time()
+    with botomock(mock_api_call):
+        response = json_poster(
+            url,
+            {
+                'stacks': [[[0, 11723767]]],
+                'memoryMap': [list(symbol_key)],
+            },
+            HTTP_SYMBOLICATE_TIME_BUDGET='0.5',
+        )
+    # Not settings.SYMBOLICATE_DOWNLOAD_LEASE_WAIT_SECONDS.
+    assert time.time() - t0 < 5
+    result1, = response.json()['results']
+    assert result1['found_modules'] == {
+        'xul.pdb/44E4EC8C2F41492B9369D6B9A059577C2': 'pending',
+    }
+    # The waiting was done by the request, not a thread of the pool. (The
+    # callback that forgets what's done might run just after the result.)
+    for _ in range(10):
+        if not download_executor._in_flight:
+            break
+        time.sleep(0.1)
+    else:
+        raise AssertionError('Still in the pool')
+
+
 def test_symbolicate_v5_json_one_symbol_never_looked_up(
     json_poster,
     clear_redis_store,
@@ -1162,6 +1575,7 @@ def test_symbolicate_v5_json_reused_memory_maps(
     json_poster,
     clear_redis_store,
     botomock,
+    metricsmock,
 ):
     reload_downloader('https://s3.example.com/public/prefix/')
 
@@ -1190,99 +1604,509 @@ def test_symbolicate_v5_json_reused_memory_maps(
         response = json_poster(url, {'jobs': [job1, job2, job3]}, debug=True)
     result = response.json()
 
+    # All modules of all jobs are looked up in the store once and
+    # that's accounted for in the first job's debug output. Each
+    # download is accounted for in the first job that needed it.
     result1 = result['results'][0]
     assert result1['debug']['downloads']['count'] == 2
-    assert result1['debug']['cache_lookups']['count'] == 2
+    assert result1['debug']['cache_lookups']['count'] == 1
 
     result2 = result['results'][1]
     assert result2['debug']['downloads']['count'] == 0
     assert result2['debug']['cache_lookups']['count'] == 0
+    assert result2['stacks'][0][0]['function'] == 'XREMain::XRE_mainRun()'
 
     result3 = result['results'][2]
     assert result3['debug']['downloads']['count'] == 1
-    assert result3['debug']['cache_lookups']['count'] == 2
+    assert result3['debug']['cache_lookups']['count'] == 0
+    assert result3['found_modules'] == {
+        'firefox.pdb/9A8C8930C5E935E3B441CC9D6E72BB990': True,
+    }
 
+    records = metricsmock.filter_records(
+        TIMING,
+        stat='tecken.symbolicate_get_symbol_maps',
+    )
+    assert len(records) == 1
 
-def test_invalidate_symbols_invalidates_cache(
+
+def test_symbolicate_v5_json_streaming_response(
+    json_poster,
     clear_redis_store,
     botomock,
-    json_poster,
-    settings
+    settings,
 ):
-    settings.SYMBOL_URLS = ['https://s3.example.com/private/prefix/']
-    reload_downloader('https://s3.example.com/private/prefix/')
-
-    mock_api_calls = []
-
-    def mock_api_call(self, operation_name, api_params):
-        assert operation_name == 'GetObject'
-        if mock_api_calls:
-            # This means you're here for the second time.
-            # Pretend we have the symbol this time.
-            mock_api_calls.append((operation_name, api_params))
-            return {
-                'Body': BytesIO(
-                    bytes(SAMPLE_SYMBOL_CONTENT['xul.sym'], 'utf-8')
-                )
-            }
-        else:
-            mock_api_calls.append((operation_name, api_params))
-            if api_params['Key'].endswith('xul.sym'):
-                parsed_response = {
-                    'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'},
-                }
-                raise ClientError(parsed_response, operation_name)
-            raise NotImplementedError(api_params)
+    reload_downloader('https://s3.example.com/public/prefix/')
 
-    with botomock(mock_api_call):
-        url = reverse('symbolicate:symbolicate_v5_json')
-        response = json_poster(url, {
-            'stacks': [[[0, 11723767]]],
+    url = reverse('symbolicate:symbolicate_v5_json')
+    jobs = [
+        {
+            'stacks': [[[0, 11723767], [1, 65802]]],
             'memoryMap': [
-                ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2']
+                ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+                ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2']
             ],
-        })
-        result = response.json()
-        result1 = result['results'][0]
-        stack1 = result1['stacks'][0]
-        frame1 = stack1[0]
-        assert 'function' not in frame1  # module couldn't be found
-        assert len(mock_api_calls) == 1
-
-        response = json_poster(url, {
-            'stacks': [[[0, 11723767]]],
+        },
+        {
+            'stacks': [[[0, 10613656]]],
             'memoryMap': [
-                ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2']
+                ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
             ],
-        })
-        result = response.json()
-        result1 = result['results'][0]
-        stack1 = result1['stacks'][0]
-        frame1 = stack1[0]
-        assert 'function' not in frame1  # module still couldn't be found
-        # Expected because the cache stores that the file can't be found.
-        assert len(mock_api_calls) == 1
+        },
+    ]
+    with botomock(default_mock_api_call):
+        response = json_poster(url, {'jobs': jobs})
+        assert not response.streaming
+        expected = response.json()
 
-        # Pretend an upload comes in and stores those symbols.
-        invalidate_symbolicate_cache([
-            ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
-        ])
-        response = json_poster(url, {
-            'stacks': [[[0, 11723767]]],
-            'memoryMap': [
-                ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2']
-            ],
-        })
-        result = response.json()
-        result1 = result['results'][0]
-        stack1 = result1['stacks'][0]
-        frame1 = stack1[0]
-        assert frame1['function']
-        assert frame1['function'] == 'XREMain::XRE_mainRun()'
-        assert len(mock_api_calls) == 2
+        settings.ENABLE_SYMBOLICATE_STREAMING_RESPONSE = True
+        response = json_poster(url, {'jobs': jobs})
+    assert response.status_code == 200
+    assert response.streaming
+    assert response['Content-Type'] == 'application/json'
+    assert response['Access-Control-Allow-Origin'] == '*'
+    content = b''.join(response.streaming_content)
+    assert json.loads(content.decode('utf-8')) == expected
+    assert len(expected['results']) == 2
 
 
-def test_change_symbols_urls_invalidates_cache(
+def test_symbolicate_v5_json_compressed(
+    client,
+    json_poster,
+    clear_redis_store,
+    botomock,
+    settings,
+):
+    reload_downloader('https://s3.example.com/public/prefix/')
+
+    url = reverse('symbolicate:symbolicate_v5_json')
+    body = json.dumps({
+        'jobs': [
+            {
+                'stacks': [[[0, 11723767], [1, 65802]]],
+                'memoryMap': [
+                    ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+                    ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2']
+                ],
+            },
+        ] * 10
+    }).encode('utf-8')
+    with botomock(default_mock_api_call):
+        response = json_poster(url, body.decode('utf-8'))
+        assert response.status_code == 200
+        assert 'Content-Encoding' not in response
+        expected = response.json()
+
+        response = client.post(
+            url,
+            gzip.compress(body),
+            content_type='application/json',
+            HTTP_CONTENT_ENCODING='gzip',
+        )
+        assert response.status_code == 200
+        assert response.json() == expected
+
+        response = client.post(
+            url,
+            zlib.compress(body),
+            content_type='application/json',
+            HTTP_CONTENT_ENCODING='deflate',
+        )
+        assert response.status_code == 200
+        assert response.json() == expected
+
+        # Compressed response.
+        response = client.post(
+            url,
+            body,
+            content_type='application/json',
+            HTTP_ACCEPT_ENCODING='gzip',
+        )
+        assert response.status_code == 200
+        assert response['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response['Vary']
+        assert json.loads(gzip.decompress(response.content)) == expected
+
+        # Streamed and compressed response.
+        settings.ENABLE_SYMBOLICATE_STREAMING_RESPONSE = True
+        response = client.post(
+            url,
+            body,
+            content_type='application/json',
+            HTTP_ACCEPT_ENCODING='gzip',
+        )
+        assert response.status_code == 200
+        assert response.streaming
+        assert response['Content-Encoding'] == 'gzip'
+        content = b''.join(response.streaming_content)
+        assert json.loads(gzip.decompress(content)) == expected
+
+    response = client.post(
+        url,
+        gzip.compress(body)[:-10],
+        content_type='application/json',
+        HTTP_CONTENT_ENCODING='gzip',
+    )
+    assert response.status_code == 400
+    assert response.json()['error']
+
+    response = client.post(
+        url,
+        body,
+        content_type='application/json',
+        HTTP_CONTENT_ENCODING='gzip',
+    )
+    assert response.status_code == 400
+    assert 'decompress' in response.json()['error']
+
+    response = client.post(
+        url,
+        body,
+        content_type='application/json',
+        HTTP_CONTENT_ENCODING='compress',
+    )
+    assert response.status_code == 415
+    assert response.json()['error']
+
+    # Too big once decompressed.
+    settings.SYMBOLICATE_MAX_REQUEST_BODY_SIZE = len(body) - 1
+    response = client.post(
+        url,
+        gzip.compress(body),
+        content_type='application/json',
+        HTTP_CONTENT_ENCODING='gzip',
+    )
+    assert response.status_code == 413
+    assert response.json()['error']
+    response = json_poster(url, body.decode('utf-8'))
+    assert response.status_code == 413
+
+
+def test_symbolicate_v5_json_paged_store(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    settings,
+):
+    reload_downloader('https://s3.example.com/public/prefix/')
+
+    url = reverse('symbolicate:symbolicate_v5_json')
+    body = {
+        'stacks': [[[0, 11723767], [1, 65802], [0, 10613656]]],
+        'memoryMap': [
+            ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+            ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2']
+        ],
+    }
+    with botomock(default_mock_api_call):
+        expected = json_poster(url, body).json()
+
+    settings.SYMBOLICATE_STORE_PAGE_SIZE = 2
+    caches['store'].clear()
+    symbol_table_cache.clear()
+    with botomock(default_mock_api_call):
+        result = json_poster(url, body, debug=True).json()
+    assert result['results'][0]['debug']['downloads']['count'] == 2
+    del result['results'][0]['debug']
+    assert result == expected
+
+    # As if this was another web worker.
+    symbol_table_cache.clear()
+    result = json_poster(url, body, debug=True).json()
+    debug = result['results'][0]['debug']
+    assert debug['downloads']['count'] == 0
+    # One pipeline for the indexes and one for the pages.
+    assert debug['cache_lookups']['count'] == 2
+    del result['results'][0]['debug']
+    assert result == expected
+
+    redis_store_connection = get_redis_connection('store')
+    page_keys = redis_store_connection.keys('*:page:*')
+    assert page_keys
+
+    # If a page has been evicted from the Redis store, the symbol table
+    # is downloaded again. Only the one for 'wntdll.pdb' has more than two
+    # offsets, and is paged.
+    redis_store_connection.delete(*page_keys)
+    symbol_table_cache.clear()
+    with botomock(default_mock_api_call):
+        result = json_poster(url, body, debug=True).json()
+    assert result['results'][0]['debug']['downloads']['count'] == 1
+    del result['results'][0]['debug']
+    assert result == expected
+
+    # If a page has been evicted while some other web worker is already
+    # downloading it again, the index they haven't overwritten yet is
+    # no good either. It's pending till they've stored it.
+    symbol_key = ('wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2')
+    cache_key = views.SymbolicateJSON._make_cache_key(symbol_key)
+    lease = Lease(
+        redis_store_connection,
+        caches['store'].make_key(f'{cache_key}:lease'),
+        10,
+    )
+    assert lease.acquire()
+    try:
+        redis_store_connection.delete(
+            *redis_store_connection.keys('*:page:*')
+        )
+        symbol_table_cache.clear()
+
+        def mock_api_call(self, operation_name, api_params):
+            raise AssertionError('Should not need to download')
+
+        with botomock(mock_api_call):
+            result = json_poster(url, body).json()
+    finally:
+        lease.release()
+    result1, = result['results']
+    assert result1['found_modules'] == {
+        'xul.pdb/44E4EC8C2F41492B9369D6B9A059577C2': True,
+        'wntdll.pdb/D74F79EB1F8D4A45ABCD2F476CCABACC2': 'pending',
+    }
+    assert result1['stacks'][0][1] == {
+        'module_offset': '0x1010a',
+        'module': 'wntdll.pdb',
+        'frame': 1,
+    }
+
+
+def test_invalidation_poller(clear_redis_store, settings, metricsmock):
+    settings.SYMBOLICATE_INVALIDATION_POLL_SECONDS = 0
+    poller = InvalidationPoller()
+    record_invalidations(['before'])
+    symbol_table = SymbolTable.from_symbol_map({10: 'small'})
+    for key in ('before', 'a', 'b', 'c'):
+        symbol_table_cache.set(key, symbol_table)
+    frame_cache.set_many('a', {1: (0, 'one')})
+
+    # Whatever was invalidated before the first poll is ignored.
+    assert poller.poll() == 0
+    assert 'before' in symbol_table_cache
+
+    # As if invalidated by another process.
+    record_invalidations(['a', 'b'])
+    assert poller.poll() == 2
+    assert 'a' not in symbol_table_cache
+    assert 'b' not in symbol_table_cache
+    assert 'c' in symbol_table_cache
+    assert not frame_cache.get_many('a', [1])
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_invalidation_evicted', 2
+    )
+    assert poller.poll() == 0
+
+    # Not more often than this.
+    settings.SYMBOLICATE_INVALIDATION_POLL_SECONDS = 60
+    assert poller.poll() == 0
+    record_invalidations(['c'])
+    assert poller.poll() == 0
+    assert 'c' in symbol_table_cache
+
+    # Too far behind, i.e. some invalidations have been forgotten, and
+    # everything is cleared.
+    settings.SYMBOLICATE_INVALIDATION_POLL_SECONDS = 0
+    with mock.patch('tecken.symbolicate.invalidation.MAX_INVALIDATIONS', 2):
+        record_invalidations(['d'])
+        record_invalidations(['e'])
+        assert poller.poll()
+    assert len(symbol_table_cache) == 0
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_invalidation_cleared', 1
+    )
+
+
+def test_symbolicate_v5_json_invalidated_elsewhere(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    settings,
+):
+    settings.SYMBOLICATE_INVALIDATION_POLL_SECONDS = 0
+    reload_downloader('https://s3.example.com/public/prefix/')
+    url = reverse('symbolicate:symbolicate_v5_json')
+    job = {
+        'stacks': [[[0, 11723767]]],
+        'memoryMap': [['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2']],
+    }
+    with botomock(default_mock_api_call):
+        response = json_poster(url, job, debug=True)
+        result1, = response.json()['results']
+        assert result1['debug']['downloads']['count'] == 1
+        response = json_poster(url, job, debug=True)
+        result1, = response.json()['results']
+        assert result1['debug']['memory_cache']['hits'] == 1
+
+        # What the invalidation does in another process, e.g. the Celery
+        # task that runs after a re-upload.
+        cache_key = views.SymbolicateJSON._make_cache_key(
+            ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2')
+        )
+        caches['store'].delete(cache_key)
+        record_invalidations([cache_key])
+
+        response = json_poster(url, job, debug=True)
+        result1, = response.json()['results']
+        assert result1['debug']['memory_cache']['hits'] == 0
+        assert result1['debug']['downloads']['count'] == 1
+
+
+def test_invalidate_symbols_invalidates_cache(
+    clear_redis_store,
+    botomock,
+    json_poster,
+    settings
+):
+    settings.SYMBOL_URLS = ['https://s3.example.com/private/prefix/']
+    reload_downloader('https://s3.example.com/private/prefix/')
+
+    mock_api_calls = []
+
+    def mock_api_call(self, operation_name, api_params):
+        assert operation_name == 'GetObject'
+        if mock_api_calls:
+            # This means you're here for the second time.
+            # Pretend we have the symbol this time.
+            mock_api_calls.append((operation_name, api_params))
+            return {
+                'Body': BytesIO(
+                    bytes(SAMPLE_SYMBOL_CONTENT['xul.sym'], 'utf-8')
+                )
+            }
+        else:
+            mock_api_calls.append((operation_name, api_params))
+            if api_params['Key'].endswith('xul.sym'):
+                parsed_response = {
+                    'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'},
+                }
+                raise ClientError(parsed_response, operation_name)
+            raise NotImplementedError(api_params)
+
+    with botomock(mock_api_call):
+        url = reverse('symbolicate:symbolicate_v5_json')
+        response = json_poster(url, {
+            'stacks': [[[0, 11723767]]],
+            'memoryMap': [
+                ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2']
+            ],
+        })
+        result = response.json()
+        result1 = result['results'][0]
+        stack1 = result1['stacks'][0]
+        frame1 = stack1[0]
+        assert 'function' not in frame1  # module couldn't be found
+        assert len(mock_api_calls) == 1
+
+        response = json_poster(url, {
+            'stacks': [[[0, 11723767]]],
+            'memoryMap': [
+                ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2']
+            ],
+        })
+        result = response.json()
+        result1 = result['results'][0]
+        stack1 = result1['stacks'][0]
+        frame1 = stack1[0]
+        assert 'function' not in frame1  # module still couldn't be found
+        # Expected because the cache stores that the file can't be found.
+        assert len(mock_api_calls) == 1
+
+        # Pretend an upload comes in and stores those symbols.
+        invalidate_symbolicate_cache([
+            ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
+        ])
+        response = json_poster(url, {
+            'stacks': [[[0, 11723767]]],
+            'memoryMap': [
+                ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2']
+            ],
+        })
+        result = response.json()
+        result1 = result['results'][0]
+        stack1 = result1['stacks'][0]
+        frame1 = stack1[0]
+        assert frame1['function']
+        assert frame1['function'] == 'XREMain::XRE_mainRun()'
+        assert len(mock_api_calls) == 2
+
+
+def test_prebuild_symbolicate_cache_task(
+    clear_redis_store,
+    botomock,
+    json_poster,
+    metricsmock,
+):
+    reload_downloader('https://s3.example.com/public/prefix/')
+
+    # Pretend a previous symbolication stored that it couldn't be found.
+    store = caches['store']
+    redis_store_connection = get_redis_connection('store')
+    cache_key = views.SymbolicateJSON._make_cache_key(
+        ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2')
+    )
+    redis_store_connection.set(store.make_key(cache_key), EMPTY_SYMBOL_TABLE)
+
+    def mock_api_call(self, operation_name, api_params):
+        if api_params['Key'].endswith('nonexistent.sym'):
+            parsed_response = {
+                'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'},
+            }
+            raise ClientError(parsed_response, operation_name)
+        return default_mock_api_call(self, operation_name, api_params)
+
+    with botomock(mock_api_call):
+        prebuild_symbolicate_cache_task([
+            ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+            ['nonexistent.pdb', '00000000000000000000000000000000'],
+        ])
+    metricsmock.has_record(INCR, 'tecken.symbolicate_prebuild_built', 1)
+    metricsmock.has_record(INCR, 'tecken.symbolicate_prebuild_failed', 1)
+
+    # Now it can be symbolicated without any downloads.
+    symbol_table_cache.clear()
+    url = reverse('symbolicate:symbolicate_v5_json')
+    response = json_poster(url, {
+        'stacks': [[[0, 11723767]]],
+        'memoryMap': [
+            ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2']
+        ],
+    }, debug=True)
+    result1, = response.json()['results']
+    assert result1['stacks'][0][0]['function'] == 'XREMain::XRE_mainRun()'
+    assert result1['debug']['downloads']['count'] == 0
+
+
+def test_queue_prebuild_symbolicate_cache(settings, metricsmock):
+    settings.SYMBOLICATE_PREBUILD_MAX_QUEUED = 3
+    delayed = []
+
+    class FakeTask:
+        def delay(self, symbol_keys):
+            delayed.append(symbol_keys)
+
+    with mock.patch(
+        'tecken.symbolicate.tasks.prebuild_symbolicate_cache_task',
+        new=FakeTask()
+    ):
+        assert queue_prebuild_symbolicate_cache([('a.pdb', 'A')])
+        assert queue_prebuild_symbolicate_cache([('b.pdb', 'B')])
+        # Too many in the queue
+        assert not queue_prebuild_symbolicate_cache([
+            ('c.pdb', 'C'),
+            ('d.pdb', 'D'),
+        ])
+        assert delayed == [[('a.pdb', 'A')], [('b.pdb', 'B')]]
+        metricsmock.has_record(INCR, 'tecken.symbolicate_prebuild_skipped', 2)
+
+        # Pretend one of them has been prebuilt.
+        tasks._decrement_prebuild_queued(1)
+        assert queue_prebuild_symbolicate_cache([
+            ('c.pdb', 'C'),
+            ('d.pdb', 'D'),
+        ])
+
+
+def test_change_symbols_urls_invalidates_cache(
     clear_redis_store,
     botomock,
     json_poster,
@@ -1404,3 +2228,1392 @@ def test_symbolicate_huge_symbol_file(
             }
         ]
     ]
+
+
+def test_symbol_table_serialization():
+    symbol_map = {
+        0x1550: 'Output',
+        0xeb0: 'main',
+        0x1700: 'mozilla::BinaryPath::GetFile(char const*, nsIFile**)',
+        0x3160: 'main',
+        0x3330: 'Ünïcødé',
+    }
+    buffer = SymbolTable.serialize(symbol_map)
+    symbol_table = SymbolTable(buffer)
+    assert len(symbol_table) == 5
+    assert list(symbol_table.offsets) == sorted(symbol_map)
+    # The name 'main' is only stored once.
+    assert len(symbol_table.name_starts) == 4 + 1
+    assert symbol_table.nbytes == len(buffer)
+
+    assert symbol_table.get_nearest(0xeb0) == (0xeb0, 'main')
+    assert symbol_table.get_nearest(0x1600) == (0x1550, 'Output')
+    assert symbol_table.get_nearest(0x3200) == (0x3160, 'main')
+    assert symbol_table.get_nearest(0x9999) == (0x3330, 'Ünïcødé')
+
+    empty = SymbolTable(EMPTY_SYMBOL_TABLE)
+    assert not empty
+    assert len(empty) == 0
+
+
+def test_symbol_table_get_nearest_many():
+    symbol_table = SymbolTable.from_symbol_map({
+        0x1550: 'Output',
+        0xeb0: 'main',
+        0x1700: 'mozilla::BinaryPath::GetFile(char const*, nsIFile**)',
+        0x3160: 'main',
+    })
+    offsets = [0x9999, 0xeb0, 0x1600, 0x1551, 0xeb1, 0x3160, 0x1600, 0x100]
+    assert symbol_table.get_nearest_many(offsets) == [
+        symbol_table.get_nearest(offset) for offset in offsets
+    ]
+    assert symbol_table.get_nearest_many([]) == []
+
+
+def test_paged_symbol_table():
+    symbol_table = SymbolTable.from_symbol_map({
+        0x1550: 'Output',
+        0xeb0: 'main',
+        0x1700: 'mozilla::BinaryPath::GetFile(char const*, nsIFile**)',
+        0x3160: 'main',
+        0x3330: 'Ünïcødé',
+    })
+    generation, index, pages = PagedSymbolTable.serialize(symbol_table, 2)
+    assert len(pages) == 3
+    paged = read_symbol_table(index)
+    assert isinstance(paged, PagedSymbolTable)
+    assert paged.generation == generation
+    assert len(paged) == 5
+    assert paged.nbytes == len(index)
+    assert paged.nbytes < symbol_table.nbytes
+
+    offsets = [0x9999, 0xeb0, 0x1600, 0x1551, 0xeb1, 0x3160, 0x1600, 0x100]
+    # 0x100 is before the first function so, just like an unpaged symbol
+    # table, it ends up in the last one.
+    assert paged.get_missing_pages([0xeb1, 0x100]) == {0, 2}
+    assert paged.get_missing_pages(offsets) == {0, 1, 2}
+    with_pages = paged.with_pages({
+        i: SymbolTable(page) for i, page in enumerate(pages)
+    })
+    # The original is left as is.
+    assert not paged.pages
+    assert not with_pages.get_missing_pages(offsets)
+    assert with_pages.get_nearest_many(offsets) == (
+        symbol_table.get_nearest_many(offsets)
+    )
+    assert with_pages.get_nearest(0x1600) == (0x1550, 'Output')
+
+    assert isinstance(read_symbol_table(symbol_table.buffer), SymbolTable)
+    with pytest.raises(InvalidSymbolTable):
+        read_symbol_table(index[:-1])
+
+
+def test_parse_symbol_lines():
+    lines = [
+        b'MODULE windows x86 44E4EC8C2F41492B9369D6B9A059577C2 xul.pdb',
+        b'FILE 1 c:/program files (x86)/windows kits/8.0/include/sal.h',
+        b'FUNC 26791a 592 4 XREMain::XRE_mainRun()',
+        b'26791a 2d 91 1',
+        b'FUNC m b2e3f7 2b4 4 Overridden() ',
+        b'FUNC 0 junkline',
+        b'',
+        'PUBLIC 10070 10 Ω::KiUserCallback'.encode('utf-8'),
+        b'PUBLIC b2e3f7 0 Public',
+        b'PUBLIC junk',
+        b'STACK WIN 4 26791a 592 3 0 8 0 34 0 1 $T0 $ebp = $eip $T0 4 + ^ =',
+    ]
+    symbol_map, total_size = parse_symbol_lines(lines)
+    assert symbol_map == {
+        0x26791a: b'XREMain::XRE_mainRun()',
+        0xb2e3f7: b'Public',
+        0x10070: 'Ω::KiUserCallback'.encode('utf-8'),
+    }
+    assert total_size == sum(len(x) for x in lines)
+
+    symbol_table, total_size = parse_symbol_table(lines)
+    assert len(symbol_table) == 3
+    assert symbol_table.get_nearest(0x10071) == (
+        0x10070,
+        'Ω::KiUserCallback'
+    )
+    assert symbol_table.get_nearest(0xb2e3f8) == (0xb2e3f7, 'Public')
+
+    # Same result as if it had been parsed from strings
+    assert symbol_table.buffer == SymbolTable.serialize({
+        key: value.decode('utf-8') for key, value in symbol_map.items()
+    })
+
+
+def test_symbol_table_invalid():
+    with pytest.raises(InvalidSymbolTable):
+        SymbolTable(b'')
+    with pytest.raises(InvalidSymbolTable):
+        # E.g. how the old code used to store an empty list
+        SymbolTable(b'\x90' * 20)
+    buffer = SymbolTable.serialize({10: 'foo', 20: 'bar'})
+    with pytest.raises(InvalidSymbolTable):
+        SymbolTable(buffer[:-1])
+
+
+def test_symbolicate_v5_json_legacy_store_value(
+    json_poster,
+    clear_redis_store,
+    botomock,
+):
+    """If the Redis store contains something stored in the old format,
+    it should be treated as a cache miss and overwritten."""
+    reload_downloader('https://s3.example.com/public/prefix/')
+
+    store = caches['store']
+    # This is how the old code used to remember that a symbol couldn't
+    # be found.
+    store.set(
+        views.SymbolicateJSON._make_cache_key(
+            ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2')
+        ),
+        [],
+    )
+
+    url = reverse('symbolicate:symbolicate_v5_json')
+    with botomock(default_mock_api_call):
+        response = json_poster(url, {
+            'stacks': [[[0, 11723767]]],
+            'memoryMap': [
+                ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+            ],
+        }, debug=True)
+    result = response.json()
+    result1, = result['results']
+    assert result1['stacks'][0][0]['function'] == 'XREMain::XRE_mainRun()'
+    assert result1['debug']['downloads']['count'] == 1
+
+
+def test_symbol_table_cache(metricsmock):
+    small = SymbolTable.from_symbol_map({10: 'small'})
+    big = SymbolTable.from_symbol_map({i: f'big{i}' for i in range(100)})
+    max_bytes = (
+        small.nbytes + big.nbytes + 2 * memorycache.ENTRY_OVERHEAD_BYTES
+    )
+    cache = SymbolTableCache(max_bytes=max_bytes, ttl_seconds=60)
+    assert cache.get('a') is None
+    cache.set('a', small)
+    cache.set('b', big)
+    assert len(cache) == 2
+    assert cache.total_bytes == max_bytes
+    assert cache.get('a') is small
+
+    # Now 'b' is the least recently used.
+    cache.set('c', small)
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.get('a') is small
+    assert cache.get('c') is small
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_memory_cache_eviction', 1
+    )
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_memory_cache_lookup', 1, ['cache:hit']
+    )
+
+    assert cache.evict(['a', 'x']) == 1
+    assert 'a' not in cache
+    cache.clear()
+    assert not cache.total_bytes
+
+    # Too big to even fit.
+    cache = SymbolTableCache(max_bytes=small.nbytes, ttl_seconds=60)
+    cache.set('a', small)
+    assert 'a' not in cache
+
+    # Replaced by one that's too big to fit. The old one isn't kept.
+    cache = SymbolTableCache(
+        max_bytes=small.nbytes + memorycache.ENTRY_OVERHEAD_BYTES,
+        ttl_seconds=60,
+    )
+    cache.set('a', small)
+    assert cache.get('a') is small
+    cache.set('a', big)
+    assert 'a' not in cache
+    assert cache.get('a') is None
+    assert not cache.total_bytes
+
+    # Expired entries are like missing entries.
+    cache = SymbolTableCache(max_bytes=max_bytes, ttl_seconds=-1)
+    cache.set('a', small)
+    assert cache.get('a') is None
+    assert not cache.total_bytes
+
+
+def test_symbol_table_cache_max_open_files(tmpdir, metricsmock):
+    small = SymbolTable.from_symbol_map({10: 'small'})
+    disk_cache = SymbolTableDiskCache(
+        directory=tmpdir,
+        max_bytes=10 * small.nbytes,
+        ttl_seconds=60,
+    )
+    cache = SymbolTableCache(
+        max_bytes=10 * (small.nbytes + memorycache.ENTRY_OVERHEAD_BYTES),
+        ttl_seconds=60,
+        max_open_files=2,
+    )
+    cache.set('a', disk_cache.set('a', small))
+    cache.set('x', small)
+    cache.set('b', disk_cache.set('b', small))
+    assert cache.open_files == 2
+    assert cache.get('a') is not None
+
+    # Now 'b' is the least recently used of the ones holding a file.
+    # The one that doesn't is left alone.
+    cache.set('c', disk_cache.set('c', small))
+    assert cache.open_files == 2
+    assert 'b' not in cache
+    assert 'a' in cache
+    assert 'x' in cache
+    assert not is_locked(disk_cache.get_path('b'))
+    assert is_locked(disk_cache.get_path('a'))
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_memory_cache_eviction', 1
+    )
+
+    cache.evict(['a'])
+    assert cache.open_files == 1
+    cache.clear()
+    assert not cache.open_files
+
+
+def test_invalidate_symbols_invalidates_memory_cache(
+    clear_redis_store,
+    botomock,
+    json_poster,
+):
+    reload_downloader('https://s3.example.com/public/prefix/')
+    url = reverse('symbolicate:symbolicate_v5_json')
+    with botomock(default_mock_api_call):
+        response = json_poster(url, {
+            'stacks': [[[0, 11723767]]],
+            'memoryMap': [
+                ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2']
+            ],
+        })
+    assert response.status_code == 200
+    assert len(symbol_table_cache) == 1
+    invalidate_symbolicate_cache([
+        ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
+    ])
+    assert len(symbol_table_cache) == 0
+
+
+def test_symbol_table_disk_cache(tmpdir, metricsmock):
+    small = SymbolTable.from_symbol_map({10: 'small'})
+    big = SymbolTable.from_symbol_map({i: f'big{i}' for i in range(100)})
+    cache = SymbolTableDiskCache(
+        directory=tmpdir,
+        max_bytes=small.nbytes + big.nbytes,
+        ttl_seconds=60,
+    )
+    assert cache.get('a') is None
+    mmapped = cache.set('a', small)
+    assert mmapped is not small
+    assert mmapped.buffer[:] == small.buffer
+    assert mmapped.get_nearest(12) == (10, 'small')
+    cache.set('b', big)
+    assert len(os.listdir(tmpdir)) == 2
+    symbol_table = cache.get('a')
+    assert symbol_table.get_nearest(12) == (10, 'small')
+
+    # Make 'b' the least recently used.
+    os.utime(cache.get_path('b'), (1, time.time()))
+    cache.set('c', small)
+    assert cache.get('b') is None
+    assert cache.get('a')
+    assert cache.get('c')
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_disk_cache_eviction', 1
+    )
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_disk_cache_lookup', 1, ['cache:hit']
+    )
+
+    # Empty symbol tables are never written.
+    empty = SymbolTable(EMPTY_SYMBOL_TABLE)
+    assert cache.set('d', empty) is empty
+    assert cache.get('d') is None
+
+    assert cache.evict(['a', 'x']) == 1
+    assert cache.get('a') is None
+    cache.clear()
+    assert not os.listdir(tmpdir)
+
+    # Expired files are like missing files.
+    cache = SymbolTableDiskCache(
+        directory=tmpdir,
+        max_bytes=big.nbytes,
+        ttl_seconds=-1,
+    )
+    cache.set('a', small)
+    assert cache.get('a') is None
+    assert not os.listdir(tmpdir)
+
+    # Disabled by default.
+    cache = SymbolTableDiskCache()
+    assert cache.set('a', small) is small
+    assert cache.get('a') is None
+
+
+def test_symbol_table_disk_cache_attached(tmpdir, metricsmock):
+    big = SymbolTable.from_symbol_map({i: f'big{i}' for i in range(100)})
+    cache = SymbolTableDiskCache(
+        directory=tmpdir,
+        max_bytes=big.nbytes,
+        ttl_seconds=60,
+    )
+    a = cache.set('a', big)
+    assert is_locked(cache.get_path('a'))
+    os.utime(cache.get_path('a'), (1, time.time()))
+    b = cache.set('b', big)
+    # Over the limit but both are still attached to so deleting either
+    # wouldn't free any memory.
+    assert len(os.listdir(tmpdir)) == 2
+    assert not metricsmock.has_record(
+        INCR, 'tecken.symbolicate_disk_cache_eviction', None
+    )
+
+    # Garbage collecting the symbol table detaches it.
+    del a
+    assert not is_locked(cache.get_path('a'))
+    assert cache.cleanup() == 1
+    assert not os.path.exists(cache.get_path('a'))
+    assert b.get_nearest(12) == (12, 'big12')
+    del b
+
+    # Temporary files, that nobody is writing to, left behind by a
+    # process that died.
+    orphan = os.path.join(tmpdir, 'orphan.tmp')
+    recent = os.path.join(tmpdir, 'recent.tmp')
+    for path in (orphan, recent):
+        with open(path, 'wb') as f:
+            f.write(b'half-written')
+    os.utime(orphan, (1, 1))
+    # Expired, i.e. written before this process was (re)started.
+    os.utime(cache.get_path('b'), (1, 1))
+    # A new process sweeps the directory the first time it's used.
+    cache = SymbolTableDiskCache(
+        directory=tmpdir,
+        max_bytes=big.nbytes,
+        ttl_seconds=60,
+    )
+    assert cache.get('c') is None
+    assert sorted(os.listdir(tmpdir)) == ['recent.tmp']
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_disk_cache_orphan', 1
+    )
+
+
+def test_symbolicate_v5_json_disk_cache(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    settings,
+    tmpdir,
+):
+    settings.SYMBOLICATE_DISK_CACHE_DIR = tmpdir
+    reload_downloader('https://s3.example.com/public/prefix/')
+    url = reverse('symbolicate:symbolicate_v5_json')
+    job = {
+        'stacks': [[[0, 11723767], [1, 65802]]],
+        'memoryMap': [
+            ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+            ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+        ],
+    }
+    with botomock(default_mock_api_call):
+        response = json_poster(url, job, debug=True)
+    result1, = response.json()['results']
+    assert result1['debug']['downloads']['count'] == 2
+    assert result1['debug']['disk_cache']['hits'] == 0
+    assert len(os.listdir(tmpdir)) == 2
+
+    # Pretend it's a different web worker process on the same host.
+    # The Redis store isn't even needed.
+    symbol_table_cache.clear()
+    caches['store'].clear()
+    response = json_poster(url, job, debug=True)
+    result1, = response.json()['results']
+    assert result1['stacks'][0][0]['function'] == 'XREMain::XRE_mainRun()'
+    assert result1['debug']['disk_cache']['hits'] == 2
+    assert result1['debug']['cache_lookups']['count'] == 0
+    assert result1['debug']['downloads']['count'] == 0
+
+    invalidate_symbolicate_cache([
+        ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
+    ])
+    assert len(os.listdir(tmpdir)) == 1
+
+
+@pytest.mark.parametrize('backend', ['redis', 'file', 'sqlite'])
+def test_symbol_table_store(backend, clear_redis_store, tmpdir):
+    if backend == 'redis':
+        store = RedisSymbolTableStore('')
+    elif backend == 'file':
+        store = FileSystemSymbolTableStore(os.path.join(tmpdir, 'store'))
+    else:
+        store = SQLiteSymbolTableStore(os.path.join(tmpdir, 'store.sqlite3'))
+    assert store.get('a') is None
+    store.set_many([('a', b'aaa'), ('b', b'bb')])
+    store.set('c', b'c')
+    assert store.get('a') == b'aaa'
+    assert store.get_many(['b', 'x', 'a', 'c']) == [b'bb', None, b'aaa', b'c']
+    assert store.get_sizes(['a', 'x']) == [3, 0]
+    assert store.get_prefixes(['a', 'x', 'b'], 2) == [b'aa', None, b'bb']
+
+    store.delete_many(['a', 'x'])
+    assert store.get('a') is None
+
+    store.set('d', b'ddd', timeout=60)
+    assert store.get('d') == b'ddd'
+    if backend == 'redis':
+        assert 0 < store.connection.ttl(store.make_key('d')) <= 60
+    else:
+        with mock.patch('time.time', return_value=time.time() + 61):
+            assert store.get('d') is None
+
+    lease = store.get_lease('b', 10)
+    other = store.get_lease('b', 10)
+    assert lease.acquire()
+    assert not other.acquire()
+    lease.release()
+    assert other.acquire()
+    other.release()
+
+
+def test_redis_symbol_table_store_big_value(clear_redis_store, settings):
+    store = RedisSymbolTableStore('')
+    # Bigger than what Redis used to drop the connection over (~9MB) when
+    # sent as one command.
+    big = SymbolTable.from_symbol_map({
+        i * 16: f'function{i}' for i in range(500000)
+    })
+    assert big.nbytes > 10 * 1024 * 1024
+    with mock.patch.object(
+        StrictPipeline,
+        'append',
+        autospec=True,
+        side_effect=StrictPipeline.append,
+    ) as append:
+        store.set_many([('small', b'small'), ('big', big.buffer)], timeout=60)
+    chunk_size = settings.SYMBOLICATE_STORE_WRITE_CHUNK_BYTES
+    assert append.call_count == -(-big.nbytes // chunk_size)
+    assert all(len(call[0][2]) <= chunk_size for call in append.call_args_list)
+    assert store.get('big') == bytes(big.buffer)
+    assert store.get('small') == b'small'
+    assert 0 < store.connection.ttl(store.make_key('big')) <= 60
+    # No temporary keys are left behind.
+    assert not store.connection.keys('*:writing:*')
+
+    store.set('big', big.buffer)
+    assert store.get('big') == bytes(big.buffer)
+    assert store.connection.ttl(store.make_key('big')) == -1
+
+    # If the temporary key got evicted, half way through, it's not moved
+    # into place.
+    temp_key = store.make_key('other:writing:x')
+    store.connection.set(temp_key, b'end')
+    finish_writing = store.connection.register_script(
+        store.FINISH_WRITING_SCRIPT
+    )
+    assert not finish_writing(
+        keys=[temp_key, store.make_key('other')],
+        args=[10, 0],
+    )
+    assert store.get('other') is None
+    assert not store.connection.exists(temp_key)
+
+
+def test_symbolicate_v5_json_sqlite_store(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    settings,
+    tmpdir,
+):
+    settings.SYMBOLICATE_STORE_BACKEND = (
+        'tecken.symbolicate.storage.SQLiteSymbolTableStore'
+    )
+    settings.SYMBOLICATE_STORE_LOCATION = os.path.join(tmpdir, 'store.db')
+    reload_downloader('https://s3.example.com/public/prefix/')
+    url = reverse('symbolicate:symbolicate_v5_json')
+    job = {
+        'stacks': [[[0, 11723767], [1, 65802]]],
+        'memoryMap': [
+            ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+            ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+        ],
+    }
+    with botomock(default_mock_api_call):
+        response = json_poster(url, job, debug=True)
+    result1, = response.json()['results']
+    assert result1['debug']['downloads']['count'] == 2
+    assert not caches['store'].keys('*44E4EC8C2F41492B9369D6B9A059577C2*')
+
+    # Pretend it's a different web worker process.
+    symbol_table_cache.clear()
+    response = json_poster(url, job, debug=True)
+    result1, = response.json()['results']
+    assert result1['stacks'][0][0]['function'] == 'XREMain::XRE_mainRun()'
+    assert result1['debug']['cache_lookups']['count'] == 1
+    assert result1['debug']['downloads']['count'] == 0
+
+    invalidate_symbolicate_cache([
+        ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
+    ])
+    symbol_table_cache.clear()
+    with botomock(default_mock_api_call):
+        response = json_poster(url, job, debug=True)
+    result1, = response.json()['results']
+    assert result1['debug']['downloads']['count'] == 1
+
+
+def test_symbolicate_v5_json_paged_store_old_pages_deleted(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    settings,
+    tmpdir,
+):
+    settings.SYMBOLICATE_STORE_BACKEND = (
+        'tecken.symbolicate.storage.SQLiteSymbolTableStore'
+    )
+    settings.SYMBOLICATE_STORE_LOCATION = os.path.join(tmpdir, 'store.db')
+    settings.SYMBOLICATE_STORE_PAGE_SIZE = 2
+    reload_downloader('https://s3.example.com/public/prefix/')
+    url = reverse('symbolicate:symbolicate_v5_json')
+    job = {
+        'stacks': [[[0, 11723767], [1, 65802]]],
+        'memoryMap': [
+            ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+            ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+        ],
+    }
+
+    def get_stored_keys():
+        connection = sqlite3.connect(settings.SYMBOLICATE_STORE_LOCATION)
+        try:
+            return sorted(
+                key for key, in
+                connection.execute('SELECT key FROM symbol_tables')
+            )
+        finally:
+            connection.close()
+
+    with botomock(default_mock_api_call):
+        json_poster(url, job)
+    # The one for 'xul.pdb', and the index of 'wntdll.pdb' plus its two
+    # pages.
+    keys = get_stored_keys()
+    page_keys = [key for key in keys if ':page:' in key]
+    assert len(keys) == 4
+    assert len(page_keys) == 2
+
+    # A page goes missing so it's all downloaded, and stored, again. As
+    # a new generation of pages.
+    get_symbol_table_store().delete_many(page_keys[:1])
+    symbol_table_cache.clear()
+    with botomock(default_mock_api_call):
+        response = json_poster(url, job, debug=True)
+    result1, = response.json()['results']
+    assert result1['debug']['downloads']['count'] == 1
+    keys = get_stored_keys()
+    assert len(keys) == 4
+    assert not set(page_keys) & set(keys)
+
+    invalidate_symbolicate_cache([
+        ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
+        ('wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'),
+    ])
+    assert get_stored_keys() == []
+
+
+def test_frame_cache(metricsmock):
+    cache = FrameCache(max_entries=3, ttl_seconds=60)
+    assert cache.get_many('a', [1, 2]) == {}
+    cache.set_many('a', {1: (0, 'one'), 2: (0, 'two')})
+    cache.set_many('b', {1: (0, 'uno')})
+    assert cache.get_many('a', [1, 2, 3]) == {1: (0, 'one'), 2: (0, 'two')}
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_frame_cache_lookup', 2, ['cache:hit']
+    )
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_frame_cache_lookup', 1, ['cache:miss']
+    )
+
+    # Now ('b', 1) is the least recently used.
+    cache.set_many('c', {1: (0, 'ein')})
+    assert len(cache) == 3
+    assert cache.get_many('b', [1]) == {}
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_frame_cache_eviction', 1
+    )
+
+    assert cache.evict(['a', 'x']) == 2
+    assert cache.get_many('a', [1, 2]) == {}
+    assert cache.get_many('c', [1]) == {1: (0, 'ein')}
+    cache.clear()
+    assert not len(cache)
+
+    # Expired frames are like missing frames.
+    cache = FrameCache(max_entries=3, ttl_seconds=-1)
+    cache.set_many('a', {1: (0, 'one')})
+    assert cache.get_many('a', [1]) == {}
+
+    # Disabled by default.
+    cache = FrameCache()
+    cache.set_many('a', {1: (0, 'one')})
+    assert cache.get_many('a', [1]) == {}
+
+
+def test_symbolicate_v5_json_frame_cache(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    settings,
+):
+    settings.SYMBOLICATE_FRAME_CACHE_MAX_ENTRIES = 100
+    reload_downloader('https://s3.example.com/public/prefix/')
+    url = reverse('symbolicate:symbolicate_v5_json')
+    job = {
+        'stacks': [[[0, 11723767], [1, 65802]]],
+        'memoryMap': [
+            ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+            ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+        ],
+    }
+    with botomock(default_mock_api_call):
+        response = json_poster(url, job, debug=True)
+    result1, = response.json()['results']
+    assert result1['debug']['frame_cache'] == {'hits': 0, 'ratio': 0.0}
+    assert len(frame_cache) == 2
+    first_stacks = result1['stacks']
+
+    # Without any symbol tables anywhere, the frames can still be
+    # symbolicated.
+    symbol_table_cache.clear()
+    caches['store'].clear()
+    response = json_poster(url, job, debug=True)
+    result1, = response.json()['results']
+    assert result1['found_modules'] == {
+        'xul.pdb/44E4EC8C2F41492B9369D6B9A059577C2': True,
+        'wntdll.pdb/D74F79EB1F8D4A45ABCD2F476CCABACC2': True,
+    }
+    assert result1['stacks'] == first_stacks
+    assert result1['debug']['frame_cache'] == {'hits': 2, 'ratio': 1.0}
+    assert result1['debug']['cache_lookups']['count'] == 0
+    assert result1['debug']['downloads']['count'] == 0
+
+    # A new offset in one module means only that symbol table is needed.
+    job['stacks'][0].append([1, 65803])
+    with botomock(default_mock_api_call):
+        response = json_poster(url, job, debug=True)
+    result1, = response.json()['results']
+    assert result1['stacks'][0][:2] == first_stacks[0]
+    assert result1['debug']['frame_cache']['hits'] == 2
+    pipeline, = result1['debug']['cache_lookups']['pipelines']
+    assert pipeline['keys'] == 1
+    assert result1['debug']['downloads']['count'] == 1
+
+    invalidate_symbolicate_cache([
+        ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
+    ])
+    assert len(frame_cache) == 2
+
+
+def test_symbolicate_v5_json_frame_cache_partial_hit(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    settings,
+):
+    settings.SYMBOLICATE_FRAME_CACHE_MAX_ENTRIES = 100
+    settings.SYMBOLICATE_DOWNLOAD_TIMEOUT_SECONDS = 0.5
+    reload_downloader('https://s3.example.com/public/prefix/')
+    url = reverse('symbolicate:symbolicate_v5_json')
+    memory_map = [['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2']]
+    with botomock(default_mock_api_call):
+        response = json_poster(url, {
+            'stacks': [[[0, 65802]]],
+            'memoryMap': memory_map,
+        })
+    result1, = response.json()['results']
+    cached_frame = result1['stacks'][0][0]
+    assert cached_frame['function']
+
+    # One offset is in the frame cache, the other needs the symbol table
+    # which takes too long to download.
+    symbol_table_cache.clear()
+    caches['store'].clear()
+    released = threading.Event()
+
+    def mock_api_call(self, operation_name, api_params):
+        released.wait(10)
+        return default_mock_api_call(self, operation_name, api_params)
+
+    job = {
+        'stacks': [[[0, 65802], [0, 517]]],
+        'memoryMap': memory_map,
+    }
+    with botomock(mock_api_call):
+        response = json_poster(url, job)
+        released.set()
+    result1, = response.json()['results']
+    assert result1['found_modules'] == {
+        'wntdll.pdb/D74F79EB1F8D4A45ABCD2F476CCABACC2': 'pending',
+    }
+    assert result1['stacks'][0] == [
+        cached_frame,
+        {'module_offset': '0x205', 'module': 'wntdll.pdb', 'frame': 1},
+    ]
+
+    # Let the download, that was given up on, finish in the background.
+    cache_key = views.SymbolicateJSON._make_cache_key(tuple(memory_map[0]))
+    for _ in range(50):
+        if cache_key in symbol_table_cache:
+            break
+        time.sleep(0.1)
+    else:
+        raise AssertionError('Never stored')
+
+    # Known to be missing. Nothing left over in the frame cache is used.
+    symbol_table_cache.clear()
+    caches['store'].clear()
+
+    def mock_api_call_not_found(self, operation_name, api_params):
+        parsed_response = {
+            'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'},
+        }
+        raise ClientError(parsed_response, operation_name)
+
+    with botomock(mock_api_call_not_found):
+        response = json_poster(url, job)
+    result1, = response.json()['results']
+    assert result1['found_modules'] == {
+        'wntdll.pdb/D74F79EB1F8D4A45ABCD2F476CCABACC2': False,
+    }
+    assert 'function' not in result1['stacks'][0][0]
+
+
+def test_symbolicate_v5_json_server_timing(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    metricsmock,
+):
+    reload_downloader('https://s3.example.com/public/prefix/')
+    url = reverse('symbolicate:symbolicate_v5_json')
+    job = {
+        'stacks': [[[0, 11723767], [1, 65802]]],
+        'memoryMap': [
+            ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+            ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+        ],
+    }
+    with botomock(default_mock_api_call):
+        response = json_poster(url, job)
+    assert response.status_code == 200
+    # Not in debug mode and still there.
+    stages = [
+        x.split(';')[0] for x in response['Server-Timing'].split(', ')
+    ]
+    assert stages == [
+        'lookup',
+        'download',
+        'fetch',
+        'parse',
+        'store',
+        'resolve',
+        'assemble',
+    ]
+    histograms = [
+        record for record in metricsmock.get_records()
+        if record[0] == HISTOGRAM
+    ]
+    assert len(histograms) == len(stages)
+    for record, stage in zip(histograms, stages):
+        assert record[1] == 'tecken.symbolicate_stage'
+        assert record[2] >= 0
+        assert record[3] == [f'stage:{stage}', 'version:v5']
+
+    # This time, nothing needs to be downloaded.
+    response = json_poster(url, job)
+    assert response['Server-Timing'].startswith('lookup;dur=')
+    assert 'download' not in response['Server-Timing']
+
+    # Version 4 too.
+    job['version'] = 4
+    response = json_poster(reverse('symbolicate:symbolicate_v4_json'), job)
+    assert 'resolve;dur=' in response['Server-Timing']
+    assert metricsmock.has_record(
+        HISTOGRAM,
+        'tecken.symbolicate_stage',
+        tags=['stage:assemble', 'version:v4'],
+    )
+
+
+def test_stage_timings():
+    timings = StageTimings()
+    assert timings.server_timing_header() == ''
+    timings.add('resolve', 0.002)
+    timings.add('lookup', 0.001)
+    timings.add('lookup', 0.0005)
+    with timings.timer('assemble'):
+        pass
+    assert [stage for stage, _ in timings.items()] == [
+        'lookup', 'resolve', 'assemble'
+    ]
+    assert timings.server_timing_header().startswith(
+        'lookup;dur=1.50, resolve;dur=2.00, assemble;dur='
+    )
+
+
+def test_module_popularity(json_poster, clear_redis_store, botomock):
+    assert get_hot_modules(10) == []
+    reload_downloader('https://s3.example.com/public/prefix/')
+    url = reverse('symbolicate:symbolicate_v5_json')
+    with botomock(default_mock_api_call):
+        json_poster(url, {
+            'jobs': [
+                {
+                    'stacks': [[[0, 11723767], [1, 65802]]],
+                    'memoryMap': [
+                        ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+                        ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+                    ],
+                },
+                {
+                    'stacks': [[[0, 11723767]]],
+                    'memoryMap': [
+                        ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+                        # Not in any of the stacks.
+                        ['firefox.pdb', '9A8C8930C5E935E3B441CC9D6E72BB990'],
+                    ],
+                },
+            ]
+        })
+        json_poster(reverse('symbolicate:symbolicate_v4_json'), {
+            'stacks': [[[0, 11723767]]],
+            'memoryMap': [
+                ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+            ],
+            'version': 4,
+        })
+    # Counted once per request, not per job.
+    assert get_hot_modules(10) == [
+        (('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'), 2),
+        (('wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'), 1),
+    ]
+    assert get_hot_modules(1) == [
+        (('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'), 2),
+    ]
+
+
+def test_prewarm_symbolicate_cache(
+    clear_redis_store,
+    botomock,
+    metricsmock,
+    settings,
+):
+    settings.SYMBOLICATE_DOWNLOAD_MAX_WORKERS = 1
+    reload_downloader('https://s3.example.com/public/prefix/')
+    assert prewarm_symbolicate_cache() == {
+        'stored': 0, 'skipped': 0, 'size': 0,
+    }
+    increment_module_popularity([
+        ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
+        ('wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'),
+    ])
+    increment_module_popularity([
+        ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
+    ])
+
+    # The budget is used up by the first, most popular, one.
+    with botomock(default_mock_api_call):
+        summary = prewarm_symbolicate_cache(max_bytes=1)
+    assert summary['stored'] == 1
+    assert summary['skipped'] == 0
+    assert summary['size'] > 0
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_prewarm_stored', 1
+    )
+
+    with botomock(default_mock_api_call):
+        summary = prewarm_symbolicate_cache()
+    assert summary['stored'] == 1
+    assert summary['skipped'] == 1
+
+    # Now it can be symbolicated without any downloads.
+    symbol_table_cache.clear()
+    symbolicator = views.SymbolicateJSON(views.downloader)
+    informations = symbolicator.get_symbol_tables([
+        ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
+        ('wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'),
+    ])
+    assert all(
+        information['symbol_table']
+        for information in informations['symbols'].values()
+    )
+
+
+def test_store_accounting(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    metricsmock,
+):
+    assert get_store_accounting(10) == {
+        'count': 0, 'size': 0, 'largest': [], 'most_churned': [],
+    }
+    reload_downloader('https://s3.example.com/public/prefix/')
+    url = reverse('symbolicate:symbolicate_v5_json')
+    payload = {
+        'stacks': [[[0, 11723767], [1, 65802]]],
+        'memoryMap': [
+            ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+            ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+        ],
+    }
+    with botomock(default_mock_api_call):
+        json_poster(url, payload)
+    assert not metricsmock.has_record(INCR, 'tecken.symbolicate_store_reload')
+
+    accounting = get_store_accounting(10)
+    assert accounting['count'] == 2
+    largest = accounting['largest']
+    assert [x['symbol'] for x in largest] == ['wntdll.pdb', 'xul.pdb']
+    assert largest[0]['size'] > largest[1]['size']
+    assert accounting['size'] == largest[0]['size'] + largest[1]['size']
+    assert all(x['loads'] == 1 and x['stored'] for x in largest)
+
+    # As if the LRU had evicted it.
+    invalidate_symbolicate_cache([
+        ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'),
+    ])
+    accounting = get_store_accounting(1)
+    assert len(accounting['largest']) == 1
+    assert accounting['largest'][0]['stored']
+    xul, = [
+        x for x in get_store_accounting(10)['largest']
+        if x['symbol'] == 'xul.pdb'
+    ]
+    assert not xul['stored']
+
+    with botomock(default_mock_api_call):
+        json_poster(url, payload)
+    assert metricsmock.has_record(INCR, 'tecken.symbolicate_store_reload', 1)
+    most_churned = get_store_accounting(1)['most_churned']
+    assert most_churned == [
+        {
+            'symbol': 'xul.pdb',
+            'debugid': '44E4EC8C2F41492B9369D6B9A059577C2',
+            'size': xul['size'],
+            'loads': 2,
+            'stored': True,
+        }
+    ]
+
+
+def test_symbolicate_command(
+    tmpdir,
+    json_poster,
+    clear_redis_store,
+    botomock,
+    metricsmock,
+    settings,
+):
+    # Note, 'metricsmock' is there so that no metrics are sent over the
+    # network, which could hold up a download beyond the timeouts below.
+    reload_downloader('https://s3.example.com/public/prefix/')
+    v4 = {
+        'stacks': [[[0, 11723767], [1, 65802]]],
+        'memoryMap': [
+            ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+            ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+        ],
+        'version': 4,
+    }
+    v5 = {
+        'jobs': [
+            {
+                'stacks': [[[0, 11723767], [1, 65802]]],
+                'memoryMap': [
+                    ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+                    ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+                ],
+            },
+            {
+                'stacks': [[[0, 10613656]]],
+                'memoryMap': [
+                    ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+                ],
+            },
+        ]
+    }
+    payloads = os.path.join(tmpdir, 'payloads.jsonl')
+    with open(payloads, 'w') as f:
+        f.write(json.dumps(v4) + '\n')
+        f.write(json.dumps(v5) + '\n')
+        f.write('\n')
+        f.write(json.dumps({'jobs': [{'stacks': 'junk'}]}) + '\n')
+        f.write(json.dumps(v5['jobs'][1]) + '\n')
+        # A module index that isn't in the memory map.
+        f.write(json.dumps({
+            'stacks': [[[1, 65802]]],
+            'memoryMap': [['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2']],
+        }) + '\n')
+        # A module that can't be found.
+        f.write(json.dumps({
+            'stacks': [[[0, 65802]]],
+            'memoryMap': [
+                ['missing.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+            ],
+        }) + '\n')
+
+    def mock_api_call(self, operation_name, api_params):
+        if api_params['Key'].endswith('/missing.sym'):
+            parsed_response = {
+                'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'},
+            }
+            raise ClientError(parsed_response, operation_name)
+        return default_mock_api_call(self, operation_name, api_params)
+
+    with botomock(default_mock_api_call):
+        expected = [
+            json_poster(reverse('symbolicate:symbolicate_v4_json'), v4).json(),
+            json_poster(reverse('symbolicate:symbolicate_v5_json'), v5).json(),
+            None,
+            json_poster(
+                reverse('symbolicate:symbolicate_v5_json'),
+                v5['jobs'][1]
+            ).json(),
+        ]
+
+    for workers in (1, 2):
+        output = os.path.join(tmpdir, f'results{workers}.jsonl')
+        out = StringIO()
+        with botomock(mock_api_call):
+            call_command(
+                'symbolicate',
+                payloads,
+                workers=workers,
+                chunk_size=1,
+                output=output,
+                stdout=out,
+            )
+        assert '6 payloads (6 jobs, 8 frames)' in out.getvalue()
+        assert '3 payloads failed' in out.getvalue()
+        with open(output) as f:
+            results = [json.loads(line) for line in f]
+        assert len(results) == 6
+        assert results[0] == expected[0]
+        assert results[1] == expected[1]
+        assert results[2]['error']
+        assert results[3] == expected[3]
+        assert results[4]['error'].startswith('IndexError')
+        result1, = results[5]['results']
+        assert result1['found_modules'] == {
+            'missing.pdb/D74F79EB1F8D4A45ABCD2F476CCABACC2': False,
+        }
+
+    # Unlike a web request, it waits for the downloads for as long as it
+    # takes. Unless it's told otherwise, and then what's still pending
+    # has failed too.
+    released = threading.Event()
+
+    def slow_mock_api_call(self, operation_name, api_params):
+        if api_params['Key'].endswith('/wntdll.sym'):
+            released.wait(10)
+        return default_mock_api_call(self, operation_name, api_params)
+
+    with open(payloads, 'w') as f:
+        f.write(json.dumps(v4) + '\n')
+    output = os.path.join(tmpdir, 'results.jsonl')
+    symbol_table_cache.clear()
+    caches['store'].clear()
+    out = StringIO()
+    with botomock(slow_mock_api_call):
+        try:
+            call_command(
+                'symbolicate',
+                payloads,
+                workers=1,
+                timeout=0.5,
+                output=output,
+                stdout=out,
+            )
+        finally:
+            released.set()
+    assert '1 payloads failed' in out.getvalue()
+    with open(output) as f:
+        result = json.loads(f.read())
+    assert result['knownModules'] == [True, 'pending']
+
+    settings.SYMBOLICATE_DOWNLOAD_TIMEOUT_SECONDS = 0.1
+    symbol_table_cache.clear()
+    caches['store'].clear()
+    released.clear()
+    out = StringIO()
+
+    def release_later():
+        time.sleep(0.5)
+        released.set()
+
+    with botomock(slow_mock_api_call):
+        threading.Thread(target=release_later).start()
+        call_command(
+            'symbolicate',
+            payloads,
+            workers=1,
+            output=output,
+            stdout=out,
+        )
+    assert 'failed' not in out.getvalue()
+    with open(output) as f:
+        result = json.loads(f.read())
+    assert result['knownModules'] == [True, True]
+
+    with pytest.raises(CommandError):
+        call_command('symbolicate', os.path.join(tmpdir, 'nothere.jsonl'))
+
+
+def test_parse_executor(tmpdir, metricsmock, settings):
+    settings.SYMBOLICATE_PARSE_TEMP_DIR = tmpdir
+    lines = [
+        b'MODULE windows x86 44E4EC8C2F41492B9369D6B9A059577C2 xul.pdb',
+        b'',
+        b'FUNC 26791a 592 4 XREMain::XRE_mainRun()',
+        b'26791a 2d 91 1',
+        'PUBLIC 10070 10 Ω::KiUserCallback'.encode('utf-8'),
+    ]
+    expected, expected_size = parse_symbol_table(lines)
+    path = os.path.join(tmpdir, 'xul.sym')
+    with open(path, 'wb') as f:
+        f.write(b'\n'.join(lines) + b'\n')
+    buffer, total_size, _ = parse_symbol_file(path)
+    assert buffer == expected.buffer
+    assert total_size == expected_size
+
+    executor = ParseExecutor(processes=1)
+    assert executor.enabled
+    try:
+        symbol_table, total_size, _, _ = executor.parse(iter(lines))
+        assert symbol_table.buffer == expected.buffer
+        assert total_size == expected_size
+        assert metricsmock.has_record(
+            GAUGE, 'tecken.symbolicate_parse_queue_depth', 1
+        )
+        assert metricsmock.has_record(
+            GAUGE, 'tecken.symbolicate_parse_queue_depth', 0
+        )
+        pool = executor._pool
+        content = b'\n'.join(lines) + b'\n'
+
+        def wait_for(condition):
+            for _ in range(100):
+                if condition():
+                    return
+                time.sleep(0.1)
+            raise AssertionError('Never happened')
+
+        # Reading a named pipe blocks till something is written to it.
+        # That's a slow parse.
+        settings.SYMBOLICATE_PARSE_TIMEOUT_SECONDS = 1
+        slow_path = os.path.join(tmpdir, 'slow.sym')
+        os.mkfifo(slow_path)
+        results = {}
+        slow = threading.Thread(target=lambda: results.update(
+            slow=executor.parse_file(slow_path)
+        ))
+        slow.start()
+        wait_for(lambda: os.path.exists(slow_path + LOCK_FILE_SUFFIX))
+        # This one waits in line, behind the slow one, for the only process
+        # for longer than the timeout. Only the slow one times out and is
+        # then parsed in this process instead.
+        fast = threading.Thread(target=lambda: results.update(
+            fast=executor.parse(iter(lines))
+        ))
+        fast.start()
+        wait_for(lambda: metricsmock.has_record(
+            INCR, 'tecken.symbolicate_parse_executor_timeout', 1
+        ))
+        time.sleep(1.5)
+        assert 'fast' not in results
+        with open(slow_path, 'wb') as f:
+            f.write(content)
+        slow.join(10)
+        fast.join(10)
+        assert results['fast'][0].buffer == expected.buffer
+        assert 'slow' in results
+        assert len(metricsmock.filter_records(
+            INCR, 'tecken.symbolicate_parse_executor_timeout'
+        )) == 1
+        assert executor._pool is pool
+
+        # If the process dies, it's parsed in this process instead. The
+        # pool starts a new process in its place.
+        died_path = os.path.join(tmpdir, 'died.sym')
+        os.mkfifo(died_path)
+        died = threading.Thread(target=lambda: results.update(
+            died=executor.parse_file(died_path)
+        ))
+        died.start()
+        wait_for(lambda: os.path.exists(died_path + LOCK_FILE_SUFFIX))
+        with open(died_path + LOCK_FILE_SUFFIX) as f:
+            os.kill(int(f.read()), signal.SIGKILL)
+        wait_for(lambda: metricsmock.has_record(
+            INCR, 'tecken.symbolicate_parse_executor_died', 1
+        ))
+        with open(died_path, 'wb') as f:
+            f.write(content)
+        died.join(10)
+        assert results['died'][0] == expected.buffer
+        symbol_table, _, _, _ = executor.parse(iter(lines))
+        assert symbol_table.buffer == expected.buffer
+        assert executor._pool is pool
+    finally:
+        executor.shutdown()
+
+    # If the pool is broken, it's parsed in this process instead.
+    executor._pool = mock.MagicMock()
+    executor._pool.apply_async.side_effect = RuntimeError('broken')
+    symbol_table, total_size, _, _ = executor.parse(iter(lines))
+    assert symbol_table.buffer == expected.buffer
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_parse_executor_error', 1
+    )
+    executor._pool = None
+    # The temporary files, and lock files, are cleaned up.
+    assert sorted(os.listdir(tmpdir)) == ['died.sym', 'slow.sym', 'xul.sym']
+    assert not ParseExecutor(processes=0).enabled
+
+
+def test_download_executor(metricsmock):
+    executor = DownloadExecutor(max_workers=1)
+    released = threading.Event()
+    calls = []
+
+    def download(value):
+        calls.append(value)
+        released.wait(10)
+        return value
+
+    future = executor.submit('a', download, 1)
+    # The same one is already in flight.
+    assert executor.submit('a', download, 2) is future
+    assert metricsmock.has_record(
+        INCR, 'tecken.symbolicate_download_deduplicated', 1
+    )
+    # Waits in line, behind 'a', for the one and only thread.
+    other = executor.submit('b', download, 3)
+    assert not other.done()
+    released.set()
+    assert future.result(10) == 1
+    assert other.result(10) == 3
+    assert calls == [1, 3]
+
+    # Once done, it's forgotten (by a callback that might run just after
+    # the result is out) and a new one is started.
+    for _ in range(50):
+        if not executor._in_flight:
+            break
+        time.sleep(0.1)
+    else:
+        raise AssertionError('Never forgotten')
+    assert executor.submit('a', download, 4).result(10) == 4
+
+
+def test_request_downloads():
+    executor = DownloadExecutor(max_workers=4)
+    downloads = RequestDownloads(executor, max_workers=1)
+    released = threading.Event()
+
+    def download(value):
+        released.wait(10)
+        if value is None:
+            raise ValueError('Nope')
+        return value
+
+    future = downloads.submit('a', download, 1)
+    failing = downloads.submit('b', download, None)
+    # Only one at a time, for this request, even with threads to spare.
+    assert list(executor._in_flight) == ['a']
+    assert not failing.done()
+    # Other requests aren't held up by it.
+    assert executor.submit('c', download, 3) is not future
+    assert set(executor._in_flight) == {'a', 'c'}
+    released.set()
+    assert future.result(10) == 1
+    with pytest.raises(ValueError):
+        failing.result(10)
+
+
+def test_symbolicate_v5_json_deduplicated_download_timings(
+    clear_redis_store,
+    botomock,
+):
+    reload_downloader('https://s3.example.com/public/prefix/')
+    symbol_key = ('xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2')
+    released = threading.Event()
+
+    def mock_api_call(self, operation_name, api_params):
+        released.wait(10)
+        return default_mock_api_call(self, operation_name, api_params)
+
+    with botomock(mock_api_call):
+        # Gives up right away. The download carries on in the background.
+        impatient = views.SymbolicateJSON(views.downloader)
+        (_, information), = impatient.load_symbols([symbol_key], timeout=0)
+        assert information['pending']
+        # Waits for that same download.
+        patient = views.SymbolicateJSON(views.downloader)
+        t = threading.Timer(0.2, released.set)
+        t.start()
+        (_, information), = patient.load_symbols([symbol_key], timeout=10)
+        t.join()
+    assert information['symbol_table']
+    assert 'stage_timings' not in information
+    # The time it took belongs to the one that waited for it, even though
+    # it didn't start it, and not to the one that gave up on it.
+    stages = [stage for stage, _ in patient.timings.items()]
+    assert stages == ['fetch', 'parse', 'store']
+    assert impatient.timings.items() == []
+
+
+def test_symbolicate_v5_json_parse_executor(
+    json_poster,
+    clear_redis_store,
+    botomock,
+    metricsmock,
+    settings,
+):
+    reload_downloader('https://s3.example.com/public/prefix/')
+    url = reverse('symbolicate:symbolicate_v5_json')
+    job = {
+        'stacks': [[[0, 11723767], [1, 65802]]],
+        'memoryMap': [
+            ['xul.pdb', '44E4EC8C2F41492B9369D6B9A059577C2'],
+            ['wntdll.pdb', 'D74F79EB1F8D4A45ABCD2F476CCABACC2'],
+        ],
+    }
+    with botomock(default_mock_api_call):
+        expected = json_poster(url, job).json()
+
+    settings.SYMBOLICATE_PARSE_PROCESSES = 2
+    caches['store'].clear()
+    symbol_table_cache.clear()
+    try:
+        with botomock(default_mock_api_call):
+            response = json_poster(url, job)
+    finally:
+        parse_executor.shutdown()
+    assert response.json() == expected
+    assert 'parse;dur=' in response['Server-Timing']
+    assert metricsmock.has_record(
+        TIMING, 'tecken.symbolicate_parse_executor_wait'
+    )